@@ -0,0 +1,169 @@
+"""
+bounded_cache
+职责：进程内有界缓存，替代长期运行服务中无限增长的全局字典。
+- 容量上限：超出时按最近最少使用（LRU）淘汰
+- 可选 TTL：过期条目在访问或写入时惰性清理
+- 可选保留规则：can_evict 返回 False 的条目（如运行中的任务）不参与淘汰
+- 命中、未命中、淘汰、过期计数，可通过 cache_stats() 运行时查询
+接口与 dict 保持一致（get/[]/in/len/pop/clear/update/copy），可直接替换原有字典。
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+
+_MISSING = object()
+
+
+class BoundedCache:
+    """
+    线程安全的 LRU + TTL 缓存；max_size<=0 表示不限容量，ttl<=0 表示不过期。
+    """
+    def __init__(
+        self,
+        name: str,
+        max_size: int,
+        ttl: float = 0.0,
+        can_evict: Optional[Callable[[object], bool]] = None,
+    ):
+        self.name = name
+        self.max_size = int(max_size)
+        self.ttl = float(ttl)
+        self._can_evict = can_evict
+        self._data: "OrderedDict[Hashable, Tuple[object, float]]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._last_sweep = time.monotonic()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def _evictable(self, value: object) -> bool:
+        return self._can_evict is None or bool(self._can_evict(value))
+
+    def _expired(self, stored_at: float, value: object, now: float) -> bool:
+        return self.ttl > 0 and now - stored_at >= self.ttl and self._evictable(value)
+
+    def _prune(self, force: bool = False) -> None:
+        now = time.monotonic()
+        # 全量过期扫描是 O(n)，写入时最多每 ttl/10 秒做一次
+        if self.ttl > 0 and (force or now - self._last_sweep >= max(1.0, self.ttl / 10)):
+            self._last_sweep = now
+            for key in [k for k, (v, at) in self._data.items() if self._expired(at, v, now)]:
+                del self._data[key]
+                self._counters["expirations"] += 1
+        if self.max_size <= 0:
+            return
+        overflow = len(self._data) - self.max_size
+        if overflow <= 0:
+            return
+        # 从最久未使用的一端逐个弹出，只访问被淘汰与受保护的条目，不复制整个键列表
+        pinned: List[Tuple[Hashable, Tuple[object, float]]] = []
+        while overflow > 0 and self._data:
+            key, item = self._data.popitem(last=False)
+            if self._evictable(item[0]):
+                self._counters["evictions"] += 1
+                overflow -= 1
+            else:
+                pinned.append((key, item))
+        # 受保护的条目放回原位置（最久未使用一端），保持相对顺序
+        for key, item in reversed(pinned):
+            self._data[key] = item
+            self._data.move_to_end(key, last=False)
+
+    def get(self, key: Hashable, default: object = None) -> object:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self._counters["misses"] += 1
+                return default
+            value, stored_at = item
+            if self._expired(stored_at, value, time.monotonic()):
+                del self._data[key]
+                self._counters["expirations"] += 1
+                self._counters["misses"] += 1
+                return default
+            self._data.move_to_end(key)
+            self._counters["hits"] += 1
+            return value
+
+    def __getitem__(self, key: Hashable) -> object:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: object) -> None:
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            self._prune()
+
+    def __delitem__(self, key: Hashable) -> None:
+        with self._lock:
+            del self._data[key]
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return False
+            return not self._expired(item[1], item[0], time.monotonic())
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        with self._lock:
+            return iter(list(self._data.keys()))
+
+    def keys(self) -> List[Hashable]:
+        with self._lock:
+            return list(self._data.keys())
+
+    def pop(self, key: Hashable, default: object = None) -> object:
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+            return default if item is _MISSING else item[0]
+
+    def update(self, values: Dict[Hashable, object]) -> None:
+        with self._lock:
+            for key, value in dict(values).items():
+                self[key] = value
+
+    def copy(self) -> Dict[Hashable, object]:
+        with self._lock:
+            return {k: v for k, (v, _) in self._data.items()}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            self._prune(force=True)
+            return {
+                "name": self.name,
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                **self._counters,
+            }
+
+
+_REGISTRY: Dict[str, BoundedCache] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def register_cache(cache: BoundedCache) -> BoundedCache:
+    with _REGISTRY_LOCK:
+        _REGISTRY[cache.name] = cache
+    return cache
+
+
+def cache_stats() -> Dict[str, Dict[str, object]]:
+    """
+    返回所有已注册缓存的容量与计数快照，用于监控内存占用与命中率。
+    """
+    with _REGISTRY_LOCK:
+        caches = list(_REGISTRY.values())
+    return {c.name: c.stats() for c in caches}
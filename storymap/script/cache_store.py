@@ -0,0 +1,464 @@
+"""
+cache_store
+职责：基于 SQLite 的本地持久化缓存层，供地理编码等模块在进程重启后复用结果。
+- 连接懒加载：首次读写时才打开数据库文件
+- WAL 模式 + busy timeout：支持多线程与多进程并发读写
+- 打开失败自动回退为内存库，缓存不可用不影响主流程
+依赖环境变量：STORY_MAP_CACHE_DIR（可选，默认 storymap/cache）
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+_MEMORY_PATH = ":memory:"
+_DISABLED_VALUES = {"0", "off", "false", "no", "none", "memory"}
+# SQLite 默认单条语句最多 999 个参数，批量查询按块拆分
+_BULK_CHUNK = 400
+
+_LOGGER = logging.getLogger("cache_store")
+
+
+def default_cache_dir() -> str:
+    custom = (os.getenv("STORY_MAP_CACHE_DIR") or "").strip()
+    if custom:
+        return os.path.abspath(custom)
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "cache"))
+
+
+def resolve_store_path(env_name: str, filename: str) -> str:
+    """
+    解析缓存库路径：环境变量优先；设为 off/0 等值时仅使用进程内内存库。
+    """
+    value = (os.getenv(env_name) or "").strip()
+    if value.lower() in _DISABLED_VALUES:
+        return _MEMORY_PATH
+    if value:
+        return os.path.abspath(value)
+    return os.path.join(default_cache_dir(), filename)
+
+
+class SqliteStore:
+    """
+    SQLite 存储基类：
+    - 子类通过 _SCHEMA 声明建表语句
+    - 单连接 + 可重入锁，保证同进程内多线程串行访问
+    - 所有数据库异常统一记录日志并降级为空结果
+    """
+    _SCHEMA: Tuple[str, ...] = ()
+    # 写入后的过期/超量清理每隔多少次写入执行一次（首次写入也执行，覆盖上次运行遗留的数据）
+    _PRUNE_EVERY = 100
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+        self._writes = 0
+
+    def _open(self, path: str) -> sqlite3.Connection:
+        if path != _MEMORY_PATH:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        if path != _MEMORY_PATH:
+            # WAL 允许读写并发，多进程共享同一缓存文件时不会互相阻塞读取
+            conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        for stmt in self._SCHEMA:
+            conn.execute(stmt)
+        return conn
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is not None:
+            return self._conn
+        try:
+            self._conn = self._open(self.path)
+        except (sqlite3.Error, OSError) as exc:
+            _LOGGER.warning("store_open_failed path=%s error=%s", self.path, exc)
+            self.path = _MEMORY_PATH
+            self._conn = self._open(_MEMORY_PATH)
+        return self._conn
+
+    def _query(self, sql: str, params: Sequence[object] = ()) -> List[tuple]:
+        with self._lock:
+            try:
+                return self._connect().execute(sql, params).fetchall()
+            except sqlite3.Error as exc:
+                _LOGGER.warning("store_query_failed path=%s error=%s", self.path, exc)
+                return []
+
+    def _execute(self, sql: str, params: Sequence[object] = ()) -> int:
+        with self._lock:
+            try:
+                return self._connect().execute(sql, params).rowcount
+            except sqlite3.Error as exc:
+                _LOGGER.warning("store_write_failed path=%s error=%s", self.path, exc)
+                return 0
+
+    def _executemany(self, sql: str, rows: Iterable[Sequence[object]]) -> int:
+        rows = list(rows)
+        if not rows:
+            return 0
+        with self._lock:
+            conn = self._connect()
+            try:
+                # 批量写入放在单个事务内，避免逐行提交的 fsync 开销
+                conn.execute("BEGIN")
+                changed = conn.executemany(sql, rows).rowcount
+                conn.execute("COMMIT")
+                return max(0, changed)
+            except sqlite3.Error as exc:
+                try:
+                    conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+                _LOGGER.warning("store_write_failed path=%s error=%s", self.path, exc)
+                return 0
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+    def _prune_due(self) -> bool:
+        """
+        记一次写入，到了清理周期时返回 True。
+        """
+        with self._lock:
+            self._writes += 1
+            return (self._writes - 1) % max(1, self._PRUNE_EVERY) == 0
+
+    def _trim(self, table: str, key: str, order: str, max_rows: int) -> int:
+        """
+        行数超过 max_rows 时按 order 列只保留最新的 max_rows 行，返回删除条数；未超出时只做一次计数。
+        """
+        rows = self._query(f"SELECT COUNT(*) FROM {table}")
+        if not rows or rows[0][0] <= max_rows:
+            return 0
+        return self._execute(
+            f"DELETE FROM {table} WHERE {key} NOT IN (SELECT {key} FROM {table} ORDER BY {order} DESC LIMIT ?)",
+            (int(max_rows),),
+        )
+
+
+class GeocodeStore(SqliteStore):
+    """
+    地理编码结果持久化：以（规范化地名, 候选查询串）为键，记录坐标、来源服务与写入时间。
+    """
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS geocode ("
+        " name TEXT NOT NULL,"
+        " candidate TEXT NOT NULL,"
+        " lat REAL NOT NULL,"
+        " lng REAL NOT NULL,"
+        " provider TEXT NOT NULL DEFAULT '',"
+        " updated_at REAL NOT NULL,"
+        " PRIMARY KEY (name, candidate))",
+        "CREATE INDEX IF NOT EXISTS idx_geocode_candidate ON geocode (candidate)",
+        "CREATE TABLE IF NOT EXISTS geocode_miss ("
+        " name TEXT PRIMARY KEY,"
+        " reasons TEXT NOT NULL DEFAULT '{}',"
+        " created_at REAL NOT NULL,"
+        " expires_at REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS geocode_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    )
+
+    def get(self, name: str) -> Optional[Dict[str, object]]:
+        if not name:
+            return None
+        rows = self._query(
+            "SELECT lat, lng, provider, updated_at FROM geocode"
+            " WHERE name = ? OR candidate = ? ORDER BY updated_at DESC LIMIT 1",
+            (name, name),
+        )
+        if not rows:
+            return None
+        lat, lng, provider, updated_at = rows[0]
+        return {"lat": lat, "lng": lng, "provider": provider, "updated_at": updated_at}
+
+    def get_many(self, names: Sequence[str]) -> Dict[str, Dict[str, object]]:
+        """
+        批量读取：单条 SQL 覆盖一组地名，返回 {地名: 最新记录}。
+        """
+        out: Dict[str, Dict[str, object]] = {}
+        wanted = set(n for n in names if n)
+        items = sorted(wanted)
+        for i in range(0, len(items), _BULK_CHUNK):
+            chunk = items[i : i + _BULK_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            rows = self._query(
+                f"SELECT name, candidate, lat, lng, provider, updated_at FROM geocode"
+                f" WHERE name IN ({marks}) OR candidate IN ({marks})",
+                (*chunk, *chunk),
+            )
+            for name, candidate, lat, lng, provider, updated_at in rows:
+                row = {"lat": lat, "lng": lng, "provider": provider, "updated_at": updated_at}
+                for key in (name, candidate):
+                    if key in wanted and (key not in out or out[key]["updated_at"] < updated_at):
+                        out[key] = row
+        return out
+
+    def put(self, name: str, candidate: str, coord: Tuple[float, float], provider: str = "") -> None:
+        if not name or not coord:
+            return
+        self._execute(
+            "INSERT OR REPLACE INTO geocode (name, candidate, lat, lng, provider, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (name, candidate or name, float(coord[0]), float(coord[1]), provider or "", time.time()),
+        )
+
+    def put_many(self, items: Dict[str, Tuple[float, float]], provider: str = "") -> int:
+        """
+        批量写入（单事务）；已有记录保持不变，返回实际新增条数。
+        """
+        now = time.time()
+        return self._executemany(
+            "INSERT OR IGNORE INTO geocode (name, candidate, lat, lng, provider, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (name, name, float(coord[0]), float(coord[1]), provider or "", now)
+                for name, coord in items.items()
+                if name and coord
+            ],
+        )
+
+    def get_meta(self, key: str) -> str:
+        rows = self._query("SELECT value FROM geocode_meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else ""
+
+    def set_meta(self, key: str, value: str) -> None:
+        self._execute("INSERT OR REPLACE INTO geocode_meta (key, value) VALUES (?, ?)", (key, value))
+
+    def rows_for_providers(self, providers: Sequence[str]) -> List[Tuple[str, str, float, float]]:
+        if not providers:
+            return []
+        marks = ",".join("?" * len(providers))
+        return self._query(
+            f"SELECT name, candidate, lat, lng FROM geocode WHERE provider IN ({marks})", tuple(providers)
+        )
+
+    def update_coords(self, rows: Iterable[Tuple[str, str, float, float]]) -> int:
+        """
+        批量改写坐标，rows 为 (name, candidate, lat, lng)。
+        """
+        return self._executemany(
+            "UPDATE geocode SET lat = ?, lng = ? WHERE name = ? AND candidate = ?",
+            [(lat, lng, name, candidate) for name, candidate, lat, lng in rows],
+        )
+
+    def get_miss(self, name: str) -> Optional[Dict[str, object]]:
+        """
+        读取未过期的失败记录；过期记录视为不存在。
+        """
+        if not name:
+            return None
+        rows = self._query(
+            "SELECT name, reasons, created_at, expires_at FROM geocode_miss WHERE name = ? AND expires_at > ?",
+            (name, time.time()),
+        )
+        return self._miss_row(rows[0]) if rows else None
+
+    def get_misses(self, names: Sequence[str]) -> Dict[str, Dict[str, object]]:
+        out: Dict[str, Dict[str, object]] = {}
+        items = sorted(set(n for n in names if n))
+        now = time.time()
+        for i in range(0, len(items), _BULK_CHUNK):
+            chunk = items[i : i + _BULK_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            rows = self._query(
+                f"SELECT name, reasons, created_at, expires_at FROM geocode_miss"
+                f" WHERE name IN ({marks}) AND expires_at > ?",
+                (*chunk, now),
+            )
+            for row in rows:
+                out[row[0]] = self._miss_row(row)
+        return out
+
+    def put_miss(self, name: str, reasons: Dict[str, List[str]], ttl: float) -> None:
+        """
+        写入失败记录，并按清理周期删除已过期的记录。
+        """
+        if not name or ttl <= 0:
+            return
+        now = time.time()
+        self._execute(
+            "INSERT OR REPLACE INTO geocode_miss (name, reasons, created_at, expires_at) VALUES (?, ?, ?, ?)",
+            (name, json.dumps(reasons or {}, ensure_ascii=False), now, now + ttl),
+        )
+        if self._prune_due():
+            self._execute("DELETE FROM geocode_miss WHERE expires_at <= ?", (now,))
+
+    def list_misses(self, limit: int = 100) -> List[Dict[str, object]]:
+        rows = self._query(
+            "SELECT name, reasons, created_at, expires_at FROM geocode_miss"
+            " WHERE expires_at > ? ORDER BY created_at DESC LIMIT ?",
+            (time.time(), max(0, int(limit))),
+        )
+        return [self._miss_row(row) for row in rows]
+
+    def clear_misses(self, name: Optional[str] = None) -> int:
+        """
+        清除指定地名（或全部）的失败记录，顺带清理已过期条目。
+        """
+        self._execute("DELETE FROM geocode_miss WHERE expires_at <= ?", (time.time(),))
+        if name:
+            return self._execute("DELETE FROM geocode_miss WHERE name = ?", (name,))
+        return self._execute("DELETE FROM geocode_miss")
+
+    @staticmethod
+    def _miss_row(row: tuple) -> Dict[str, object]:
+        name, reasons, created_at, expires_at = row
+        try:
+            parsed = json.loads(reasons or "{}")
+        except ValueError:
+            parsed = {}
+        return {"name": name, "reasons": parsed, "created_at": created_at, "expires_at": expires_at}
+
+
+class ProfileStore(SqliteStore):
+    """
+    人物页数据持久化：以 Markdown 内容摘要为键保存构建好的 profile（JSON），进程重启后直接复用。
+    """
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS profile ("
+        " digest TEXT PRIMARY KEY,"
+        " payload TEXT NOT NULL,"
+        " updated_at REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_profile_updated ON profile (updated_at)",
+    )
+
+    def get(self, digest: str) -> Optional[Dict[str, object]]:
+        if not digest:
+            return None
+        rows = self._query("SELECT payload FROM profile WHERE digest = ?", (digest,))
+        if not rows:
+            return None
+        try:
+            payload = json.loads(rows[0][0])
+        except ValueError:
+            return None
+        return payload if isinstance(payload, dict) else None
+
+    def put(self, digest: str, profile: Dict[str, object], max_rows: int = 0) -> None:
+        """
+        写入 profile；max_rows > 0 时按清理周期只保留最近写入的 max_rows 条（两次清理之间可短暂超出）。
+        """
+        if not digest or not profile:
+            return
+        self._execute(
+            "INSERT OR REPLACE INTO profile (digest, payload, updated_at) VALUES (?, ?, ?)",
+            (digest, json.dumps(profile, ensure_ascii=False), time.time()),
+        )
+        if max_rows > 0 and self._prune_due():
+            self._trim("profile", "digest", "updated_at", max_rows)
+
+
+class SplitStore(SqliteStore):
+    """
+    古今地名拆解结果持久化：以（规范化地点文本, 模型 ID, 提示词版本）为键，模型或提示词变化后旧记录不再读取。
+    同一文件可能被使用不同模型的多个进程共享，其他版本的记录只在长期未写入后清理。
+    """
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS place_split ("
+        " text TEXT NOT NULL,"
+        " model TEXT NOT NULL,"
+        " prompt TEXT NOT NULL,"
+        " ancient TEXT NOT NULL DEFAULT '',"
+        " modern TEXT NOT NULL DEFAULT '',"
+        " updated_at REAL NOT NULL,"
+        " PRIMARY KEY (text, model, prompt))",
+    )
+
+    def load(self, model: str, prompt: str, limit: int = 0) -> Dict[str, Tuple[str, str]]:
+        """
+        读取当前模型与提示词版本下的全部记录（limit > 0 时只取最近写入的 limit 条）。
+        """
+        sql = "SELECT text, ancient, modern FROM place_split WHERE model = ? AND prompt = ? ORDER BY updated_at DESC"
+        params: Tuple[object, ...] = (model, prompt)
+        if limit > 0:
+            sql += " LIMIT ?"
+            params += (int(limit),)
+        return {text: (ancient, modern) for text, ancient, modern in self._query(sql, params)}
+
+    def get_many(self, texts: Sequence[str], model: str, prompt: str) -> Dict[str, Tuple[str, str]]:
+        """
+        按文本批量读取当前模型与提示词版本下的记录，未收录的文本不出现在结果中。
+        """
+        out: Dict[str, Tuple[str, str]] = {}
+        items = sorted(set(t for t in texts if t))
+        for i in range(0, len(items), _BULK_CHUNK):
+            chunk = items[i : i + _BULK_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            rows = self._query(
+                f"SELECT text, ancient, modern FROM place_split"
+                f" WHERE model = ? AND prompt = ? AND text IN ({marks})",
+                (model, prompt, *chunk),
+            )
+            for text, ancient, modern in rows:
+                out[text] = (ancient, modern)
+        return out
+
+    def put_many(self, items: Dict[str, Tuple[str, str]], model: str, prompt: str) -> int:
+        now = time.time()
+        return self._executemany(
+            "INSERT OR REPLACE INTO place_split (text, model, prompt, ancient, modern, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            [(text, model, prompt, a, m, now) for text, (a, m) in items.items() if text],
+        )
+
+    def purge_stale(self, model: str, prompt: str, max_age: float) -> int:
+        """
+        删除其他模型或提示词版本下超过 max_age 秒未写入的记录，返回删除条数；max_age <= 0 时不清理。
+        """
+        if max_age <= 0:
+            return 0
+        return self._execute(
+            "DELETE FROM place_split WHERE (model != ? OR prompt != ?) AND updated_at < ?",
+            (model, prompt, time.time() - max_age),
+        )
+
+
+class LlmResponseStore(SqliteStore):
+    """
+    模型响应持久化：以请求内容摘要为键保存响应文本，读取时按 TTL 判断是否过期。
+    """
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS llm_response ("
+        " key TEXT PRIMARY KEY,"
+        " content TEXT NOT NULL,"
+        " created_at REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_llm_response_created ON llm_response (created_at)",
+    )
+
+    def get(self, key: str, ttl: float = 0) -> Optional[str]:
+        rows = self._query("SELECT content, created_at FROM llm_response WHERE key = ?", (key,))
+        if not rows:
+            return None
+        content, created_at = rows[0]
+        if ttl > 0 and time.time() - created_at >= ttl:
+            return None
+        return content
+
+    def put(self, key: str, content: str, ttl: float = 0, max_rows: int = 0) -> None:
+        """
+        写入响应，并按清理周期删除过期记录；max_rows > 0 时只保留最近写入的 max_rows 条。
+        过期记录在读取时已按 TTL 判断，清理只为回收空间。
+        """
+        if not key or not content:
+            return
+        now = time.time()
+        self._execute(
+            "INSERT OR REPLACE INTO llm_response (key, content, created_at) VALUES (?, ?, ?)",
+            (key, content, now),
+        )
+        if not self._prune_due():
+            return
+        if ttl > 0:
+            self._execute("DELETE FROM llm_response WHERE created_at <= ?", (now - ttl,))
+        if max_rows > 0:
+            self._trim("llm_response", "key", "created_at", max_rows)
@@ -0,0 +1,120 @@
+"""
+coord_transform
+职责：WGS84 与 GCJ-02（国测局坐标）互转，统一不同地理编码来源的坐标系。
+- 高德/QVeris 结果为 GCJ-02；Nominatim、maps.co、Photon 等公共服务返回 WGS84
+- 地图与缓存统一使用 GCJ-02；GeoJSON 等标准导出格式使用 WGS84
+- 国内范围外的坐标原样返回（GCJ-02 偏移只在国内生效）
+- 安装 NumPy 时整组坐标一次向量化转换；未安装时逐点计算，结果一致
+"""
+import math
+from typing import List, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 为可选依赖
+    np = None
+
+
+Coord = Tuple[float, float]
+
+_AXIS = 6378245.0
+_EE = 0.00669342162296594323
+# GCJ-02 偏移生效的经纬度范围
+_CHINA_LNG = (72.004, 137.8347)
+_CHINA_LAT = (0.8293, 55.8271)
+# GCJ-02 → WGS84 没有解析逆变换，迭代三轮即可收敛到厘米级
+_INVERSE_ROUNDS = 3
+
+
+def in_china(lat: float, lng: float) -> bool:
+    return _CHINA_LAT[0] <= lat <= _CHINA_LAT[1] and _CHINA_LNG[0] <= lng <= _CHINA_LNG[1]
+
+
+def _offset(lat, lng, lib):
+    """
+    计算 WGS84 → GCJ-02 的纬度、经度偏移量；lib 为 math（标量）或 numpy（数组）。
+    """
+    x = lng - 105.0
+    y = lat - 35.0
+    pi = lib.pi
+    common = (20.0 * lib.sin(6.0 * x * pi) + 20.0 * lib.sin(2.0 * x * pi)) * 2.0 / 3.0
+    d_lat = -100.0 + 2.0 * x + 3.0 * y + 0.2 * y * y + 0.1 * x * y + 0.2 * lib.sqrt(abs(x))
+    d_lat = d_lat + common
+    d_lat = d_lat + (20.0 * lib.sin(y * pi) + 40.0 * lib.sin(y / 3.0 * pi)) * 2.0 / 3.0
+    d_lat = d_lat + (160.0 * lib.sin(y / 12.0 * pi) + 320.0 * lib.sin(y * pi / 30.0)) * 2.0 / 3.0
+    d_lng = 300.0 + x + 2.0 * y + 0.1 * x * x + 0.1 * x * y + 0.1 * lib.sqrt(abs(x))
+    d_lng = d_lng + common
+    d_lng = d_lng + (20.0 * lib.sin(x * pi) + 40.0 * lib.sin(x / 3.0 * pi)) * 2.0 / 3.0
+    d_lng = d_lng + (150.0 * lib.sin(x / 12.0 * pi) + 300.0 * lib.sin(x / 30.0 * pi)) * 2.0 / 3.0
+    rad_lat = lat / 180.0 * pi
+    magic = 1 - _EE * lib.sin(rad_lat) ** 2
+    sqrt_magic = lib.sqrt(magic)
+    d_lat = (d_lat * 180.0) / ((_AXIS * (1 - _EE)) / (magic * sqrt_magic) * pi)
+    d_lng = (d_lng * 180.0) / (_AXIS / sqrt_magic * lib.cos(rad_lat) * pi)
+    return d_lat, d_lng
+
+
+def _np_in_china(lat, lng):
+    return (lat >= _CHINA_LAT[0]) & (lat <= _CHINA_LAT[1]) & (lng >= _CHINA_LNG[0]) & (lng <= _CHINA_LNG[1])
+
+
+def _np_to_gcj(lat, lng):
+    d_lat, d_lng = _offset(lat, lng, np)
+    mask = _np_in_china(lat, lng)
+    return np.where(mask, lat + d_lat, lat), np.where(mask, lng + d_lng, lng)
+
+
+def _split(coords: Sequence[Coord]):
+    arr = np.asarray(coords, dtype=float).reshape(-1, 2)
+    return arr[:, 0], arr[:, 1]
+
+
+def _join(lat, lng) -> List[Coord]:
+    return list(zip(lat.tolist(), lng.tolist()))
+
+
+def wgs84_to_gcj02(coords: Sequence[Coord]) -> List[Coord]:
+    """
+    批量 WGS84 → GCJ-02，输入输出均为 [(纬度, 经度), ...]。
+    """
+    if not coords:
+        return []
+    if np is not None:
+        return _join(*_np_to_gcj(*_split(coords)))
+    out: List[Coord] = []
+    for lat, lng in coords:
+        if in_china(lat, lng):
+            d_lat, d_lng = _offset(lat, lng, math)
+            out.append((lat + d_lat, lng + d_lng))
+        else:
+            out.append((lat, lng))
+    return out
+
+
+def gcj02_to_wgs84(coords: Sequence[Coord]) -> List[Coord]:
+    """
+    批量 GCJ-02 → WGS84（迭代逼近），输入输出均为 [(纬度, 经度), ...]。
+    """
+    if not coords:
+        return []
+    if np is not None:
+        lat, lng = _split(coords)
+        w_lat, w_lng = lat.copy(), lng.copy()
+        for _ in range(_INVERSE_ROUNDS):
+            g_lat, g_lng = _np_to_gcj(w_lat, w_lng)
+            w_lat = w_lat - (g_lat - lat)
+            w_lng = w_lng - (g_lng - lng)
+        mask = _np_in_china(lat, lng)
+        return _join(np.where(mask, w_lat, lat), np.where(mask, w_lng, lng))
+    out: List[Coord] = []
+    for lat, lng in coords:
+        if not in_china(lat, lng):
+            out.append((lat, lng))
+            continue
+        w_lat, w_lng = lat, lng
+        for _ in range(_INVERSE_ROUNDS):
+            (g_lat, g_lng), = wgs84_to_gcj02([(w_lat, w_lng)])
+            w_lat -= g_lat - lat
+            w_lng -= g_lng - lng
+        out.append((w_lat, w_lng))
+    return out
@@ -0,0 +1,156 @@
+"""
+copresence
+职责：多人物“同时同地”分析，找出同一时期到过同一地点的人物组合（如 184 年前后涿郡的刘备、关羽、张飞）。
+- 时间解析：把地点的 time（公元纪年/时间）文本归一为闭区间年份，公元前记为负数
+- 空间：复用 spatial_index 的地点聚类（规范化地名 + 半径邻近）
+- 时间：每个地点组建一棵区间树，按区间端点切分时间段并做点查询，避免人物两两比较
+"""
+import re
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from spatial_index import cluster_places, collect_places, default_radius_km, describe_group, person_names
+
+
+Interval = Tuple[int, int]
+
+_YEAR_RE = re.compile(r"(公元前|前)?\s*(\d{1,4})\s*(?:年|(?=\s*[-—–~～至到]))")
+
+
+def parse_year_interval(text: object) -> Optional[Interval]:
+    """
+    “约184年-200年”“公元192年—195年”“前206年”“184-188年”等文本转为 (起始年, 结束年)；无法识别时返回 None。
+    """
+    if not text:
+        return None
+    years: List[int] = []
+    for m in _YEAR_RE.finditer(str(text)):
+        year = int(m.group(2))
+        if year == 0:
+            continue
+        years.append(-year if m.group(1) else year)
+    if not years:
+        return None
+    return min(years), max(years)
+
+
+def format_year(year: int) -> str:
+    return f"前{-year}年" if year < 0 else f"{year}年"
+
+
+def format_interval(start: int, end: int) -> str:
+    if start == end:
+        return format_year(start)
+    return f"{format_year(start)}—{format_year(end)}"
+
+
+class _Node(NamedTuple):
+    center: int
+    by_start: List[Tuple[int, int, int]]
+    by_end: List[Tuple[int, int, int]]
+    left: Optional["_Node"]
+    right: Optional["_Node"]
+
+
+class IntervalTree:
+    """
+    静态中心区间树：区间为闭区间 [start, end]，stab(t) 返回覆盖时刻 t 的全部区间编号。
+    构建 O(n log n)，单次查询 O(log n + k)。
+    """
+    def __init__(self, intervals: Sequence[Interval]):
+        items = [(s, e, i) for i, (s, e) in enumerate(intervals)]
+        self._root = self._build(items)
+        self.size = len(items)
+
+    def _build(self, items: List[Tuple[int, int, int]]) -> Optional[_Node]:
+        if not items:
+            return None
+        points = sorted(p for s, e, _ in items for p in (s, e))
+        center = points[len(points) // 2]
+        left = [it for it in items if it[1] < center]
+        right = [it for it in items if it[0] > center]
+        mid = [it for it in items if it[0] <= center <= it[1]]
+        return _Node(
+            center,
+            sorted(mid, key=lambda it: it[0]),
+            sorted(mid, key=lambda it: -it[1]),
+            self._build(left),
+            self._build(right),
+        )
+
+    def stab(self, t: int) -> List[int]:
+        out: List[int] = []
+        node = self._root
+        while node is not None:
+            if t < node.center:
+                for s, _, i in node.by_start:
+                    if s > t:
+                        break
+                    out.append(i)
+                node = node.left
+            elif t > node.center:
+                for _, e, i in node.by_end:
+                    if e < t:
+                        break
+                    out.append(i)
+                node = node.right
+            else:
+                out.extend(i for _, _, i in node.by_start)
+                break
+        return out
+
+
+def _co_present_spans(intervals: List[Interval], owners: List[int]) -> List[Tuple[int, int, Tuple[int, ...]]]:
+    """
+    以区间端点切分时间轴，返回在场人物不少于两人的时间段 (起, 止, 人物序号)；相邻且人物相同的时间段合并。
+    """
+    tree = IntervalTree(intervals)
+    bounds = sorted({s for s, _ in intervals} | {e + 1 for _, e in intervals})
+    spans: List[Tuple[int, int, Tuple[int, ...]]] = []
+    for lo, hi in zip(bounds, bounds[1:]):
+        present = tuple(sorted({owners[i] for i in tree.stab(lo)}))
+        if len(present) < 2:
+            continue
+        if spans and spans[-1][1] == lo - 1 and spans[-1][2] == present:
+            spans[-1] = (spans[-1][0], hi - 1, present)
+        else:
+            spans.append((lo, hi - 1, present))
+    return spans
+
+
+def find_copresence(
+    people: List[Dict[str, object]], radius_km: Optional[float] = None
+) -> List[Dict[str, object]]:
+    """
+    返回同时同地事件，按起始年份排序：
+    {name, names, lat, lng, spread_km, start, end, period, count, persons}；缺少可解析时间的地点不参与。
+    """
+    radius = default_radius_km() if radius_km is None else radius_km
+    points = collect_places(people)
+    names = person_names(people)
+    out: List[Dict[str, object]] = []
+    for members in cluster_places(points, radius):
+        timed = []
+        for i in members:
+            interval = parse_year_interval(points[i].loc.get("time"))
+            if interval:
+                timed.append((i, interval))
+        if len({points[i].person for i, _ in timed}) < 2:
+            continue
+        spans = _co_present_spans([iv for _, iv in timed], [points[i].person for i, _ in timed])
+        if not spans:
+            continue
+        place = describe_group(points, members)
+        for start, end, present in spans:
+            entry = dict(place)
+            entry.update(
+                {
+                    "start": start,
+                    "end": end,
+                    "period": format_interval(start, end),
+                    "count": len(present),
+                    "persons": [names[p] for p in present],
+                }
+            )
+            out.append(entry)
+    out.sort(key=lambda x: (x["start"], -x["count"], x["name"]))
+    return out
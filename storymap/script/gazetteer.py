@@ -0,0 +1,189 @@
+"""
+gazetteer
+职责：内置离线地名库，常见古今中国地名直接得到 GCJ-02 坐标，无需外部地理编码调用。
+- 数据文件：storymap/data/gazetteer.tsv（名称、纬度、经度、层级、今地名、上级地名）
+- 首次查询时整体加载为字典，之后查询为纯内存操作
+- 查询时兼容“许昌市”“河南省”等带行政区划后缀的写法
+依赖环境变量：STORY_MAP_GAZETTEER（可选，自定义地名库路径；设为 off 时关闭）
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import unicodedata
+from typing import Dict, List, NamedTuple, Optional
+
+
+_DISABLED_VALUES = {"0", "off", "false", "no", "none"}
+_ADMIN_SUFFIXES = (
+    "特别行政区",
+    "维吾尔自治区",
+    "壮族自治区",
+    "回族自治区",
+    "自治区",
+    "省",
+    "市",
+    "县",
+    "区",
+)
+_PAREN_CONTENT_RE = re.compile(r"[（(].*?[)）]")
+# 市/县/区 后缀不指向省级条目（“吉林市”不是吉林省），直辖市除外
+_SUB_PROVINCE_SUFFIXES = ("市", "县", "区")
+_MUNICIPALITIES = frozenset({"北京", "天津", "上海", "重庆"})
+
+_LOGGER = logging.getLogger("gazetteer")
+
+
+class GazetteerEntry(NamedTuple):
+    name: str
+    lat: float
+    lng: float
+    level: str
+    modern: str
+    parent: str
+
+
+_ENTRIES: Optional[Dict[str, GazetteerEntry]] = None
+_ENTRIES_LOCK = threading.Lock()
+_VERSION: Optional[tuple] = None
+
+
+def default_gazetteer_path() -> str:
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "data", "gazetteer.tsv"))
+
+
+def normalize_place_name(text: str) -> str:
+    """
+    统一写法：全角转半角，去掉括注与空白。
+    """
+    value = unicodedata.normalize("NFKC", str(text or ""))
+    value = _PAREN_CONTENT_RE.sub("", value)
+    return re.sub(r"\s+", "", value)
+
+
+def strip_admin_suffix(text: str) -> str:
+    """
+    去掉末尾的行政区划后缀（省/市/县/区/自治区等），剩余不足两个字时保持原样。
+    """
+    for suffix in _ADMIN_SUFFIXES:
+        if text.endswith(suffix) and len(text) - len(suffix) >= 2:
+            return text[: -len(suffix)]
+    return text
+
+
+def suffix_fits(entry: GazetteerEntry, suffix: str) -> bool:
+    """
+    去掉的行政区划后缀是否与条目层级相符：省级条目（直辖市除外）不接受市/县/区。
+    """
+    if entry.level != "province" or entry.name in _MUNICIPALITIES:
+        return True
+    return suffix not in _SUB_PROVINCE_SUFFIXES
+
+
+def _parse_line(line: str) -> Optional[GazetteerEntry]:
+    parts = line.rstrip("\r\n").split("\t")
+    if len(parts) < 3 or not parts[0].strip() or parts[0].startswith("#"):
+        return None
+    parts += [""] * (6 - len(parts))
+    try:
+        lat, lng = float(parts[1]), float(parts[2])
+    except ValueError:
+        return None
+    return GazetteerEntry(
+        name=parts[0].strip(),
+        lat=lat,
+        lng=lng,
+        level=parts[3].strip(),
+        modern=parts[4].strip(),
+        parent=parts[5].strip(),
+    )
+
+
+def load_gazetteer(path: Optional[str] = None) -> Dict[str, GazetteerEntry]:
+    """
+    读取地名库文件，返回 {查询键: 条目}；同一条目同时以原名与去后缀名建立索引。
+    文件不存在或无法读取时返回空字典。
+    """
+    entries: Dict[str, GazetteerEntry] = {}
+    target = path or default_gazetteer_path()
+    try:
+        with open(target, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+    except OSError as exc:
+        _LOGGER.warning("gazetteer_load_failed path=%s error=%s", target, exc)
+        return entries
+    for line in lines:
+        entry = _parse_line(line)
+        if entry is None:
+            continue
+        key = normalize_place_name(entry.name)
+        # 原名优先：避免“涿县”去后缀后覆盖已有的同名条目
+        entries[key] = entry
+        entries.setdefault(strip_admin_suffix(key), entry)
+    return entries
+
+
+def gazetteer_table() -> Dict[str, GazetteerEntry]:
+    """
+    返回当前加载的 {查询键: 条目} 字典；重新加载后为新对象，索引据此判断是否需要重建。
+    """
+    global _ENTRIES
+    if _ENTRIES is None:
+        with _ENTRIES_LOCK:
+            if _ENTRIES is None:
+                value = (os.getenv("STORY_MAP_GAZETTEER") or "").strip()
+                if value.lower() in _DISABLED_VALUES:
+                    _ENTRIES = {}
+                else:
+                    _ENTRIES = load_gazetteer(os.path.abspath(value) if value else None)
+    return _ENTRIES
+
+
+def lookup_place(name: str) -> Optional[GazetteerEntry]:
+    """
+    精确查询地名库：先按原文，再按去掉行政区划后缀的写法（后缀须与条目层级相符）；未收录时返回 None。
+    """
+    key = normalize_place_name(name)
+    if not key:
+        return None
+    entries = gazetteer_table()
+    entry = entries.get(key)
+    if entry is None:
+        short = strip_admin_suffix(key)
+        entry = entries.get(short)
+        if entry is not None and not suffix_fits(entry, key[len(short):]):
+            return None
+    return entry
+
+
+def gazetteer_entries() -> List[GazetteerEntry]:
+    """
+    返回去重后的全部条目（按文件顺序），供索引构建与预热使用。
+    """
+    seen = set()
+    out: List[GazetteerEntry] = []
+    for entry in gazetteer_table().values():
+        if entry.name not in seen:
+            seen.add(entry.name)
+            out.append(entry)
+    return out
+
+
+def gazetteer_version() -> str:
+    """
+    当前地名库内容的短摘要；地名库文件更换或修改后随之变化，供派生缓存判断是否失效。
+    """
+    global _VERSION
+    table = gazetteer_table()
+    cached = _VERSION
+    if cached is None or cached[0] is not table:
+        digest = hashlib.sha1(repr(gazetteer_entries()).encode("utf-8")).hexdigest()[:12]
+        cached = _VERSION = (table, digest)
+    return cached[1]
+
+
+def reset_gazetteer() -> None:
+    global _ENTRIES
+    with _ENTRIES_LOCK:
+        _ENTRIES = None
@@ -0,0 +1,115 @@
+"""
+geo_distance
+职责：批量球面距离计算（Haversine），供路线统计、导出与交集分析复用。
+- 输入为 [(纬度, 经度), ...] 坐标序列，单位公里
+- 安装 NumPy 时整段坐标一次向量化计算；未安装时回退为纯 Python 实现，结果一致
+- 返回值均为 Python 原生 list/float，可直接写入 JSON
+"""
+import math
+from typing import List, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 为可选依赖
+    np = None
+
+
+EARTH_RADIUS_KM = 6371.0
+
+Coord = Tuple[float, float]
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    两点间大圆距离（公里）。
+    """
+    d_lat = math.radians(lat2 - lat1)
+    d_lon = math.radians(lon2 - lon1)
+    a = math.sin(d_lat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(d_lon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _as_radians(coords: Sequence[Coord]):
+    arr = np.radians(np.asarray(coords, dtype=float).reshape(-1, 2))
+    return arr[:, 0], arr[:, 1]
+
+
+def _np_haversine(lat1, lon1, lat2, lon2):
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+def segment_lengths_km(coords: Sequence[Coord]) -> List[float]:
+    """
+    相邻两点的距离，长度为 len(coords) - 1。
+    """
+    if len(coords) < 2:
+        return []
+    if np is not None:
+        lat, lon = _as_radians(coords)
+        return _np_haversine(lat[:-1], lon[:-1], lat[1:], lon[1:]).tolist()
+    return [
+        haversine_km(coords[i][0], coords[i][1], coords[i + 1][0], coords[i + 1][1])
+        for i in range(len(coords) - 1)
+    ]
+
+
+def cumulative_km(coords: Sequence[Coord]) -> List[float]:
+    """
+    从起点到每个点的累计距离，首项为 0，长度与 coords 相同。
+    """
+    if not coords:
+        return []
+    segments = segment_lengths_km(coords)
+    if np is not None and segments:
+        return [0.0] + np.cumsum(segments).tolist()
+    out = [0.0]
+    for seg in segments:
+        out.append(out[-1] + seg)
+    return out
+
+
+def path_length_km(coords: Sequence[Coord]) -> float:
+    """
+    沿坐标顺序的折线总长度。
+    """
+    return float(sum(segment_lengths_km(coords)))
+
+
+def pairwise_km(coords: Sequence[Coord]) -> List[List[float]]:
+    """
+    全部点两两之间的距离矩阵（n × n，对称，对角线为 0）。
+    """
+    n = len(coords)
+    if n == 0:
+        return []
+    if np is not None:
+        lat, lon = _as_radians(coords)
+        return _np_haversine(lat[:, None], lon[:, None], lat[None, :], lon[None, :]).tolist()
+    matrix = [[0.0] * n for _ in range(n)]
+    for i in range(n):
+        for j in range(i + 1, n):
+            d = haversine_km(coords[i][0], coords[i][1], coords[j][0], coords[j][1])
+            matrix[i][j] = d
+            matrix[j][i] = d
+    return matrix
+
+
+def spread_km(coords: Sequence[Coord]) -> float:
+    """
+    点集内最远两点的距离，用于衡量同名地点的坐标离散程度。
+    """
+    if len(coords) < 2:
+        return 0.0
+    return float(max(max(row) for row in pairwise_km(coords)))
+
+
+def centroid(coords: Sequence[Coord]) -> Coord:
+    """
+    点集的算术平均中心；地点间距较小（同一城市/区域）时足够精确。
+    """
+    if not coords:
+        raise ValueError("coords is empty")
+    lat = sum(c[0] for c in coords) / len(coords)
+    lng = sum(c[1] for c in coords) / len(coords)
+    return lat, lng
@@ -0,0 +1,211 @@
+"""
+http_pool
+职责：线程安全的 HTTP/HTTPS 连接池，复用 keep-alive 连接，避免每次请求重复 TCP/TLS 握手。
+- 按 (scheme, host, port) 维护空闲连接，空闲超时后丢弃
+- 每个主机限制最大并发连接数，超出时排队等待
+- 复用的连接若已被服务端关闭，自动换新连接重试一次
+- 跟随 301/302/303/307/308 重定向（与 urlopen 一致：303 及 POST 的 301/302 改为 GET）
+- 目标主机需经 HTTP(S)_PROXY 代理（未被 NO_PROXY 排除）时改用 urlopen，不走连接池
+依赖环境变量：STORY_MAP_HTTP_POOL_SIZE（可选，每主机连接上限，默认 4）
+"""
+import http.client
+import os
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+
+_RETRYABLE_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+_HostKey = Tuple[str, str, int]
+
+_REDIRECT_CODES = (301, 302, 303, 307, 308)
+_MAX_REDIRECTS = 5
+
+
+class TooManyRedirects(RuntimeError):
+    pass
+
+
+def _uses_proxy(scheme: str, host: str) -> bool:
+    """
+    按环境变量判断该主机是否需要经代理访问（每次读取，环境变化即时生效）。
+    """
+    return bool(urllib.request.getproxies().get(scheme)) and not urllib.request.proxy_bypass(host)
+
+
+class HttpConnectionPool:
+    """
+    轻量连接池：
+    - request 返回 (状态码, 响应体)，网络异常原样抛出由调用方处理
+    - 连接在响应读取完毕且服务端未要求关闭时归还池中
+    """
+    def __init__(self, max_per_host: int = 4, idle_timeout: float = 60.0):
+        self.max_per_host = max(1, int(max_per_host))
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._idle: Dict[_HostKey, List[Tuple[http.client.HTTPConnection, float]]] = {}
+        self._slots: Dict[_HostKey, threading.BoundedSemaphore] = {}
+        self._ssl_context = ssl.create_default_context()
+        self._stats = {"created": 0, "reused": 0, "discarded": 0, "proxied": 0, "redirects": 0}
+
+    def _slot(self, key: _HostKey) -> threading.BoundedSemaphore:
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.max_per_host)
+                self._slots[key] = slot
+            return slot
+
+    def _checkout(self, key: _HostKey, timeout: float) -> Tuple[http.client.HTTPConnection, bool]:
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(key) or []
+            while idle:
+                conn, released_at = idle.pop()
+                if now - released_at <= self.idle_timeout:
+                    self._stats["reused"] += 1
+                    return conn, True
+                self._stats["discarded"] += 1
+                conn.close()
+            self._stats["created"] += 1
+        scheme, host, port = key
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(host, port, timeout=timeout, context=self._ssl_context)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        return conn, False
+
+    def _checkin(self, key: _HostKey, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            self._idle.setdefault(key, []).append((conn, time.monotonic()))
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        body: Optional[bytes] = None,
+        timeout: float = 20,
+    ) -> Tuple[int, bytes]:
+        """
+        发送请求并返回最终响应的 (状态码, 响应体)；重定向超过 _MAX_REDIRECTS 次时抛出 TooManyRedirects。
+        """
+        for _ in range(_MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            scheme = (parts.scheme or "http").lower()
+            if _uses_proxy(scheme, parts.hostname or ""):
+                # urlopen 自行处理代理与重定向
+                return self._request_via_urlopen(method, url, headers, body, timeout)
+            status, data, location = self._request_once(method, url, headers, body, timeout)
+            if status not in _REDIRECT_CODES or not location:
+                return status, data
+            with self._lock:
+                self._stats["redirects"] += 1
+            url = urljoin(url, location)
+            if status == 303 or (status in (301, 302) and method.upper() == "POST"):
+                method, body = "GET", None
+                headers = {k: v for k, v in (headers or {}).items() if k.lower() != "content-type"}
+        raise TooManyRedirects(f"too many redirects url={url}")
+
+    def _request_via_urlopen(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict[str, str]],
+        body: Optional[bytes],
+        timeout: float,
+    ) -> Tuple[int, bytes]:
+        with self._lock:
+            self._stats["proxied"] += 1
+        req = urllib.request.Request(url, data=body, headers=headers or {}, method=method)
+        try:
+            # 每次新建 opener：全局 urlopen 会缓存首次调用时的代理设置
+            with urllib.request.build_opener().open(req, timeout=timeout) as resp:
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as exc:
+            return exc.code, exc.read()
+
+    def _request_once(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict[str, str]],
+        body: Optional[bytes],
+        timeout: float,
+    ) -> Tuple[int, bytes, Optional[str]]:
+        parts = urlsplit(url)
+        scheme = (parts.scheme or "http").lower()
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname or "", port)
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        slot = self._slot(key)
+        if not slot.acquire(timeout=timeout):
+            raise TimeoutError(f"connection pool exhausted host={key[1]}")
+        try:
+            for attempt in range(2):
+                conn, reused = self._checkout(key, timeout)
+                try:
+                    conn.timeout = timeout
+                    if conn.sock is not None:
+                        conn.sock.settimeout(timeout)
+                    conn.request(method, path, body=body, headers=headers or {})
+                    resp = conn.getresponse()
+                    data = resp.read()
+                except _RETRYABLE_ERRORS:
+                    conn.close()
+                    # 仅复用连接允许重试：服务端可能已关闭空闲连接
+                    if reused and attempt == 0:
+                        continue
+                    raise
+                except Exception:
+                    conn.close()
+                    raise
+                if resp.will_close:
+                    conn.close()
+                else:
+                    self._checkin(key, conn)
+                return resp.status, data, resp.getheader("Location")
+            raise http.client.RemoteDisconnected("connection closed")
+        finally:
+            slot.release()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            idle = sum(len(items) for items in self._idle.values())
+            return {**self._stats, "idle": idle, "hosts": len(self._slots)}
+
+    def close(self) -> None:
+        with self._lock:
+            for items in self._idle.values():
+                for conn, _ in items:
+                    conn.close()
+            self._idle.clear()
+
+
+_DEFAULT_POOL: Optional[HttpConnectionPool] = None
+_DEFAULT_POOL_LOCK = threading.Lock()
+
+
+def get_default_pool() -> HttpConnectionPool:
+    """
+    进程级共享连接池，首次调用时按环境变量创建。
+    """
+    global _DEFAULT_POOL
+    if _DEFAULT_POOL is None:
+        with _DEFAULT_POOL_LOCK:
+            if _DEFAULT_POOL is None:
+                size = int(os.getenv("STORY_MAP_HTTP_POOL_SIZE", "4"))
+                _DEFAULT_POOL = HttpConnectionPool(max_per_host=size)
+    return _DEFAULT_POOL
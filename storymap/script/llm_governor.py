@@ -0,0 +1,349 @@
+"""
+llm_governor
+职责：进程内所有模型调用共用的调度器，统一控制人物抽取、生平生成、古今地名拆解与前端代理等调用点。
+- 在途上限：同时进行中的模型请求不超过 max_in_flight，同步线程与 asyncio 协程共用同一份名额
+- 令牌预算：按 60 秒滑动窗口统计 token 用量，请求前按提示词长度预扣，完成后按实际用量修正
+- 优先级通道：interactive（前端代理）> generate（人物抽取、生平生成）> batch（古今地名拆解）；
+  名额空出时高优先级先得，同一通道先到先得；队首请求放不进预算时后面的请求也不越过它
+- 排队统计：每次调用记录排队耗时，按通道汇总次数、平均/最大等待与超时次数
+- 退避：重试等待为带抖动的指数退避；上游返回 429 时按 Retry-After 暂停全部通道，避免重试风暴
+依赖环境变量：
+- LLM_MAX_CONCURRENCY（可选，在途请求上限，默认 4）
+- LLM_TOKENS_PER_MINUTE（可选，每分钟 token 预算，默认 0 表示不限）
+- LLM_QUEUE_MAX_WAIT（可选，单次排队最长秒数，超出抛出 LlmQueueTimeout，默认 300）
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+
+INTERACTIVE = "interactive"
+GENERATE = "generate"
+BATCH = "batch"
+# 数值越小优先级越高
+LANES: Dict[str, int] = {INTERACTIVE: 0, GENERATE: 1, BATCH: 2}
+
+# 等待中的请求定期重新检查令牌窗口与暂停状态，避免依赖释放事件才被唤醒
+_POLL_INTERVAL = 0.5
+_CJK_RE = re.compile(r"[\u3000-\u9fff\uff00-\uffef]")
+
+_LOGGER = logging.getLogger("llm_governor")
+
+
+class LlmQueueTimeout(RuntimeError):
+    pass
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算 token 数：中日韩字符按 1 个计，其余字符按 4 个 1 token 计。
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_message_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(estimate_tokens(str(m.get("content") or "")) + 4 for m in messages or [])
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    """
+    第 attempt 次失败后的重试等待：指数上限内均匀抖动（full jitter），并发失败的请求不会同时重试。
+    """
+    ceiling = min(cap, base * (2 ** max(0, attempt - 1)))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+class Ticket:
+    """
+    一次获准的调用：release 时归还名额并按实际用量修正令牌预算。
+    """
+    __slots__ = ("lane", "tokens", "wait", "granted_at", "released", "usage")
+
+    def __init__(self, lane: str, tokens: int, wait: float, usage: Optional[List] = None):
+        self.lane = lane
+        self.tokens = tokens
+        self.wait = wait
+        self.usage = usage
+        self.granted_at = time.monotonic()
+        self.released = False
+
+
+class _Waiter:
+    __slots__ = ("lane", "tokens", "enqueued", "granted", "cancelled", "event", "loop", "future", "usage")
+
+    def __init__(self, lane: str, tokens: int):
+        self.lane = lane
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.cancelled = False
+        self.event: Optional[threading.Event] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.future: Optional[asyncio.Future] = None
+        self.usage: Optional[List] = None
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(True)
+
+
+class LlmGovernor:
+    """
+    在途上限 + 令牌预算 + 优先级队列。acquire/acquire_async 获准后返回 Ticket，调用结束后必须 release。
+    """
+    def __init__(
+        self,
+        max_in_flight: int = 4,
+        tokens_per_minute: int = 0,
+        max_wait: float = 300.0,
+        window: float = 60.0,
+    ):
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.tokens_per_minute = max(0, int(tokens_per_minute))
+        self.max_wait = float(max_wait)
+        self.window = float(window)
+        self._lock = threading.Lock()
+        self._queue: List[Tuple[int, int, _Waiter]] = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        # 每条用量为 [时刻, 令牌数]，预扣记录在 release 时原地修正
+        self._usage: Deque[List] = deque()
+        self._used = 0
+        self._paused_until = 0.0
+        self._stats = {
+            lane: {"calls": 0, "queued": 0, "timeouts": 0, "wait_total": 0.0, "wait_max": 0.0, "tokens": 0}
+            for lane in LANES
+        }
+
+    # ---- 预算与调度（调用方持有 self._lock） ----
+
+    def _expire_usage(self, now: float) -> None:
+        while self._usage and now - self._usage[0][0] >= self.window:
+            self._used -= self._usage.popleft()[1]
+
+    def _fits(self, tokens: int, now: float) -> bool:
+        if self.tokens_per_minute <= 0:
+            return True
+        self._expire_usage(now)
+        # 窗口内没有用量时总是放行，单个超出预算的请求不会永远排不上
+        return self._used <= 0 or self._used + tokens <= self.tokens_per_minute
+
+    def _charge(self, tokens: int, now: float) -> Optional[List]:
+        if not tokens:
+            return None
+        entry = [now, tokens]
+        self._usage.append(entry)
+        self._used += tokens
+        return entry
+
+    def _dispatch(self) -> None:
+        now = time.monotonic()
+        if now < self._paused_until:
+            return
+        while self._queue and self._in_flight < self.max_in_flight:
+            waiter = self._queue[0][2]
+            if waiter.cancelled:
+                heapq.heappop(self._queue)
+                continue
+            if not self._fits(waiter.tokens, now):
+                break
+            heapq.heappop(self._queue)
+            self._stats[waiter.lane]["queued"] -= 1
+            if waiter.loop is not None:
+                try:
+                    waiter.loop.call_soon_threadsafe(_resolve, waiter.future)
+                except RuntimeError:
+                    # 事件循环已关闭，等待方不会再取走名额
+                    waiter.cancelled = True
+                    continue
+            self._in_flight += 1
+            waiter.usage = self._charge(waiter.tokens, now)
+            waiter.granted = True
+            if waiter.event is not None:
+                waiter.event.set()
+
+    def _enqueue(self, lane: str, tokens: int) -> _Waiter:
+        if lane not in LANES:
+            raise ValueError(f"unknown lane: {lane}")
+        waiter = _Waiter(lane, max(0, int(tokens)))
+        heapq.heappush(self._queue, (LANES[lane], next(self._seq), waiter))
+        self._stats[lane]["queued"] += 1
+        return waiter
+
+    def _abandon(self, waiter: _Waiter, timed_out: bool = True) -> bool:
+        """
+        排队超时或被取消；返回 False 表示在放弃前已获准，调用方应照常使用名额。
+        """
+        if waiter.granted:
+            return False
+        waiter.cancelled = True
+        self._stats[waiter.lane]["queued"] -= 1
+        if timed_out:
+            self._stats[waiter.lane]["timeouts"] += 1
+        return True
+
+    def _ticket(self, waiter: _Waiter) -> Ticket:
+        wait = time.monotonic() - waiter.enqueued
+        stats = self._stats[waiter.lane]
+        stats["calls"] += 1
+        stats["wait_total"] += wait
+        stats["wait_max"] = max(stats["wait_max"], wait)
+        return Ticket(waiter.lane, waiter.tokens, wait, waiter.usage)
+
+    # ---- 对外接口 ----
+
+    def acquire(self, lane: str = GENERATE, tokens: int = 0, max_wait: Optional[float] = None) -> Ticket:
+        deadline = time.monotonic() + (self.max_wait if max_wait is None else max_wait)
+        with self._lock:
+            waiter = self._enqueue(lane, tokens)
+            waiter.event = threading.Event()
+            self._dispatch()
+        while not waiter.event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                with self._lock:
+                    if self._abandon(waiter):
+                        raise LlmQueueTimeout(f"模型请求排队超时（通道 {lane}）")
+                break
+            waiter.event.wait(min(_POLL_INTERVAL, remaining))
+            with self._lock:
+                self._dispatch()
+        with self._lock:
+            return self._ticket(waiter)
+
+    async def acquire_async(self, lane: str = GENERATE, tokens: int = 0, max_wait: Optional[float] = None) -> Ticket:
+        """
+        协程版 acquire：排队期间只挂起当前协程，不占用线程。
+        """
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + (self.max_wait if max_wait is None else max_wait)
+        with self._lock:
+            waiter = self._enqueue(lane, tokens)
+            waiter.loop = loop
+            waiter.future = loop.create_future()
+            self._dispatch()
+        try:
+            while not waiter.future.done():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self._lock:
+                        if self._abandon(waiter):
+                            raise LlmQueueTimeout(f"模型请求排队超时（通道 {lane}）")
+                    break
+                await asyncio.wait({waiter.future}, timeout=min(_POLL_INTERVAL, remaining))
+                with self._lock:
+                    self._dispatch()
+        except asyncio.CancelledError:
+            with self._lock:
+                if not self._abandon(waiter, timed_out=False):
+                    self._release_locked(self._ticket(waiter), None)
+            raise
+        with self._lock:
+            return self._ticket(waiter)
+
+    def _release_locked(self, ticket: Ticket, used_tokens: Optional[int]) -> None:
+        if ticket.released:
+            return
+        ticket.released = True
+        self._in_flight -= 1
+        if used_tokens is not None and self.tokens_per_minute > 0:
+            self._correct_usage(ticket, max(0, int(used_tokens)))
+        self._stats[ticket.lane]["tokens"] += ticket.tokens if used_tokens is None else int(used_tokens)
+        self._dispatch()
+
+    def _correct_usage(self, ticket: Ticket, used_tokens: int) -> None:
+        """
+        按实际用量修正预扣：预扣记录仍在窗口内时原地改写，不另记负数条目
+        （负数条目比预扣活得久，过期后窗口用量会变成负数而超发）。
+        """
+        now = time.monotonic()
+        self._expire_usage(now)
+        entry = ticket.usage
+        if entry is not None and now - entry[0] < self.window:
+            self._used += used_tokens - entry[1]
+            entry[1] = used_tokens
+        elif entry is None or used_tokens > ticket.tokens:
+            # 没有预扣记录或预扣已过期：只补记超出预扣的部分
+            self._charge(used_tokens - (0 if entry is None else ticket.tokens), now)
+
+    def release(self, ticket: Ticket, used_tokens: Optional[int] = None) -> None:
+        """
+        归还名额；used_tokens 为本次调用实际消耗（提示词 + 输出），为空时按预扣值计。
+        """
+        with self._lock:
+            self._release_locked(ticket, used_tokens)
+        _LOGGER.info(
+            "llm_call lane=%s wait_ms=%s duration_ms=%s tokens=%s",
+            ticket.lane,
+            int(ticket.wait * 1000),
+            int((time.monotonic() - ticket.granted_at) * 1000),
+            ticket.tokens if used_tokens is None else used_tokens,
+        )
+
+    def pause(self, seconds: float) -> None:
+        """
+        上游限流时暂停放行新请求 seconds 秒，已在途的请求不受影响。
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + max(0.0, seconds))
+        _LOGGER.warning("llm_governor_paused seconds=%s", round(seconds, 2))
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            now = time.monotonic()
+            self._expire_usage(now)
+            lanes = {}
+            for lane, stats in self._stats.items():
+                calls = stats["calls"]
+                lanes[lane] = {
+                    "calls": calls,
+                    "queued": stats["queued"],
+                    "timeouts": stats["timeouts"],
+                    "wait_avg_ms": int(stats["wait_total"] / calls * 1000) if calls else 0,
+                    "wait_max_ms": int(stats["wait_max"] * 1000),
+                    "tokens": stats["tokens"],
+                }
+            return {
+                "max_in_flight": self.max_in_flight,
+                "in_flight": self._in_flight,
+                "tokens_per_minute": self.tokens_per_minute,
+                "tokens_in_window": max(0, self._used),
+                "paused_for": round(max(0.0, self._paused_until - now), 2),
+                "lanes": lanes,
+            }
+
+
+_GOVERNOR: Optional[LlmGovernor] = None
+_GOVERNOR_LOCK = threading.Lock()
+
+
+def get_governor() -> LlmGovernor:
+    global _GOVERNOR
+    if _GOVERNOR is None:
+        with _GOVERNOR_LOCK:
+            if _GOVERNOR is None:
+                _GOVERNOR = LlmGovernor(
+                    max_in_flight=int(os.getenv("LLM_MAX_CONCURRENCY", "4")),
+                    tokens_per_minute=int(os.getenv("LLM_TOKENS_PER_MINUTE", "0")),
+                    max_wait=float(os.getenv("LLM_QUEUE_MAX_WAIT", "300")),
+                )
+    return _GOVERNOR
+
+
+def governor_status() -> Dict[str, object]:
+    """
+    返回调度器快照，用于监控。
+    """
+    return get_governor().snapshot()
@@ -1,53 +1,240 @@
 """
 map_client
 职责：与地图与地理计算相关的通用能力层，供 story_map 集成调用。
-- 地理编码：优先通过 QVeris 接入的高德工具，失败回退 OSM（并做 WGS84→GCJ-02 转换）
-- 距离计算：本地 Haversine
+- 地理编码：优先通过 QVeris 接入的高德工具，失败回退 OSM（并做 WGS84→GCJ-02 转换，见 coord_transform）
+- 离线地名库：常见古今地名直接查内置 gazetteer，无需外呼（见 gazetteer）；“荆州麦城”等组合地名经前缀树解析（见 place_index）
+- 地理编码缓存：进程内字典 + SQLite 持久化（见 cache_store），重启后重复地名无需外呼
+- 服务保护：每个地理编码服务独立限流与熔断（见 provider_guard）
+- 距离计算：本地 Haversine，批量向量化（见 geo_distance）
 - 地图渲染：通过 QVeris 提供的高德地图渲染接口生成 HTML 片段
-依赖环境变量：QVERIS_API_URL/QVERIS_BASE_URL、QVERIS_API_KEY（可选）
+依赖环境变量：QVERIS_API_URL/QVERIS_BASE_URL、QVERIS_API_KEY（可选）、STORY_MAP_GEOCODE_DB（可选）、STORY_MAP_GEOCODE_CACHE_SIZE（可选）
 """
 import json
 import logging
 import os
 import re
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Dict, Iterable, List, Optional, Tuple
+import unicodedata
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
 from urllib.parse import quote
-from urllib.request import Request, urlopen
 
+from bounded_cache import BoundedCache, register_cache
+from cache_store import GeocodeStore, resolve_store_path
+from coord_transform import wgs84_to_gcj02
 from dotenv import load_dotenv
+from geo_distance import path_length_km
+from http_pool import get_default_pool
+from md_document import parse_markdown
+from gazetteer import gazetteer_version
+from place_index import resolve_place
+from provider_guard import get_guard, provider_status
 
 
 _DEFAULT_USER_AGENT = "map-story/1.0"
-_TABLE_SEPARATOR_RE = re.compile(r"^\|\s*-{3,}\s*\|")
 _PAREN_CONTENT_RE = re.compile(r"[（(].*?[)）]")
 _GEOCODE_ENDPOINTS = [
-    ("https://nominatim.openstreetmap.org/search?format=json&limit=1&q={}", "list"),
-    ("https://geocode.maps.co/search?q={}", "list"),
-    ("https://photon.komoot.io/api/?limit=1&q={}", "photon"),
+    ("https://nominatim.openstreetmap.org/search?format=json&limit=1&q={}", "list", "nominatim"),
+    ("https://geocode.maps.co/search?q={}", "list", "mapsco"),
+    ("https://photon.komoot.io/api/?limit=1&q={}", "photon", "photon"),
 ]
 
+_PUBLIC_PROVIDERS = tuple(provider for _, _, provider in _GEOCODE_ENDPOINTS)
+# 缓存库坐标系版本：公共服务结果已统一转换为 GCJ-02
+_COORD_SYSTEM = "gcj02"
+
 _LOGGER = logging.getLogger("map_client")
 if not _LOGGER.handlers:
     logging.basicConfig(level=logging.INFO)
 
-_GEOCODE_CACHE: Dict[str, Tuple[float, float]] = {}
+# 进程内一级缓存按 LRU 限制条目数，完整结果仍保存在磁盘缓存中
+_GEOCODE_CACHE = register_cache(
+    BoundedCache("geocode", int(os.getenv("STORY_MAP_GEOCODE_CACHE_SIZE", "10000")))
+)
 _GEOCODE_CACHE_LOCK = threading.Lock()
+_GEOCODE_STORE: Optional[GeocodeStore] = None
+_GEOCODE_STORE_LOCK = threading.Lock()
+# 失败记录默认保留 7 天；仅网络异常导致的失败只保留 10 分钟，避免短暂故障被长期记住
+_QVERIS_GEOCODE_PARAMS = ("address", "keywords", "q")
+# 竞速模式：QVeris 各参数形式与首个公共回退同时发起，取最先通过校验的结果
+_GEOCODE_HEDGE = (os.getenv("STORY_MAP_GEOCODE_HEDGE") or "").strip().lower() in {"1", "true", "yes", "on"}
+_HEDGE_EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix="geocode-hedge")
+# 高德地理编码批量模式单次最多 10 个地址
+_QVERIS_BATCH_SIZE = 10
+_GEOCODE_INFLIGHT: Dict[str, Future] = {}
+_GEOCODE_INFLIGHT_LOCK = threading.Lock()
+_GEOCODE_MISS_TTL = float(os.getenv("STORY_MAP_GEOCODE_MISS_TTL", str(7 * 24 * 3600)))
+_GEOCODE_TRANSIENT_MISS_TTL = 600.0
+
+
+def _normalize_place_key(name: str) -> str:
+    """
+    统一缓存键：全角转半角并折叠空白，避免同一地名因书写差异重复编码。
+    """
+    text = unicodedata.normalize("NFKC", str(name or ""))
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _get_geocode_store() -> GeocodeStore:
+    """
+    懒加载持久化缓存，首次访问时才打开 SQLite 文件。
+    """
+    global _GEOCODE_STORE
+    if _GEOCODE_STORE is None:
+        with _GEOCODE_STORE_LOCK:
+            if _GEOCODE_STORE is None:
+                store = GeocodeStore(resolve_store_path("STORY_MAP_GEOCODE_DB", "geocode.sqlite3"))
+                _migrate_public_coords(store)
+                _GEOCODE_STORE = store
+    return _GEOCODE_STORE
+
+
+def _migrate_public_coords(store: GeocodeStore) -> int:
+    """
+    早期版本把公共服务的 WGS84 坐标原样写入缓存；首次打开旧库时批量转换为 GCJ-02，只执行一次。
+    """
+    if store.get_meta("coord_system") == _COORD_SYSTEM:
+        return 0
+    rows = store.rows_for_providers(_PUBLIC_PROVIDERS)
+    converted = wgs84_to_gcj02([(float(r[2]), float(r[3])) for r in rows])
+    changed = store.update_coords(
+        [(r[0], r[1], lat, lng) for r, (lat, lng) in zip(rows, converted)]
+    )
+    store.set_meta("coord_system", _COORD_SYSTEM)
+    if changed:
+        _LOGGER.info("geocode_store_migrated rows=%s coord_system=%s", changed, _COORD_SYSTEM)
+    return changed
 
 
 def _geocode_cache_get(name: str) -> Optional[Tuple[float, float]]:
-    if not name:
+    key = _normalize_place_key(name)
+    if not key:
+        return None
+    with _GEOCODE_CACHE_LOCK:
+        cached = _GEOCODE_CACHE.get(key)
+    if cached:
+        return cached
+    # 内存未命中再查磁盘缓存，命中后回填内存
+    row = _get_geocode_store().get(key)
+    if not row:
         return None
+    coord = (float(row["lat"]), float(row["lng"]))
+    with _GEOCODE_CACHE_LOCK:
+        _GEOCODE_CACHE[key] = coord
+    return coord
+
+
+def _geocode_cache_get_many(keys: List[str]) -> Dict[str, Tuple[float, float]]:
+    """
+    批量查询缓存：先查内存，剩余键用一次磁盘查询补齐并回填内存。
+    """
+    found: Dict[str, Tuple[float, float]] = {}
+    with _GEOCODE_CACHE_LOCK:
+        for key in keys:
+            cached = _GEOCODE_CACHE.get(key)
+            if cached:
+                found[key] = cached
+    rest = [k for k in keys if k not in found]
+    if not rest:
+        return found
+    rows = _get_geocode_store().get_many(rest)
     with _GEOCODE_CACHE_LOCK:
-        return _GEOCODE_CACHE.get(name)
+        for key, row in rows.items():
+            coord = (float(row["lat"]), float(row["lng"]))
+            _GEOCODE_CACHE[key] = coord
+            found[key] = coord
+    return found
 
 
-def _geocode_cache_set(name: str, coord: Tuple[float, float]) -> None:
-    if not name or not coord:
+def _geocode_cache_set(
+    name: str, coord: Tuple[float, float], candidate: str = "", provider: str = ""
+) -> None:
+    key = _normalize_place_key(name)
+    if not key or not coord:
         return
+    cand_key = _normalize_place_key(candidate) or key
     with _GEOCODE_CACHE_LOCK:
-        _GEOCODE_CACHE[name] = coord
+        _GEOCODE_CACHE[key] = coord
+        _GEOCODE_CACHE[cand_key] = coord
+    _get_geocode_store().put(key, cand_key, coord, provider)
+
+
+def _single_flight(key: str, fn: Callable[[], Optional[Tuple[float, float]]]) -> Optional[Tuple[float, float]]:
+    """
+    同一键的并发调用只执行一次 fn，其余调用方等待同一个 Future 的结果。
+    """
+    with _GEOCODE_INFLIGHT_LOCK:
+        future = _GEOCODE_INFLIGHT.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _GEOCODE_INFLIGHT[key] = future
+    if not leader:
+        return future.result()
+    try:
+        result = fn()
+    except BaseException as exc:
+        with _GEOCODE_INFLIGHT_LOCK:
+            _GEOCODE_INFLIGHT.pop(key, None)
+        future.set_exception(exc)
+        raise
+    with _GEOCODE_INFLIGHT_LOCK:
+        _GEOCODE_INFLIGHT.pop(key, None)
+    future.set_result(result)
+    return result
+
+
+def _note_geocode_failure(reasons: Optional[Dict[str, List[str]]], provider: str, reason: str) -> None:
+    if reasons is None:
+        return
+    items = reasons.setdefault(provider, [])
+    if reason not in items:
+        items.append(reason)
+
+
+def _geocode_miss_get(name: str) -> Optional[Dict[str, object]]:
+    key = _normalize_place_key(name)
+    if not key or _GEOCODE_MISS_TTL <= 0:
+        return None
+    return _get_geocode_store().get_miss(key)
+
+
+def _geocode_miss_set(name: str, reasons: Dict[str, List[str]]) -> None:
+    key = _normalize_place_key(name)
+    if not key or _GEOCODE_MISS_TTL <= 0:
+        return
+    definitive = any(r in ("no_result", "outside_china") for items in reasons.values() for r in items)
+    ttl = _GEOCODE_MISS_TTL if definitive else min(_GEOCODE_MISS_TTL, _GEOCODE_TRANSIENT_MISS_TTL)
+    _get_geocode_store().put_miss(key, reasons, ttl)
+
+
+def geocode_provider_status() -> Dict[str, Dict[str, object]]:
+    """
+    查看各地理编码服务的熔断状态、限流速率与调用计数。
+    """
+    return provider_status()
+
+
+def geocode_data_version() -> str:
+    """
+    地理编码结果的版本标识（坐标系 + 离线地名库摘要），二者任一变化时依赖坐标的缓存应失效。
+    """
+    return f"{_COORD_SYSTEM}:{gazetteer_version()}"
+
+
+def list_geocode_misses(limit: int = 100) -> List[Dict[str, object]]:
+    """
+    查看当前生效的地理编码失败记录（含各服务的失败原因与过期时间）。
+    """
+    return _get_geocode_store().list_misses(limit=limit)
+
+
+def clear_geocode_misses(name: Optional[str] = None) -> int:
+    """
+    清除失败记录；指定 name 时仅清除该地名，返回删除条数。
+    """
+    key = _normalize_place_key(name) if name else None
+    return _get_geocode_store().clear_misses(key)
 
 
 def _project_root() -> str:
@@ -59,16 +246,25 @@ load_dotenv(dotenv_path=local_env)
 load_dotenv(dotenv_path=os.path.join(_project_root(), ".env"))
 
 
+def _http_request_json(
+    method: str, url: str, headers: Dict[str, str], body: Optional[bytes] = None
+) -> object:
+    """
+    通过共享连接池发送请求并解析 JSON；HTTP 错误状态与网络异常直接抛出。
+    """
+    status, data = get_default_pool().request(method, url, headers=headers, body=body, timeout=20)
+    if status >= 400:
+        raise RuntimeError(f"HTTP {status}")
+    return json.loads(data.decode("utf-8", errors="ignore"))
+
+
 def _http_post_json(url: str, headers: Dict[str, str], body: Dict[str, object]) -> Optional[object]:
     """
     使用 POST 请求发送 JSON，并返回解析后的 JSON 对象。
     任何网络或解析异常统一回退为 None，避免上层调用中断。
     """
     try:
-        req = Request(url, headers=headers, data=json.dumps(body).encode("utf-8"), method="POST")
-        with urlopen(req, timeout=20) as resp:
-            data = resp.read()
-            return json.loads(data.decode("utf-8", errors="ignore"))
+        return _http_request_json("POST", url, headers, json.dumps(body).encode("utf-8"))
     except Exception as exc:
         _LOGGER.warning("http_post_failed url=%s error=%s", url, exc)
         return None
@@ -145,6 +341,20 @@ def _extract_latlon(value: object) -> Optional[Tuple[float, float]]:
     return None
 
 
+class QVerisUnavailable(RuntimeError):
+    """
+    QVeris 调用未取得响应：reason 为 error（网络/HTTP 异常）、circuit_open 或 rate_limited，
+    与“有响应但无结果”（no_result）区分，失败记录据此只短期保留。
+    """
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def _qveris_failure(exc: Exception) -> str:
+    return exc.reason if isinstance(exc, QVerisUnavailable) else f"error: {exc}"
+
+
 class QVerisClient:
     """
     QVeris 的轻量调用器：
@@ -157,14 +367,24 @@ class QVerisClient:
 
     def _execute(self, tool_id: str, parameters: Dict[str, object]) -> Optional[object]:
         """
-        调用 QVeris 工具执行接口，返回 data 字段或原始数据。
+        调用 QVeris 工具执行接口，返回 data 字段或原始数据；
+        熔断跳过、限流跳过或网络/HTTP 异常时抛出 QVerisUnavailable。
         """
         if not tool_id:
             return None
+        guard = get_guard("qveris")
+        skipped = guard.before_call()
+        if skipped:
+            raise QVerisUnavailable(skipped)
         url = f"{self.api_url}/tools/execute?tool_id={tool_id}"
         headers = {"Content-Type": "application/json", "Authorization": f"Bearer {self.api_key}"}
         body = {"parameters": parameters, "max_response_size": 20480}
         data = _http_post_json(url, headers, body)
+        # _http_post_json 仅在网络/HTTP 异常时返回 None，计入熔断失败
+        if data is None:
+            guard.record_failure()
+            raise QVerisUnavailable("error")
+        guard.record_success()
         if not isinstance(data, dict):
             return None
         result = data.get("result")
@@ -178,17 +398,32 @@ class QVerisClient:
         使用 QVeris 的地理编码工具解析地点坐标。
         兼容 address / keywords / q 三种参数形式。
         """
+        for param in _QVERIS_GEOCODE_PARAMS:
+            res = self.geocode_variant(name, param)
+            if res:
+                return res
+        return None
+
+    def geocode_variant(self, name: str, param: str) -> Optional[Tuple[float, float]]:
+        """
+        仅使用指定参数名（address / keywords / q）发起一次地理编码。
+        """
         tool_id = os.getenv("QVERIS_GEOCODE_TOOL_ID") or "amap_webservice.geocode.geo.retrieve.v3"
-        payload = self._execute(tool_id, {"address": name})
-        res = _extract_latlon(payload)
-        if res:
-            return res
-        payload = self._execute(tool_id, {"keywords": name})
-        res = _extract_latlon(payload)
-        if res:
-            return res
-        payload = self._execute(tool_id, {"q": name})
-        return _extract_latlon(payload)
+        return _extract_latlon(self._execute(tool_id, {param: name}))
+
+    def geocode_batch(self, names: List[str]) -> List[Optional[Tuple[float, float]]]:
+        """
+        使用高德地理编码的批量模式（batch=true，地址以 | 分隔）一次解析多个地点。
+        返回与输入等长的列表；响应条数对不上时整体视为失败，交由逐条查询兜底。
+        """
+        if not names:
+            return []
+        tool_id = os.getenv("QVERIS_GEOCODE_TOOL_ID") or "amap_webservice.geocode.geo.retrieve.v3"
+        payload = self._execute(tool_id, {"address": "|".join(names), "batch": "true"})
+        geocodes = payload.get("geocodes") if isinstance(payload, dict) else payload
+        if not isinstance(geocodes, list) or len(geocodes) != len(names):
+            return [None] * len(names)
+        return [_extract_latlon(item) if item else None for item in geocodes]
 
 def _is_valid_coord(lat: object, lon: object) -> bool:
     try:
@@ -292,53 +527,82 @@ def _build_geocode_candidates(name: str) -> List[str]:
     return out
 
 
-def _geocode_nominatim(name: str, force_cn: bool = False) -> Optional[Tuple[float, float]]:
+def _geocode_public(
+    name: str,
+    force_cn: bool = False,
+    reasons: Optional[Dict[str, List[str]]] = None,
+    cancel: Optional[threading.Event] = None,
+) -> Optional[Tuple[Tuple[float, float], str]]:
     """
-    公共地理编码回退链路：
+    公共地理编码回退链路，返回 (坐标, 服务名)，失败原因按服务写入 reasons：
     - nominatim.openstreetmap.org
     - geocode.maps.co
     - photon.komoot.io
+    cancel 被置位后不再尝试后续服务（竞速模式下已有其他结果胜出）。
     """
     if not name:
         return None
     country_param = "&countrycodes=cn" if force_cn else ""
     mapsco_key = (os.getenv("MAPSCO_API_KEY") or "").strip()
-    for url_tpl, kind in _GEOCODE_ENDPOINTS:
+    for url_tpl, kind, provider in _GEOCODE_ENDPOINTS:
+        if cancel is not None and cancel.is_set():
+            return None
+        if provider == "mapsco" and not mapsco_key:
+            _note_geocode_failure(reasons, provider, "not_configured")
+            continue
+        guard = get_guard(provider)
+        # 熔断打开的服务立即跳过；限流排队过久同样跳过，交给下一个服务
+        skipped = guard.before_call()
+        if skipped:
+            _note_geocode_failure(reasons, provider, skipped)
+            continue
         try:
-            if "geocode.maps.co" in url_tpl:
-                if not mapsco_key:
-                    continue
+            if provider == "mapsco":
                 url = f"{url_tpl.format(quote(name))}&api_key={quote(mapsco_key)}"
             else:
                 url = url_tpl.format(quote(name))
             if kind == "list" and country_param:
                 url = f"{url}{country_param}"
-            req = Request(url, headers={"User-Agent": _DEFAULT_USER_AGENT})
-            with urlopen(req, timeout=20) as resp:
-                data = resp.read()
-                payload = json.loads(data.decode("utf-8", errors="ignore"))
+            try:
+                payload = _http_request_json("GET", url, {"User-Agent": _DEFAULT_USER_AGENT})
+            except Exception:
+                guard.record_failure()
+                raise
+            guard.record_success()
+            coord = None
             if kind == "list" and isinstance(payload, list) and payload:
                 # Nominatim / maps.co 返回列表
-                lat = float(payload[0].get("lat"))
-                lon = float(payload[0].get("lon"))
-                if not force_cn or _is_inside_china(lat, lon):
-                    return lat, lon
+                coord = (float(payload[0].get("lat")), float(payload[0].get("lon")))
             if kind == "photon" and isinstance(payload, dict):
                 # Photon 返回 features 数组
                 features = payload.get("features") or []
                 if features:
                     coords = features[0].get("geometry", {}).get("coordinates") or []
                     if len(coords) >= 2:
-                        lon = float(coords[0])
-                        lat = float(coords[1])
-                        if not force_cn or _is_inside_china(lat, lon):
-                            return lat, lon
+                        coord = (float(coords[1]), float(coords[0]))
+            if not coord:
+                _note_geocode_failure(reasons, provider, "no_result")
+                continue
+            if force_cn and not _is_inside_china(coord[0], coord[1]):
+                _note_geocode_failure(reasons, provider, "outside_china")
+                continue
+            # 公共服务返回 WGS84，统一转换为与高德一致的 GCJ-02
+            return wgs84_to_gcj02([coord])[0], provider
         except Exception as exc:
-            _LOGGER.warning("geocode_failed name=%s error=%s", name, exc)
+            _LOGGER.warning("geocode_failed name=%s provider=%s error=%s", name, provider, exc)
+            _note_geocode_failure(reasons, provider, f"error: {exc}")
             continue
     return None
 
 
+def _geocode_nominatim(name: str, force_cn: bool = False) -> Optional[Tuple[float, float]]:
+    """
+    公共地理编码回退链路，仅返回坐标。
+    """
+    hit = _geocode_public(name, force_cn=force_cn)
+    return hit[0] if hit else None
+
+
 def _get_qveris_client_class():
     """
     预留扩展：允许在单测或外部注入自定义客户端。
@@ -346,46 +610,323 @@ def _get_qveris_client_class():
     return QVerisClient
 
 
-def geocode_city(name: str) -> Optional[Tuple[float, float]]:
+_QVERIS_CLIENTS: Dict[Tuple[object, str, str], object] = {}
+_QVERIS_CLIENTS_LOCK = threading.Lock()
+
+
+def _get_qveris_client(api_url: str, api_key: str):
+    """
+    按 (客户端类, URL, Key) 复用 QVeris 客户端实例，底层连接由共享连接池管理。
+    """
+    QVC = _get_qveris_client_class()
+    if not QVC:
+        raise RuntimeError("QVerisClient unavailable")
+    key = (QVC, api_url, api_key)
+    with _QVERIS_CLIENTS_LOCK:
+        client = _QVERIS_CLIENTS.get(key)
+        if client is None:
+            client = QVC(api_url=api_url, api_key=api_key)
+            _QVERIS_CLIENTS[key] = client
+    return client
+
+
+def _accept_coord(res: Optional[Tuple[float, float]], force_cn: bool) -> bool:
+    """
+    QVeris 结果的取用条件，与公共链路一致：中文且非海外地名时要求落在国内范围，避免解析到海外同名地点。
+    """
+    return bool(res) and (not force_cn or _is_inside_china(res[0], res[1]))
+
+
+def _geocode_hedged(
+    cand: str,
+    force_cn: bool,
+    qveris_client: Optional[object],
+    reasons: Dict[str, List[str]],
+) -> Optional[Tuple[Tuple[float, float], str]]:
+    """
+    竞速模式：QVeris 与公共回退链路各一路并行发起，返回最先通过国内范围校验的结果。
+    QVeris 一路按 address / keywords / q 顺序逐个尝试，两路都在每次外呼前检查 cancel，
+    一方胜出后另一方不再发起后续请求（已发出的请求无法中断，结果被丢弃）。
+    """
+    cancel = threading.Event()
+
+    def _qveris_task() -> Optional[Tuple[Tuple[float, float], str]]:
+        variant = getattr(qveris_client, "geocode_variant", None)
+        if callable(variant):
+            attempts = [lambda param=param: variant(cand, param) for param in _QVERIS_GEOCODE_PARAMS]
+        else:
+            attempts = [lambda: qveris_client.geocode(cand)]
+        for attempt in attempts:
+            if cancel.is_set():
+                return None
+            try:
+                res = attempt()
+            except QVerisUnavailable as exc:
+                # 服务不可用时其余参数形式同样无法调用
+                _note_geocode_failure(reasons, "qveris", exc.reason)
+                return None
+            if not res:
+                _note_geocode_failure(reasons, "qveris", "no_result")
+                continue
+            if not _accept_coord(res, force_cn):
+                _note_geocode_failure(reasons, "qveris", "outside_china")
+                continue
+            return res, "qveris"
+        return None
+
+    # 公共链路内部已按 force_cn 校验并逐服务记录原因，这里只记录逃逸的异常
+    tasks: Dict[str, Callable[[], Optional[Tuple[Tuple[float, float], str]]]] = {}
+    if qveris_client is not None:
+        tasks["qveris"] = _qveris_task
+    tasks["public"] = lambda: _geocode_public(cand, force_cn=force_cn, reasons=reasons, cancel=cancel)
+    labels = {_HEDGE_EXECUTOR.submit(task): label for label, task in tasks.items()}
+    pending = set(labels)
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    hit = future.result()
+                except Exception as exc:
+                    _note_geocode_failure(reasons, labels[future], _qveris_failure(exc))
+                    continue
+                if hit:
+                    return hit
+        return None
+    finally:
+        cancel.set()
+        for future in pending:
+            future.cancel()
+
+
+def geocode_city(name: str, hedge: Optional[bool] = None) -> Optional[Tuple[float, float]]:
     """
     城市/地址字符串 → GCJ-02 经纬度。
-    仅使用 QVeris 接入的高德地理编码工具。
+    查询顺序：离线地名库 → 内存缓存 → 磁盘缓存 → 失败记录 → QVeris 高德工具 → 公共地理编码回退。
+    全部失败时按服务记录失败原因，在 TTL 内重复查询直接返回 None。
+    同一规范化地名的并发调用共享一次查询结果。
+    hedge=True（或 STORY_MAP_GEOCODE_HEDGE=1）时首个候选改为多服务并行竞速。
     """
     name = str(name or "").strip()
     if not name:
         return None
-    candidates = _build_geocode_candidates(name)
-    looks_cn = _looks_chinese(name)
-    looks_foreign = _looks_foreign_location(name)
+    # 内置地名库能完整解析的地名直接返回，不触碰缓存与网络
+    local = _resolve_local(name)
+    if local:
+        return local
     # 优先使用命中缓存，减少外部地理编码调用
     cached = _geocode_cache_get(name)
     if cached:
         return cached
+    # 并发请求同一地名时合并为一次外呼
+    return _single_flight(_normalize_place_key(name), lambda: _geocode_uncached(name, hedge))
+
+
+def _geocode_uncached(name: str, hedge: Optional[bool] = None) -> Optional[Tuple[float, float]]:
+    # 成为执行方前可能刚有一轮请求完成，先复查缓存
+    cached = _geocode_cache_get(name)
+    if cached:
+        return cached
+    # 近期已确认无法解析的地名直接返回，避免重复走完整回退链路
+    if _geocode_miss_get(name):
+        return _resolve_local(name, partial=True)
+    candidates = _build_geocode_candidates(name)
+    looks_cn = _looks_chinese(name)
+    looks_foreign = _looks_foreign_location(name)
+    force_cn = looks_cn and not looks_foreign
+    reasons: Dict[str, List[str]] = {}
     api_url = os.getenv("QVERIS_API_URL") or os.getenv("QVERIS_BASE_URL")
     api_key = os.getenv("QVERIS_API_KEY")
-    if api_url and api_key:
-        for cand in candidates:
+    qveris_ready = bool(api_url and api_key) and not get_guard("qveris").breaker.is_open()
+    remaining = candidates
+    if (_GEOCODE_HEDGE if hedge is None else hedge) and candidates:
+        try:
+            client = _get_qveris_client(api_url, api_key) if qveris_ready else None
+        except Exception:
+            client = None
+        hit = _geocode_hedged(candidates[0], force_cn, client, reasons)
+        if hit:
+            res, provider = hit
+            _geocode_cache_set(name, res, candidate=candidates[0], provider=provider)
+            return res
+        # 首个候选竞速失败后，其余候选按常规顺序继续尝试
+        remaining = candidates[1:]
+    if api_url and api_key and not qveris_ready:
+        _note_geocode_failure(reasons, "qveris", "circuit_open")
+    elif api_url and api_key:
+        for cand in remaining:
             try:
-                QVC = _get_qveris_client_class()
-                if not QVC:
-                    raise RuntimeError("QVerisClient unavailable")
-                client = QVC(api_url=api_url, api_key=api_key)
+                client = _get_qveris_client(api_url, api_key)
                 res = client.geocode(cand)
-                if res:
-                    # 中文地址默认要求落在国内范围，避免解析到海外同名地点
-                    if not looks_cn or _is_inside_china(res[0], res[1]):
-                        _geocode_cache_set(name, res)
-                        _geocode_cache_set(cand, res)
-                        return res
-            except Exception:
-                pass
-    for cand in candidates:
-        res = _geocode_nominatim(cand, force_cn=looks_cn and not looks_foreign)
-        if res:
-            _geocode_cache_set(name, res)
-            _geocode_cache_set(cand, res)
+                if not res:
+                    _note_geocode_failure(reasons, "qveris", "no_result")
+                    continue
+                if _accept_coord(res, force_cn):
+                    _geocode_cache_set(name, res, candidate=cand, provider="qveris")
+                    return res
+                _note_geocode_failure(reasons, "qveris", "outside_china")
+            except Exception as exc:
+                _note_geocode_failure(reasons, "qveris", _qveris_failure(exc))
+    else:
+        _note_geocode_failure(reasons, "qveris", "not_configured")
+    for cand in remaining:
+        hit = _geocode_public(cand, force_cn=force_cn, reasons=reasons)
+        if hit:
+            res, provider = hit
+            _geocode_cache_set(name, res, candidate=cand, provider=provider)
             return res
-    return None
+    _geocode_miss_set(name, reasons)
+    # 在线服务都失败时，退回本地索引中能识别出的上级地名
+    return _resolve_local(name, partial=True)
+
+
+def _resolve_local(name: str, partial: bool = False) -> Optional[Tuple[float, float]]:
+    """
+    本地地名索引解析；partial=True 时也接受不完整匹配（仅作在线失败后的兜底）。
+    """
+    match = resolve_place(name)
+    if not match or not (match.complete or (partial and not _looks_foreign_location(name))):
+        return None
+    return (match.entry.lat, match.entry.lng)
+
+
+def _local_detail(match) -> Dict[str, object]:
+    return {
+        "lat": match.entry.lat,
+        "lng": match.entry.lng,
+        "source": "gazetteer",
+        "matched": match.entry.name,
+        "level": match.entry.level,
+        "modern": match.entry.modern,
+        "complete": match.complete,
+    }
+
+
+def geocode_detail(name: str) -> Optional[Dict[str, object]]:
+    """
+    与 geocode_city 相同的查询链路，额外返回坐标来源：
+    - source=gazetteer：离线地名库命中（含组合地名解析及在线失败后的上级回退），附带收录名、层级与今地名
+    - source=cache / network：缓存命中或本次外呼，provider 为实际提供坐标的服务
+    """
+    text = str(name or "").strip()
+    if not text:
+        return None
+    match = resolve_place(text)
+    if match and match.complete:
+        return _local_detail(match)
+    source = "cache" if _geocode_cache_get(text) else "network"
+    coord = geocode_city(text)
+    if not coord:
+        return None
+    row = _get_geocode_store().get(_normalize_place_key(text))
+    if not row and match and coord == (match.entry.lat, match.entry.lng):
+        return _local_detail(match)
+    row = row or {}
+    return {"lat": coord[0], "lng": coord[1], "source": source, "provider": row.get("provider", "")}
+
+
+def preload_geocodes(coords: Dict[str, Tuple[float, float]], provider: str = "markdown") -> int:
+    """
+    将已知坐标（如历史文档中的“地点坐标”表）批量写入缓存，返回磁盘缓存新增条数。
+    已缓存的地名不会被覆盖，避免旧文档中的坐标替换掉服务返回的结果。
+    """
+    items: Dict[str, Tuple[float, float]] = {}
+    for name, coord in (coords or {}).items():
+        key = _normalize_place_key(name)
+        if key and coord and _is_valid_coord(coord[0], coord[1]):
+            items.setdefault(key, (float(coord[0]), float(coord[1])))
+    if not items:
+        return 0
+    # 只写磁盘缓存：内存缓存在首次查询时从磁盘回填，二者始终一致
+    return _get_geocode_store().put_many(items, provider=provider)
+
+
+def _geocode_qveris_batch(keys: List[str]) -> Dict[str, Tuple[float, float]]:
+    """
+    未命中缓存的地名先走 QVeris 批量接口，减少逐条往返。
+    """
+    api_url = os.getenv("QVERIS_API_URL") or os.getenv("QVERIS_BASE_URL")
+    api_key = os.getenv("QVERIS_API_KEY")
+    if not keys or not (api_url and api_key):
+        return {}
+    found: Dict[str, Tuple[float, float]] = {}
+    try:
+        client = _get_qveris_client(api_url, api_key)
+    except Exception:
+        return found
+    geocode_batch = getattr(client, "geocode_batch", None)
+    if not callable(geocode_batch):
+        return found
+    for i in range(0, len(keys), _QVERIS_BATCH_SIZE):
+        chunk = keys[i : i + _QVERIS_BATCH_SIZE]
+        try:
+            results = geocode_batch(chunk)
+        except Exception as exc:
+            _LOGGER.warning("geocode_batch_failed size=%s error=%s", len(chunk), exc)
+            continue
+        for key, res in zip(chunk, results):
+            if not res:
+                continue
+            if _looks_chinese(key) and not _is_inside_china(res[0], res[1]):
+                continue
+            _geocode_cache_set(key, res, provider="qveris")
+            found[key] = res
+    return found
+
+
+def geocode_many(names: Iterable[str], max_workers: int = 8) -> Dict[str, Tuple[float, float]]:
+    """
+    批量地理编码，返回 {输入地名: 坐标}，解析失败的地名不出现在结果中。
+    - 一次遍历完成去重、规范化，先查离线地名库，再批量查询内存/磁盘缓存与失败记录
+    - 未命中部分优先走 QVeris 批量接口，其余以有限并发逐条回退 geocode_city
+    """
+    originals: Dict[str, List[str]] = {}
+    for name in names:
+        text = str(name or "").strip()
+        key = _normalize_place_key(text)
+        if key:
+            originals.setdefault(key, [])
+            if text not in originals[key]:
+                originals[key].append(text)
+    if not originals:
+        return {}
+    keys = list(originals)
+    resolved: Dict[str, Tuple[float, float]] = {}
+    for key in keys:
+        local = _resolve_local(key)
+        if local:
+            resolved[key] = local
+    pending = [k for k in keys if k not in resolved]
+    if pending:
+        resolved.update(_geocode_cache_get_many(pending))
+        pending = [k for k in pending if k not in resolved]
+    if pending and _GEOCODE_MISS_TTL > 0:
+        missed = _get_geocode_store().get_misses(pending)
+        for key in missed:
+            local = _resolve_local(key, partial=True)
+            if local:
+                resolved[key] = local
+        pending = [k for k in pending if k not in missed]
+    if pending:
+        resolved.update(_geocode_qveris_batch(pending))
+        pending = [k for k in pending if k not in resolved]
+    if pending:
+        workers = min(max(1, max_workers), len(pending))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            future_map = {executor.submit(geocode_city, k): k for k in pending}
+            for future in as_completed(future_map):
+                try:
+                    coord = future.result()
+                except Exception:
+                    coord = None
+                if coord:
+                    resolved[future_map[future]] = coord
+    out: Dict[str, Tuple[float, float]] = {}
+    for key, texts in originals.items():
+        if key in resolved:
+            for text in texts:
+                out[text] = resolved[key]
+    return out
 
 
 def _clean_place_name(text: str) -> str:
@@ -404,83 +945,39 @@ def extract_places_in_order(md: str) -> List[str]:
     """
     if not isinstance(md, str):
         return []
-    lines = md.splitlines()
-    in_loc = False
-    table_started = False
-    header_seen = False
-    col_indices = None
-    places: List[str] = []
-    for line in lines:
-        if line.strip().startswith("## "):
-            title = line.strip().lstrip("#").strip()
-            if title.startswith("年份"):
-                in_loc = True
-                table_started = False
-                header_seen = False
-                col_indices = None
-                continue
-            else:
-                in_loc = False
-        if not in_loc:
-            continue
-        if line.strip().startswith("|") and not table_started:
-            # 读取表头行并确定“现称”列索引
-            table_started = True
-            header_cells = [c.strip() for c in line.strip().strip("|").split("|")]
-            idx = None
-            for j, c in enumerate(header_cells):
-                if "现称" in c:
-                    idx = j
-                    break
-            if idx is None:
-                idx = len(header_cells) - 1
-            col_indices = idx
-            continue
-        if table_started:
-            if _TABLE_SEPARATOR_RE.match(line.strip()):
-                header_seen = True
-                continue
-            if header_seen and line.strip().startswith("|"):
-                # 读取数据行
-                cells = [c.strip() for c in line.strip().strip("|").split("|")]
-                if cells and col_indices is not None and col_indices < len(cells):
-                    cell = cells[col_indices]
-                    if cell:
-                        if "：" in cell:
-                            cell = cell.split("：", 1)[-1].strip()
-                        clean = _clean_place_name(cell)
-                        if clean and clean != "—":
-                            places.append(clean)
-            else:
-                break
-    if not places:
+    table = parse_markdown(md).first_table(lambda title: title.startswith("年份"))
+    if not table:
         return []
-    return list(dict.fromkeys(places))
+    places = [timeline_row_place(table.header, cells) for cells in table.rows]
+    return list(dict.fromkeys(p for p in places if p))
+
+
+def timeline_row_place(header: Sequence[str], cells: Sequence[str]) -> str:
+    """
+    “年份”表单行的“现称”地点（去除括注）；表头缺少“现称”列时取最后一列，无地点时返回空串。
+    """
+    idx = next((j for j, c in enumerate(header) if "现称" in c), len(header) - 1)
+    if idx < 0 or idx >= len(cells) or not cells[idx]:
+        return ""
+    cell = cells[idx]
+    if "：" in cell:
+        cell = cell.split("：", 1)[-1].strip()
+    clean = _clean_place_name(cell)
+    return "" if clean == "—" else clean
 
 
 def append_coords_section(md: str) -> str:
     """
-    依据“年份”表逐个地理编码，并在文末追加“地点坐标（自动地理编码）”表。
+    依据“年份”表批量地理编码，并在文末追加“地点坐标（自动地理编码）”表。
     如果没有识别出地点或均编码失败，则不做改动直接返回原文。
     """
     if not isinstance(md, str):
         return ""
     lines = md.splitlines()
-    coords: Dict[str, Tuple[float, float]] = {}
     places = extract_places_in_order(md)
     if not places:
         return md
-    max_workers = min(8, max(1, len(places)))
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_map = {executor.submit(geocode_city, p): p for p in places}
-        for future in as_completed(future_map):
-            place = future_map[future]
-            try:
-                coord = future.result()
-            except Exception:
-                coord = None
-            if coord:
-                coords[place] = coord
+    coords = geocode_many(places)
     if not coords:
         return md
     section = []
@@ -498,58 +995,24 @@ def append_coords_section(md: str) -> str:
 def compute_total_distance_km(md: str) -> Optional[float]:
     """
     从“地点坐标（自动地理编码）”表获取经纬度，计算总直线距离（公里）。
-    使用 Haversine 公式计算。
+    各段距离由 geo_distance 一次批量计算。
     """
     if not isinstance(md, str):
         return None
+    table = parse_markdown(md).first_table(lambda title: "地点坐标" in title)
     coords: List[Tuple[float, float]] = []
-    lines = md.splitlines()
-    in_section = False
-    header_seen = False
-    for line in lines:
-        if line.strip().startswith("## "):
-            title = line.strip().lstrip("#").strip()
-            in_section = "地点坐标" in title
-            header_seen = False
-            continue
-        if not in_section:
+    for cells in (table.rows if table else ()):
+        if len(cells) < 3:
             continue
-        if line.strip().startswith("|") and not header_seen:
-            header_seen = True
+        try:
+            lat = float(cells[1])
+            lon = float(cells[2])
+            coords.append((lat, lon))
+        except Exception:
             continue
-        if header_seen:
-            if not line.strip().startswith("|"):
-                break
-            cells = [c.strip() for c in line.strip().strip("|").split("|")]
-            if len(cells) < 3:
-                continue
-            try:
-                lat = float(cells[1])
-                lon = float(cells[2])
-                coords.append((lat, lon))
-            except Exception:
-                continue
     if len(coords) < 2:
         return None
-    total = 0.0
-    for i in range(len(coords) - 1):
-        lat1, lon1 = coords[i]
-        lat2, lon2 = coords[i + 1]
-        total += _haversine(lat1, lon1, lat2, lon2)
-    return total
-
-
-def _haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    import math
-
-    R = 6371.0
-    dLat = math.radians(lat2 - lat1)
-    dLon = math.radians(lon2 - lon1)
-    a = math.sin(dLat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(
-        math.radians(lat2)
-    ) * math.sin(dLon / 2) ** 2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
+    return path_length_km(coords)
 
 
 def insert_distance_intro(md: str, distance_km: float) -> str:
@@ -574,7 +574,7 @@ const buildGeoJSON = (payload) => {
   const locations = payload.locations || [];
   const features = locations.map(loc => ({
     type: 'Feature',
-    geometry: { type: 'Point', coordinates: [loc.lng, loc.lat] },
+    geometry: { type: 'Point', coordinates: [loc.wgsLng ?? loc.lng, loc.wgsLat ?? loc.lat] },
     properties: {
       person: person.name || '',
       name: loc.name || '',
@@ -589,7 +589,7 @@ const buildGeoJSON = (payload) => {
       type: 'Feature',
       geometry: {
         type: 'LineString',
-        coordinates: locations.map(loc => [loc.lng, loc.lat])
+        coordinates: locations.map(loc => [loc.wgsLng ?? loc.lng, loc.wgsLat ?? loc.lat])
       },
       properties: { person: person.name || '', name: '轨迹' }
     });
@@ -600,7 +600,7 @@ const csvEscape = (value) => `"${String(value || '').replace(/"/g, '""')}"`;
 const buildCSV = (payload) => {
   const person = payload.person || {};
   const locations = payload.locations || [];
-  const header = ['person','name','lat','lng','type','time','modernName','ancientName'];
+  const header = ['person','name','lat','lng','type','time','modernName','ancientName','lat_wgs84','lng_wgs84'];
   const rows = locations.map(loc => [
     person.name || '',
     loc.name || '',
@@ -609,7 +609,9 @@ const buildCSV = (payload) => {
     loc.type || '',
     loc.time || '',
     loc.modernName || '',
-    loc.ancientName || ''
+    loc.ancientName || '',
+    loc.wgsLat ?? '',
+    loc.wgsLng ?? ''
   ]);
   return [header.join(','), ...rows.map(r => r.map(csvEscape).join(','))].join('\\n');
 };
@@ -739,13 +741,30 @@ if (bounds.length > 0) {
 }
 const legend = document.getElementById('legend');
 const overlap = data.overlaps || [];
-const overlapText = overlap.length ? overlap.map(o => o.name).join('、') : '暂无';
+const overlapText = overlap.length
+  ? overlap.map(o => (o.persons && o.persons.length ? `${o.name}（${o.persons.join('、')}）` : o.name)).join('；')
+  : '暂无';
+const copresence = data.copresence || [];
+const copresenceText = copresence.length
+  ? copresence.map(c => `${c.name} ${c.period}（${(c.persons || []).join('、')}）`).join('；')
+  : '暂无';
+overlap.forEach((o) => {
+  if (typeof o.lat !== 'number' || typeof o.lng !== 'number') return;
+  L.circle([o.lat, o.lng], {
+    radius: Math.max(5000, (o.spread_km || 0) * 500),
+    color: '#f59e0b',
+    weight: 2,
+    dashArray: '4 4',
+    fillOpacity: 0.08
+  }).addTo(map).bindPopup(`交集：${o.name}<br>${(o.persons || []).join('、')}`);
+});
 legend.innerHTML = `<div class="text-sm font-semibold">人物轨迹</div>` + people.map(p => `
   <div class="legend-item">
     <span class="legend-color" style="background:${p.color || '#1e40af'}"></span>
     <span>${p.person?.name || ''}</span>
   </div>
-`).join('') + `<div class="text-[11px] text-slate-500 mt-2">交集地点：${overlapText}</div>`;
+`).join('') + `<div class="text-[11px] text-slate-500 mt-2">交集地点：${overlapText}</div>`
+  + `<div class="text-[11px] text-slate-500 mt-1">同时同地：${copresenceText}</div>`;
 const downloadText = (filename, content, type) => {
   const blob = new Blob([content], { type });
   const url = URL.createObjectURL(blob);
@@ -764,7 +783,7 @@ const buildGeoJSON = (payload) => {
     locations.forEach(loc => {
       features.push({
         type: 'Feature',
-        geometry: { type: 'Point', coordinates: [loc.lng, loc.lat] },
+        geometry: { type: 'Point', coordinates: [loc.wgsLng ?? loc.lng, loc.wgsLat ?? loc.lat] },
         properties: {
           person: p.person?.name || '',
           name: loc.name || '',
@@ -778,7 +797,7 @@ const buildGeoJSON = (payload) => {
     if (locations.length > 1) {
       features.push({
         type: 'Feature',
-        geometry: { type: 'LineString', coordinates: locations.map(loc => [loc.lng, loc.lat]) },
+        geometry: { type: 'LineString', coordinates: locations.map(loc => [loc.wgsLng ?? loc.lng, loc.wgsLat ?? loc.lat]) },
         properties: { person: p.person?.name || '', name: '轨迹' }
       });
     }
@@ -787,7 +806,7 @@ const buildGeoJSON = (payload) => {
 };
 const csvEscape = (value) => `"${String(value || '').replace(/"/g, '""')}"`;
 const buildCSV = (payload) => {
-  const header = ['person','name','lat','lng','type','time','modernName','ancientName'];
+  const header = ['person','name','lat','lng','type','time','modernName','ancientName','lat_wgs84','lng_wgs84'];
   const rows = [];
   (payload.people || []).forEach(p => {
     (p.locations || []).forEach(loc => {
@@ -799,7 +818,9 @@ const buildCSV = (payload) => {
         loc.type || '',
         loc.time || '',
         loc.modernName || '',
-        loc.ancientName || ''
+        loc.ancientName || '',
+        loc.wgsLat ?? '',
+        loc.wgsLng ?? ''
       ]);
     });
   });
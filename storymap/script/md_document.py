@@ -0,0 +1,244 @@
+"""
+md_document
+职责：把人物生平 Markdown 一次切分为“章节 / 小节 / 表格 / 字段列表”的文档模型，供各解析函数共享。
+- 单遍扫描：二级标题（## ）划分章节，三级标题（### ）划分小节，连续的 | 行组成表格
+- 小节内的 “- **键**：值” 列表行预先解析为有序字段
+- 按内容哈希缓存解析结果，同一篇文档在一次生成流程中只解析一次
+- 模型由元组构成、不可变，可在线程间共享；各视图函数自行复制需要修改的数据
+- MdStreamParser：流式生成时逐段喂入文本，表格数据行与小节一旦完整即产出，切分规则与整篇解析一致
+"""
+import hashlib
+import re
+from typing import Callable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from bounded_cache import BoundedCache, register_cache
+
+
+TABLE_SEPARATOR_RE = re.compile(r"^\|\s*-{3,}\s*\|")
+FIELD_RE = re.compile(r"-\s*\*\*(.+?)\*\*：\s*(.+)")
+
+
+class MdTable(NamedTuple):
+    header: Tuple[str, ...]
+    rows: Tuple[Tuple[str, ...], ...]
+
+
+class MdSubsection(NamedTuple):
+    title: str
+    lines: Tuple[str, ...]
+    fields: Tuple[Tuple[str, str], ...]
+
+
+class MdTableRow(NamedTuple):
+    header: Tuple[str, ...]
+    cells: Tuple[str, ...]
+
+
+class MdSection(NamedTuple):
+    """
+    二级标题章节；title 为空表示首个二级标题之前的内容。
+    lines 为标题下的全部原始行（含三级标题行），subsections 与 tables 按出现顺序排列。
+    """
+    title: str
+    lines: Tuple[str, ...]
+    subsections: Tuple[MdSubsection, ...]
+    tables: Tuple[MdTable, ...]
+
+
+def split_cells(line: str) -> Tuple[str, ...]:
+    return tuple(c.strip() for c in line.strip().strip("|").split("|"))
+
+
+def heading_title(line: str) -> str:
+    return line.strip().lstrip("#").strip()
+
+
+def _build_table(lines: List[str]) -> MdTable:
+    # 首行为表头；分隔行之后的 | 行为数据行，缺少分隔行的表格没有数据行
+    rows: List[Tuple[str, ...]] = []
+    body = False
+    for line in lines[1:]:
+        if TABLE_SEPARATOR_RE.match(line):
+            body = True
+            continue
+        if body:
+            rows.append(split_cells(line))
+    return MdTable(split_cells(lines[0]), tuple(rows))
+
+
+class _SectionBuilder:
+    def __init__(self, title: str):
+        self.title = title
+        self.lines: List[str] = []
+        self.subsections: List[MdSubsection] = []
+        self.tables: List[MdTable] = []
+        self._sub_title: Optional[str] = None
+        self._sub_lines: List[str] = []
+        self._sub_fields: List[Tuple[str, str]] = []
+        self._table: List[str] = []
+
+    def _flush_table(self) -> None:
+        if self._table:
+            self.tables.append(_build_table(self._table))
+            self._table = []
+
+    def _flush_subsection(self) -> None:
+        if self._sub_title is not None:
+            self.subsections.append(
+                MdSubsection(self._sub_title, tuple(self._sub_lines), tuple(self._sub_fields))
+            )
+        self._sub_title = None
+        self._sub_lines = []
+        self._sub_fields = []
+
+    def add(self, line: str) -> None:
+        self.lines.append(line)
+        stripped = line.strip()
+        if stripped.startswith("|"):
+            self._table.append(stripped)
+        else:
+            self._flush_table()
+        if stripped.startswith("### "):
+            self._flush_subsection()
+            self._sub_title = heading_title(stripped)
+            return
+        if self._sub_title is None:
+            return
+        self._sub_lines.append(line)
+        m = FIELD_RE.match(stripped)
+        if m:
+            self._sub_fields.append((m.group(1).strip(), m.group(2).strip()))
+
+    def build(self) -> MdSection:
+        self._flush_table()
+        self._flush_subsection()
+        return MdSection(self.title, tuple(self.lines), tuple(self.subsections), tuple(self.tables))
+
+
+class MdDocument:
+    """
+    单遍解析得到的文档模型，提供按标题筛选章节、表格的基础视图。
+    """
+    def __init__(self, sections: Tuple[MdSection, ...]):
+        self.sections = sections
+
+    @classmethod
+    def parse(cls, md: str) -> "MdDocument":
+        sections: List[MdSection] = []
+        current = _SectionBuilder("")
+        for line in md.splitlines():
+            if line.strip().startswith("## "):
+                sections.append(current.build())
+                current = _SectionBuilder(heading_title(line))
+                continue
+            current.add(line)
+        sections.append(current.build())
+        return cls(tuple(sections))
+
+    def find_sections(self, match: Callable[[str], bool]) -> Iterator[MdSection]:
+        for section in self.sections:
+            if section.title and match(section.title):
+                yield section
+
+    def first_section(self, match: Callable[[str], bool]) -> Optional[MdSection]:
+        return next(self.find_sections(match), None)
+
+    def tables(self, match: Optional[Callable[[str], bool]] = None) -> Iterator[MdTable]:
+        """
+        按出现顺序遍历表格；match 为空时包含首个二级标题之前的表格。
+        """
+        sections = self.sections if match is None else self.find_sections(match)
+        for section in sections:
+            yield from section.tables
+
+    def first_table(self, match: Callable[[str], bool]) -> Optional[MdTable]:
+        return next(self.tables(match), None)
+
+    def subsections(
+        self, section_match: Callable[[str], bool], sub_match: Callable[[str], bool]
+    ) -> Iterator[MdSubsection]:
+        for section in self.find_sections(section_match):
+            for sub in section.subsections:
+                if sub_match(sub.title):
+                    yield sub
+
+
+# 流式产出项：(所在二级标题, 表格数据行或三级小节)
+MdStreamItem = Tuple[str, Union[MdTableRow, MdSubsection]]
+
+
+class MdStreamParser:
+    """
+    增量解析：feed 接收任意切分的文本片段，返回其中已完整的表格数据行与小节。
+    - 表格数据行在换行到达时产出（须位于表头分隔行之后）
+    - 小节在下一个二级/三级标题到达或 close 时产出，内容与 MdDocument.parse 得到的小节相同
+    """
+    def __init__(self):
+        self._pending = ""
+        self._section = ""
+        self._sub: Optional[_SectionBuilder] = None
+        self._table_header: Optional[Tuple[str, ...]] = None
+        self._table_body = False
+
+    def feed(self, chunk: str) -> List[MdStreamItem]:
+        self._pending += chunk or ""
+        *lines, self._pending = self._pending.split("\n")
+        out: List[MdStreamItem] = []
+        for line in lines:
+            self._line(line.rstrip("\r"), out)
+        return out
+
+    def close(self) -> List[MdStreamItem]:
+        out: List[MdStreamItem] = []
+        if self._pending:
+            self._line(self._pending, out)
+            self._pending = ""
+        self._flush_subsection(out)
+        return out
+
+    def _flush_subsection(self, out: List[MdStreamItem]) -> None:
+        if self._sub is not None:
+            out.extend((self._section, sub) for sub in self._sub.build().subsections)
+            self._sub = None
+
+    def _line(self, line: str, out: List[MdStreamItem]) -> None:
+        stripped = line.strip()
+        if stripped.startswith("## "):
+            self._flush_subsection(out)
+            self._section = heading_title(stripped)
+            self._table_header = None
+            return
+        if stripped.startswith("|"):
+            if self._table_header is None:
+                self._table_header = split_cells(stripped)
+                self._table_body = False
+            elif TABLE_SEPARATOR_RE.match(stripped):
+                self._table_body = True
+            elif self._table_body:
+                out.append((self._section, MdTableRow(self._table_header, split_cells(stripped))))
+        else:
+            self._table_header = None
+        if stripped.startswith("### "):
+            self._flush_subsection(out)
+            self._sub = _SectionBuilder(self._section)
+        if self._sub is not None:
+            self._sub.add(line)
+
+
+_EMPTY = MdDocument((MdSection("", (), (), ()),))
+# 同一篇文档在生成流程中会被十余个解析函数读取，按内容哈希复用解析结果
+_DOCUMENTS = register_cache(BoundedCache("markdown", 64))
+
+
+def parse_markdown(md: object) -> MdDocument:
+    """
+    返回 Markdown 的文档模型；非字符串输入返回空文档。
+    """
+    if not isinstance(md, str):
+        return _EMPTY
+    key = hashlib.sha1(md.encode("utf-8")).hexdigest()
+    doc = _DOCUMENTS.get(key)
+    if doc is None:
+        doc = MdDocument.parse(md)
+        _DOCUMENTS[key] = doc
+    return doc
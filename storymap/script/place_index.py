@@ -0,0 +1,157 @@
+"""
+place_index
+职责：基于离线地名库的前缀树索引，解析“河东郡解县”“荆州麦城”等组合地名。
+- 从左到右做最长前缀匹配，切出文本中所有已知地名
+- 按行政层级逐级下钻：后一个地名隶属于前一个（县 → 郡/市 → 省）时取更细的一级
+- 末尾地名（忽略省/市/县等后缀）即使与前文无隶属关系也优先采用，例如“荆州麦城”取麦城
+- 文本中还有未收录的内容时标记为不完整匹配，调用方先尝试在线编码，失败再回退到该结果
+"""
+import threading
+from typing import Dict, List, NamedTuple, Optional
+
+from gazetteer import GazetteerEntry, gazetteer_table, normalize_place_name, strip_admin_suffix, suffix_fits
+
+
+_TERMINAL = ""
+# 解析时可忽略的尾部修饰
+_TRAILING_NOISE = ("一带", "附近", "境内", "故城", "旧址", "遗址")
+# 地名之间允许出现、不影响完整性判断的行政区划用字
+_ADMIN_CHARS = set("省市县区郡州国")
+
+
+class PlaceMatch(NamedTuple):
+    entry: GazetteerEntry
+    matched: str
+    complete: bool
+
+
+class PlaceIndex:
+    """
+    前缀树 + 上级关系表；构建后只读，可在多线程间共享。
+    """
+    def __init__(self, table: Dict[str, GazetteerEntry]):
+        self.source = table
+        self._root: Dict[str, dict] = {}
+        self._by_name: Dict[str, GazetteerEntry] = {}
+        for entry in table.values():
+            self._by_name.setdefault(entry.name, entry)
+            key = normalize_place_name(entry.name)
+            self._insert(key, entry)
+            short = strip_admin_suffix(key)
+            if short != key:
+                self._insert(short, entry, overwrite=False)
+
+    def _insert(self, key: str, entry: GazetteerEntry, overwrite: bool = True) -> None:
+        node = self._root
+        for ch in key:
+            node = node.setdefault(ch, {})
+        if overwrite or _TERMINAL not in node:
+            node[_TERMINAL] = entry
+
+    def _longest_at(self, text: str, start: int) -> Optional[tuple]:
+        node = self._root
+        best = None
+        for i in range(start, len(text)):
+            node = node.get(text[i])
+            if node is None:
+                break
+            if _TERMINAL in node:
+                best = (i + 1, node[_TERMINAL])
+        return best
+
+    def scan(self, text: str) -> List[tuple]:
+        """
+        返回文本中按顺序出现、互不重叠的已知地名 [(起点, 终点, 条目)]。
+        """
+        out = []
+        i = 0
+        while i < len(text):
+            hit = self._longest_at(text, i)
+            if hit:
+                end, entry = hit
+                out.append((i, end, entry))
+                i = end
+            else:
+                i += 1
+        return out
+
+    def _ancestors(self, entry: GazetteerEntry) -> List[str]:
+        chain: List[str] = []
+        parent = entry.parent
+        while parent and parent not in chain:
+            chain.append(parent)
+            node = self._by_name.get(parent)
+            parent = node.parent if node else ""
+        return chain
+
+    def is_ancestor(self, ancestor: GazetteerEntry, entry: GazetteerEntry) -> bool:
+        return ancestor.name in self._ancestors(entry)
+
+    def _province_of(self, entry: GazetteerEntry) -> str:
+        chain = self._ancestors(entry)
+        return chain[-1] if chain else entry.name
+
+    def resolve(self, text: str) -> Optional[PlaceMatch]:
+        key = normalize_place_name(text)
+        if key.startswith("中国"):
+            key = key[2:]
+        for noise in _TRAILING_NOISE:
+            if key.endswith(noise) and len(key) > len(noise):
+                key = key[: -len(noise)]
+                break
+        matches = self.scan(key)
+        if not matches:
+            return None
+        start, end, chosen = matches[0]
+        consistent = True
+        for m_start, m_end, entry in matches[1:]:
+            # 下级地名覆盖前文；末尾地名与前文无隶属关系时也采用，但仅同省时视为可信
+            if self.is_ancestor(chosen, entry):
+                start, end, chosen = m_start, m_end, entry
+            elif m_end == matches[-1][1] and m_end >= len(strip_admin_suffix(key)):
+                consistent = self._province_of(chosen) == self._province_of(entry)
+                start, end, chosen = m_start, m_end, entry
+        covered = set()
+        for m_start, m_end, _ in matches:
+            covered.update(range(m_start, m_end))
+        # 所有字符都被已知地名或行政区划用字覆盖，才算完整匹配（“洛阳白马寺”中的“寺”即不完整）
+        leftover = [ch for i, ch in enumerate(key) if i not in covered and ch not in _ADMIN_CHARS]
+        # 末尾后缀须与条目层级相符：“吉林市”匹配到吉林省时不算完整
+        complete = (
+            consistent
+            and not leftover
+            and end >= len(strip_admin_suffix(key))
+            and suffix_fits(chosen, key[end:])
+        )
+        return PlaceMatch(entry=chosen, matched=key[start:end], complete=complete)
+
+
+_INDEX: Optional[PlaceIndex] = None
+_INDEX_LOCK = threading.Lock()
+
+
+def get_place_index() -> PlaceIndex:
+    global _INDEX
+    table = gazetteer_table()
+    index = _INDEX
+    if index is None or index.source is not table:
+        with _INDEX_LOCK:
+            if _INDEX is None or _INDEX.source is not table:
+                _INDEX = PlaceIndex(table)
+            index = _INDEX
+    return index
+
+
+def resolve_place(text: str) -> Optional[PlaceMatch]:
+    """
+    在本地地名索引中解析组合地名；没有任何已知地名时返回 None。
+    """
+    if not text:
+        return None
+    return get_place_index().resolve(text)
+
+
+def reset_place_index() -> None:
+    global _INDEX
+    with _INDEX_LOCK:
+        _INDEX = None
@@ -0,0 +1,72 @@
+"""
+place_split
+职责：不调用模型，在本地把“古称（今现称）”类地点文本拆为 (古称, 今称)。
+- 覆盖“河东郡解县（今山西省运城市盐湖区）”“涿郡涿县，今河北省涿州市”“今湖北省当阳市）”等写法
+- 没有“今…”说明时，用离线地名库完整匹配古称并取其今地名
+- 今称含“及/或/、”等多地并列、“一说”等异说或逗号分句、或文本无法完整识别时返回 None，交给模型拆解
+- “和/与”常见于地名本身（和田、和县、和平区），只有两侧都能识别出地名时才视为并列
+"""
+import re
+from typing import Optional, Tuple
+
+from place_index import resolve_place
+
+
+_MODERN_RE = re.compile(
+    r"^(?P<ancient>[^（(，,；;]*?)\s*[（(，,；;]\s*(?:即|约|位于|在)?今(?:属)?\s*(?P<modern>[^（()）]+?)\s*[）)]?\s*$"
+)
+_MODERN_ONLY_RE = re.compile(r"^[（(]?\s*今(?:属)?\s*(?P<modern>[^（()）]+?)\s*[）)]?\s*$")
+_PAREN_RE = re.compile(r"[（(].*?[）)]")
+# 今称末尾的范围修饰，去掉后不影响定位
+_MODERN_NOISE = ("及周边地区", "周边地区", "及周边", "一带", "附近", "境内", "地界")
+# 今称中出现这些字样说明对应多个地点（并列、异说或分句），需要模型判断
+_AMBIGUOUS_MARKS = ("及", "或", "、", "/", "之间", "交界", "，", ",", "；", ";", "一说", "或说")
+# 可能是并列连词、也可能是地名用字，需结合两侧内容判断
+_CONJUNCTIONS = ("和", "与")
+
+
+def _clean_modern(text: str) -> str:
+    text = text.strip().rstrip("。；;，,")
+    changed = True
+    while changed:
+        changed = False
+        for noise in _MODERN_NOISE:
+            if text.endswith(noise) and len(text) > len(noise):
+                text = text[: -len(noise)].strip()
+                changed = True
+    return text
+
+
+def _is_ambiguous(modern: str) -> bool:
+    if any(mark in modern for mark in _AMBIGUOUS_MARKS):
+        return True
+    for i, ch in enumerate(modern):
+        if ch in _CONJUNCTIONS and resolve_place(modern[:i]) and resolve_place(modern[i + 1:]):
+            return True
+    return False
+
+
+def _from_gazetteer(text: str) -> Optional[Tuple[str, str]]:
+    match = resolve_place(text)
+    if not match or not match.complete:
+        return None
+    return text, match.entry.modern or match.entry.name
+
+
+def split_place_text(text: str) -> Optional[Tuple[str, str]]:
+    """
+    返回 (古称, 今称)；无法可靠拆解时返回 None。
+    """
+    text = (text or "").strip()
+    if not text:
+        return None
+    m = _MODERN_RE.match(text) or _MODERN_ONLY_RE.match(text)
+    if m:
+        modern = _clean_modern(m.group("modern"))
+        if not modern or _is_ambiguous(modern):
+            return None
+        ancient = m.groupdict().get("ancient") or ""
+        return ancient.strip(), modern
+    if "今" in text:
+        return None
+    return _from_gazetteer(_PAREN_RE.sub("", text).strip())
@@ -0,0 +1,207 @@
+"""
+provider_guard
+职责：为外部地理编码服务提供按服务隔离的限流与熔断，供 map_client 调用链使用。
+- 令牌桶限流：遵守各服务的请求频率约束（如 Nominatim 每秒 1 次）
+- 熔断器：连续失败后短路（open），冷却后放行单个探测请求（half_open），成功即恢复（closed）
+依赖环境变量：
+- STORY_MAP_GEOCODE_RATE_<PROVIDER>（可选，每秒请求数，如 STORY_MAP_GEOCODE_RATE_NOMINATIM=1）
+- STORY_MAP_BREAKER_THRESHOLD（可选，连续失败次数阈值，默认 3）
+- STORY_MAP_BREAKER_RESET（可选，熔断冷却秒数，默认 60）
+- STORY_MAP_RATE_MAX_WAIT（可选，限流最长排队秒数，超出则跳过该服务，默认 10）
+"""
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+
+# 每秒请求数与突发容量；未列出的服务使用默认值
+_PROVIDER_LIMITS: Dict[str, Tuple[float, float]] = {
+    "qveris": (10.0, 10.0),
+    "nominatim": (1.0, 1.0),
+    "mapsco": (2.0, 2.0),
+    "photon": (5.0, 5.0),
+}
+_DEFAULT_LIMIT = (5.0, 5.0)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class TokenBucket:
+    """
+    令牌桶：acquire 预占令牌后在锁外休眠，多个线程排队时按到达顺序错开。
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = max(0.001, float(rate))
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait: float) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            if wait > max_wait:
+                return False
+            self._tokens -= 1
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+
+class CircuitBreaker:
+    """
+    三态熔断器：closed → open（连续失败达到阈值）→ half_open（冷却结束）→ closed / open。
+    """
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 60.0):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if now - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = HALF_OPEN
+                self._probe_at = now
+                return True
+            # half_open 只放行一个探测请求；探测迟迟无结果时允许重新探测
+            if now - self._probe_at >= self.reset_timeout:
+                self._probe_at = now
+                return True
+            return False
+
+    def release_probe(self) -> None:
+        """
+        放行的探测请求最终没有发出（如被限流）时归还探测名额，下一个请求可立即探测。
+        """
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probe_at = time.monotonic() - self.reset_timeout
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._state == OPEN and time.monotonic() - self._opened_at < self.reset_timeout
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            retry_in = 0.0
+            if self._state == OPEN:
+                retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+            return {"state": self._state, "consecutive_failures": self._failures, "retry_in": round(retry_in, 2)}
+
+
+class ProviderGuard:
+    """
+    单个服务的限流 + 熔断组合，并统计调用、失败与跳过次数。
+    """
+    def __init__(self, name: str, bucket: TokenBucket, breaker: CircuitBreaker, max_wait: float):
+        self.name = name
+        self.bucket = bucket
+        self.breaker = breaker
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._counters = {"calls": 0, "successes": 0, "failures": 0, "skipped_open": 0, "rate_limited": 0}
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._counters[key] += 1
+
+    def before_call(self) -> Optional[str]:
+        """
+        返回 None 表示允许调用；否则返回跳过原因（circuit_open / rate_limited）。
+        """
+        if not self.breaker.allow():
+            self._count("skipped_open")
+            return "circuit_open"
+        if not self.bucket.acquire(self.max_wait):
+            # 半开状态下被限流时归还探测名额，否则要再等一个冷却周期才能探测
+            self.breaker.release_probe()
+            self._count("rate_limited")
+            return "rate_limited"
+        self._count("calls")
+        return None
+
+    def record_success(self) -> None:
+        self._count("successes")
+        self.breaker.record_success()
+
+    def record_failure(self) -> None:
+        self._count("failures")
+        self.breaker.record_failure()
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            "name": self.name,
+            "rate_per_sec": self.bucket.rate,
+            **self.breaker.snapshot(),
+            **counters,
+        }
+
+
+_GUARDS: Dict[str, ProviderGuard] = {}
+_GUARDS_LOCK = threading.Lock()
+
+
+def _build_guard(name: str) -> ProviderGuard:
+    rate, capacity = _PROVIDER_LIMITS.get(name, _DEFAULT_LIMIT)
+    custom = (os.getenv(f"STORY_MAP_GEOCODE_RATE_{name.upper()}") or "").strip()
+    if custom:
+        rate = float(custom)
+        capacity = max(1.0, rate)
+    breaker = CircuitBreaker(
+        failure_threshold=int(os.getenv("STORY_MAP_BREAKER_THRESHOLD", "3")),
+        reset_timeout=float(os.getenv("STORY_MAP_BREAKER_RESET", "60")),
+    )
+    max_wait = float(os.getenv("STORY_MAP_RATE_MAX_WAIT", "10"))
+    return ProviderGuard(name, TokenBucket(rate, capacity), breaker, max_wait)
+
+
+def get_guard(name: str) -> ProviderGuard:
+    with _GUARDS_LOCK:
+        guard = _GUARDS.get(name)
+        if guard is None:
+            guard = _build_guard(name)
+            _GUARDS[name] = guard
+        return guard
+
+
+def provider_status() -> Dict[str, Dict[str, object]]:
+    """
+    返回所有已使用服务的限流/熔断快照，用于监控。
+    """
+    with _GUARDS_LOCK:
+        guards = list(_GUARDS.values())
+    return {g.name: g.snapshot() for g in guards}
+
+
+def reset_guards() -> None:
+    with _GUARDS_LOCK:
+        _GUARDS.clear()
@@ -0,0 +1,184 @@
+"""
+spatial_index
+职责：多人物地点的空间邻近聚类，找出不同人物到过的同一地点（交集）。
+- 网格哈希：按半径划分经纬度网格，只比较相邻 3×3 网格内的组长，整体近似线性复杂度
+- 组长聚类：点并入半径内最近的组长所在组，规范化后同名（“许昌”与“许昌市”）的组长优先；组的跨度不超过 2×半径
+- 无坐标的地点仅按名称归组，保证旧数据仍能算出交集
+依赖环境变量：STORY_MAP_OVERLAP_RADIUS_KM（可选，判定为同一地点的距离半径，默认 15 公里）
+"""
+import math
+import os
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from gazetteer import normalize_place_name, strip_admin_suffix
+from geo_distance import centroid, haversine_km, spread_km
+
+
+_KM_PER_DEG = 111.32
+# 网格经度跨度按该纬度的余弦计算，覆盖国内最北端时仍不会漏掉相邻点
+_MAX_ABS_LAT = 56.0
+
+
+def default_radius_km() -> float:
+    return float(os.getenv("STORY_MAP_OVERLAP_RADIUS_KM", "15"))
+
+
+class GridIndex:
+    """
+    经纬度网格哈希：网格边长不小于半径，半径内的点必然落在相邻网格中。
+    """
+    def __init__(self, radius_km: float):
+        self.radius_km = max(0.001, float(radius_km))
+        self._d_lat = self.radius_km / _KM_PER_DEG
+        self._d_lng = self.radius_km / (_KM_PER_DEG * math.cos(math.radians(_MAX_ABS_LAT)))
+        self._cells: Dict[Tuple[int, int], List[Tuple[int, float, float]]] = {}
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self._d_lat)), int(math.floor(lng / self._d_lng))
+
+    def insert(self, item_id: int, lat: float, lng: float) -> None:
+        self._cells.setdefault(self._cell(lat, lng), []).append((item_id, lat, lng))
+
+    def within(self, lat: float, lng: float) -> Iterable[int]:
+        """
+        返回半径内的全部点编号（含自身）。
+        """
+        row, col = self._cell(lat, lng)
+        for dr in (-1, 0, 1):
+            for dc in (-1, 0, 1):
+                for item_id, p_lat, p_lng in self._cells.get((row + dr, col + dc), ()):
+                    if haversine_km(lat, lng, p_lat, p_lng) <= self.radius_km:
+                        yield item_id
+
+
+def _place_key(name: str) -> str:
+    return strip_admin_suffix(normalize_place_name(name))
+
+
+class PlacePoint(NamedTuple):
+    person: int
+    name: str
+    key: str
+    coord: Optional[Tuple[float, float]]
+    loc: Dict[str, object]
+
+
+def person_names(people: List[Dict[str, object]]) -> List[str]:
+    out: List[str] = []
+    for p_idx, person in enumerate(people):
+        info = person.get("person") or {}
+        out.append(str(info.get("name") or f"人物{p_idx + 1}"))
+    return out
+
+
+def collect_places(people: List[Dict[str, object]]) -> List[PlacePoint]:
+    """
+    展开全部人物的地点，person 为人物在 people 中的序号；坐标非法时 coord 为 None。
+    """
+    points: List[PlacePoint] = []
+    for p_idx, person in enumerate(people):
+        for loc in person.get("locations") or []:
+            name = str(loc.get("modernName") or loc.get("name") or "").strip()
+            coord = None
+            try:
+                lat, lng = float(loc.get("lat")), float(loc.get("lng"))
+                if abs(lat) <= 90 and abs(lng) <= 180:
+                    coord = (lat, lng)
+            except (TypeError, ValueError):
+                pass
+            if name or coord:
+                points.append(PlacePoint(p_idx, name, _place_key(name), coord, loc))
+    return points
+
+
+def cluster_places(points: List[PlacePoint], radius_km: float) -> List[List[int]]:
+    """
+    组长聚类，返回各组的点序号列表（按组内首个点的序号排序）：
+    - 有坐标的点并入半径内最近的组长所在组（同名组长优先），否则自成一组并担任组长；
+      组内各点到组长都不超过半径，组的跨度不超过 2×半径，不会沿着一串相邻点无限延伸
+    - 同名但坐标相距超过半径的地点（如北京市朝阳区与辽宁朝阳市）分属不同组
+    - 无坐标的点按规范化地名并入首个同名的组；没有同名组时与其他同名的无坐标点成组
+    """
+    if not points:
+        return []
+    groups: List[List[int]] = []
+    leaders: List[int] = []
+    grid = GridIndex(radius_km)
+    key_group: Dict[str, int] = {}
+    for i, point in enumerate(points):
+        if not point.coord:
+            continue
+        lat, lng = point.coord
+        best: Optional[Tuple[bool, float, int]] = None
+        for g in grid.within(lat, lng):
+            leader = points[leaders[g]]
+            dist = haversine_km(lat, lng, leader.coord[0], leader.coord[1])
+            if dist > radius_km:
+                continue
+            rank = (not point.key or leader.key != point.key, dist, g)
+            if best is None or rank < best:
+                best = rank
+        if best is None:
+            g = len(groups)
+            groups.append([])
+            leaders.append(i)
+            grid.insert(g, lat, lng)
+        else:
+            g = best[2]
+        groups[g].append(i)
+        if point.key:
+            key_group.setdefault(point.key, g)
+    for i, point in enumerate(points):
+        if point.coord:
+            continue
+        g = key_group.get(point.key) if point.key else None
+        if g is None:
+            g = len(groups)
+            groups.append([])
+            if point.key:
+                key_group[point.key] = g
+        groups[g].append(i)
+    for members in groups:
+        members.sort()
+    groups.sort(key=lambda members: members[0])
+    return groups
+
+
+def describe_group(points: List[PlacePoint], members: List[int]) -> Dict[str, object]:
+    """
+    组的代表名称（出现最多、最短的写法）、全部写法，以及有坐标时的中心点与离散程度。
+    """
+    name_counts: Dict[str, int] = {}
+    for i in members:
+        if points[i].name:
+            name_counts[points[i].name] = name_counts.get(points[i].name, 0) + 1
+    names = sorted(name_counts, key=lambda n: (-name_counts[n], len(n), n))
+    entry: Dict[str, object] = {"name": names[0] if names else "", "names": names}
+    coords = [points[i].coord for i in members if points[i].coord]
+    if coords:
+        lat, lng = centroid(coords)
+        entry.update({"lat": round(lat, 6), "lng": round(lng, 6), "spread_km": round(spread_km(coords), 3)})
+    return entry
+
+
+def find_overlap_groups(
+    people: List[Dict[str, object]], radius_km: Optional[float] = None
+) -> List[Dict[str, object]]:
+    """
+    返回至少两位人物共同到过的地点组，按人物数降序：
+    {name, count, persons, names, lat, lng, spread_km}；组内无坐标时不含 lat/lng/spread_km。
+    """
+    radius = default_radius_km() if radius_km is None else radius_km
+    points = collect_places(people)
+    names = person_names(people)
+    out: List[Dict[str, object]] = []
+    for members in cluster_places(points, radius):
+        person_ids = sorted({points[i].person for i in members})
+        if len(person_ids) < 2:
+            continue
+        entry = describe_group(points, members)
+        entry["count"] = len(person_ids)
+        entry["persons"] = [names[p] for p in person_ids]
+        out.append(entry)
+    out.sort(key=lambda x: (-x["count"], x["name"]))
+    return out
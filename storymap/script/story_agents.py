@@ -3,14 +3,33 @@
 提示词从 docs/ 目录加载，便于集中管理与调优。
 """
 import argparse
+import asyncio
+import hashlib
 import json
 import os
 import re
 import requests
+import threading
+import time
 import urllib3
-from typing import Dict, List, Optional
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
 
+from bounded_cache import BoundedCache, register_cache
+from cache_store import LlmResponseStore, resolve_store_path
 from dotenv import load_dotenv
+from llm_governor import (
+    GENERATE,
+    LlmQueueTimeout,
+    backoff_delay,
+    estimate_message_tokens,
+    estimate_tokens,
+    get_governor,
+)
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp 为可选依赖，未安装时异步客户端在线程池中执行同步请求
+    aiohttp = None
 
 # 禁用 urllib3 的不安全请求警告
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -22,6 +41,49 @@ local_env = os.path.join(os.path.dirname(__file__), ".env")
 load_dotenv(dotenv_path=local_env)
 
 _MAX_TEXT_LEN = 200
+# 上游限流（429）未给出 Retry-After 时全部通道暂停的秒数
+_DEFAULT_RETRY_AFTER = 5.0
+
+# 单次调用的最多尝试次数（含首次），同步、流式与异步调用一致
+_MAX_RETRIES = 3
+
+# 模型请求复用同一个连接池会话，避免每次调用重新建立 TCP/TLS 连接
+_LLM_KEEP_ALIVE = os.getenv("LLM_KEEP_ALIVE", "1").strip().lower() not in {"0", "off", "false", "no"}
+_LLM_SESSION: Optional[requests.Session] = None
+_LLM_SESSION_LOCK = threading.Lock()
+# 异步客户端单实例的连接数上限；在途请求总数仍由进程级调度器控制
+_LLM_ASYNC_MAX_CONCURRENCY = max(1, int(os.getenv("LLM_ASYNC_MAX_CONCURRENCY", "64")))
+
+# 模型响应缓存：键为 (模型, 工具, messages, temperature) 的摘要；LLM_CACHE=0 时完全绕过
+_LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1").strip().lower() not in {"0", "off", "false", "no"}
+_LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "604800"))
+_LLM_RESPONSES = register_cache(
+    BoundedCache("llm_response", int(os.getenv("LLM_CACHE_SIZE", "256")), ttl=_LLM_CACHE_TTL)
+)
+_LLM_RESPONSE_STORE: Optional[LlmResponseStore] = None
+_LLM_RESPONSE_STORE_LOCK = threading.Lock()
+_LLM_RESPONSE_DB_LIMIT = 5000
+
+def llm_max_concurrency() -> int:
+    return get_governor().max_in_flight
+
+def get_llm_session() -> requests.Session:
+    """
+    进程内共享的模型请求会话：连接池大小由 LLM_POOL_SIZE 控制，LLM_KEEP_ALIVE=0 时每次请求后关闭连接。
+    """
+    global _LLM_SESSION
+    if _LLM_SESSION is None:
+        with _LLM_SESSION_LOCK:
+            if _LLM_SESSION is None:
+                session = requests.Session()
+                # 连接池默认不小于调度器在途上限，首次建会话时才读取调度器配置
+                pool_size = max(1, int(os.getenv("LLM_POOL_SIZE", str(max(8, get_governor().max_in_flight)))))
+                adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers["Connection"] = "keep-alive" if _LLM_KEEP_ALIVE else "close"
+                _LLM_SESSION = session
+    return _LLM_SESSION
 
 def _validate_person(text: object) -> Optional[str]:
     if not isinstance(text, str):
@@ -33,12 +95,50 @@ def _validate_person(text: object) -> Optional[str]:
         return f"输入过长（最多 {_MAX_TEXT_LEN} 字符）"
     return None
 
-class StoryAgentLLM:
+def _response_key(model: str, tool_id: str, messages: List[Dict[str, str]], temperature: float) -> str:
+    raw = json.dumps([model, tool_id, messages, temperature], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _get_response_store() -> LlmResponseStore:
+    global _LLM_RESPONSE_STORE
+    if _LLM_RESPONSE_STORE is None:
+        with _LLM_RESPONSE_STORE_LOCK:
+            if _LLM_RESPONSE_STORE is None:
+                _LLM_RESPONSE_STORE = LlmResponseStore(resolve_store_path("LLM_CACHE_DB", "llm.sqlite3"))
+    return _LLM_RESPONSE_STORE
+
+def _cached_response(key: str) -> Optional[str]:
     """
-    主要职责：
-    - 统一管理模型 ID、API Key、Base URL 等基础配置
-    - 调用 Qveris 的 Execute Tool 接口来执行大模型对话
-    - 兼容 OpenAI 格式的 messages 输入
+    先查进程内 LRU，再查 SQLite；磁盘命中后回填内存。
+    """
+    content = _LLM_RESPONSES.get(key)
+    if content is None:
+        content = _get_response_store().get(key, ttl=_LLM_CACHE_TTL)
+        if content is not None:
+            _LLM_RESPONSES[key] = content
+    return content
+
+def _store_response(key: str, content: str) -> None:
+    _LLM_RESPONSES[key] = content
+    _get_response_store().put(key, content, ttl=_LLM_CACHE_TTL, max_rows=_LLM_RESPONSE_DB_LIMIT)
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    """
+    上游限流（HTTP 429）时返回建议等待的秒数，其余错误返回 None；兼容 requests 与 aiohttp 的异常。
+    """
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None) or getattr(exc, "status", None)
+    if status != 429:
+        return None
+    headers = getattr(response, "headers", None) or getattr(exc, "headers", None) or {}
+    try:
+        return max(0.0, float(headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return _DEFAULT_RETRY_AFTER
+
+class _QverisLLMBase:
+    """
+    同步与异步模型客户端的公共部分：配置读取、事件回调、响应缓存、请求构造与响应解析。
     """
     def __init__(
         self,
@@ -76,16 +176,87 @@ class StoryAgentLLM:
         except Exception:
             pass
 
-    def think(self, messages: List[Dict[str, str]], temperature: float = 0) -> Optional[str]:
+    def _lookup_cache(
+        self, messages: List[Dict[str, str]], temperature: float, cache: bool
+    ) -> Tuple[Optional[str], Optional[str]]:
         """
-        通过 Qveris Execute Tool 接口调用大模型。
+        返回 (缓存键, 命中的响应)；未开启缓存时缓存键为 None。
+        """
+        if not cache or not _LLM_CACHE_ENABLED:
+            return None, None
+        key = _response_key(self.model, self.tool_id, messages, temperature)
+        cached = _cached_response(key)
+        if cached is not None:
+            self._emit("✅ 命中模型响应缓存")
+        return key, cached
+
+    def _announce(self, stream: bool = False) -> None:
+        message = f"🧠 正在{'流式' if stream else ''}调用 {self.model} 模型 (via Qveris)..."
+        print(message)
+        self._emit(message)
+
+    def _queued(self, wait: float) -> None:
+        if wait >= 1:
+            self._emit(f"⏳ 排队等待模型名额 {wait:.1f} 秒")
+
+    def _queue_timeout(self, exc: LlmQueueTimeout) -> None:
+        print(f"❌ {exc}")
+        self._emit(f"❌ {exc}")
+
+    def _failed(self, attempt: int, exc: Exception) -> Optional[float]:
+        """
+        记录第 attempt 次尝试失败：还可重试时返回重试前的等待秒数，重试耗尽时返回 None。
+        """
+        print(f"⚠️ 第 {attempt}/{_MAX_RETRIES} 次尝试失败: {exc}")
+        if attempt >= _MAX_RETRIES:
+            print(f"❌ 调用LLM API最终失败: {exc}")
+            self._emit(f"❌ 调用LLM API最终失败: {exc}")
+            return None
+        wait_time = self._retry_wait(attempt, exc)
+        print(f"⏳ {wait_time:.1f} 秒后重试...")
+        return wait_time
+
+    def _succeeded(self, content: str, cache_key: Optional[str]) -> str:
+        """
+        成功返回后的收尾：非空内容写入响应缓存；空内容不视为错误，返回空字符串。
+        """
+        if not content:
+            print("⚠️ 模型返回内容为空")
+            return ""
+        self._emit("✅ 大语言模型响应成功")
+        if cache_key:
+            _store_response(cache_key, content)
+        return content
+
+    def _retry_wait(self, attempt: int, exc: Exception) -> float:
+        """
+        失败后的重试等待：上游限流时按 Retry-After 暂停调度器全部通道，其余按带抖动的指数退避。
+        """
+        delay = backoff_delay(attempt)
+        retry_after = _retry_after(exc)
+        if retry_after is not None:
+            get_governor().pause(retry_after)
+            delay = max(delay, retry_after)
+        return delay
+
+    @staticmethod
+    def _tokens_used(data: Dict[str, object], prompt_tokens: int, content: str) -> int:
+        """
+        本次调用的实际 token 数：优先取响应中的 usage.total_tokens，缺失时按提示词与输出长度估算。
+        """
+        result = data.get("result") if isinstance(data, dict) else None
+        tool_result = result.get("data") if isinstance(result, dict) else None
+        usage = tool_result.get("usage") if isinstance(tool_result, dict) else None
+        if isinstance(usage, dict) and isinstance(usage.get("total_tokens"), int):
+            return usage["total_tokens"]
+        return prompt_tokens + estimate_tokens(content)
+
+    def _request(
+        self, messages: List[Dict[str, str]], temperature: float, stream: bool = False
+    ) -> Tuple[str, Dict[str, str], Dict[str, object]]:
+        """
+        构造 Qveris Execute Tool 请求的 url、headers 与 payload。
         """
-        import time
-        max_retries = 3
-        
-        print(f"🧠 正在调用 {self.model} 模型 (via Qveris)...")
-        self._emit(f"🧠 正在调用 {self.model} 模型 (via Qveris)...")
-
         url = f"{self.baseUrl.rstrip('/')}/tools/execute"
         headers = {
             "Authorization": f"Bearer {self.apiKey}",
@@ -100,62 +271,361 @@ class StoryAgentLLM:
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.apiKey}" 
         }
+        if stream:
+            params_to_tool["stream"] = True
 
         payload = {
             "tool_id": self.tool_id,
             "parameters": params_to_tool
         }
+        return url, headers, payload
+
+    @staticmethod
+    def _content_of(data: Dict[str, object]) -> str:
+        """
+        从 Qveris 返回的 JSON 中取出模型输出文本；执行失败时抛出 RuntimeError。
+        """
+        if not data.get("success"):
+            error_msg = data.get("error_message") or "Unknown error"
+            raise RuntimeError(f"Qveris execution failed: {error_msg}")
+
+        tool_result = data.get("result", {}).get("data", {})
+        
+        # 解析 OpenAI 格式的响应
+        content = ""
+        if isinstance(tool_result, dict):
+            choices = tool_result.get("choices", [])
+            if choices and len(choices) > 0:
+                message = choices[0].get("message", {})
+                content = message.get("content", "")
+        
+        # 如果 result.data 直接是字符串（某些工具可能直接返回内容）
+        if not content and isinstance(tool_result, str):
+            content = tool_result
+        return content
+
+    @staticmethod
+    def _delta_of(event: Dict[str, object]) -> str:
+        """
+        SSE 单个事件中的增量文本；兼容 Qveris 包装（result.data）与 OpenAI chunk 两种形式。
+        """
+        if isinstance(event.get("result"), dict):
+            event = event["result"].get("data") or {}
+        if not isinstance(event, dict):
+            return event if isinstance(event, str) else ""
+        choices = event.get("choices") or []
+        if not choices:
+            return ""
+        choice = choices[0]
+        delta = choice.get("delta") or choice.get("message") or {}
+        return delta.get("content") or ""
+
+
 
-        last_error = None
-        for attempt in range(1, max_retries + 1):
+class StoryAgentLLM(_QverisLLMBase):
+    """
+    主要职责：
+    - 统一管理模型 ID、API Key、Base URL 等基础配置
+    - 调用 Qveris 的 Execute Tool 接口来执行大模型对话
+    - 兼容 OpenAI 格式的 messages 输入
+    """
+    def __init__(
+        self,
+        model: Optional[str] = None,
+        apiKey: Optional[str] = None,
+        baseUrl: Optional[str] = None,
+        timeout: Optional[int] = None,
+        event_callback: Optional[callable] = None,
+        session: Optional[requests.Session] = None,
+    ):
+        super().__init__(model, apiKey, baseUrl, timeout, event_callback)
+        # 默认使用进程内共享会话，单例客户端与按任务创建的客户端共用同一连接池
+        self.session = session or get_llm_session()
+
+    def _iter_stream(self, resp: requests.Response) -> Iterator[str]:
+        content_type = resp.headers.get("Content-Type", "")
+        if "text/event-stream" not in content_type:
+            # 服务端不支持流式时返回普通 JSON，整体作为一段产出
+            content = self._content_of(resp.json())
+            if content:
+                yield content
+            return
+        resp.encoding = "utf-8"
+        for line in resp.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            body = line[5:].strip()
+            if body == "[DONE]":
+                break
+            event = json.loads(body)
+            if isinstance(event, dict) and event.get("success") is False:
+                raise RuntimeError(f"Qveris execution failed: {event.get('error_message') or 'Unknown error'}")
+            delta = self._delta_of(event) if isinstance(event, dict) else ""
+            if delta:
+                yield delta
+
+    def _attempts(
+        self, lane: str, prompt_tokens: int, send: Callable[[], Iterator[str]]
+    ) -> Iterator[str]:
+        """
+        同步调用的重试循环，think 与 think_stream 共用：每次尝试向调度器申请名额后执行 send，
+        逐段转发其产出，名额在重试等待前归还。send 为生成器函数，返回值为本次实际 token 数。
+        尚未产出内容时失败按 _failed 重试；已产出部分内容后失败抛出 RuntimeError。
+        生成器的返回值为完整输出，排队超时或重试耗尽时为 None。
+        """
+        governor = get_governor()
+        for attempt in range(1, _MAX_RETRIES + 1):
+            # 只在请求期间占用调度器名额，重试等待时释放
             try:
-                # Qveris execute tool 接口通常不支持流式返回，这里使用同步调用
-                # 禁用 SSL 验证以解决证书错误
-                resp = requests.post(url, headers=headers, json=payload, timeout=self.timeout, verify=False)
+                ticket = governor.acquire(lane, tokens=prompt_tokens)
+            except LlmQueueTimeout as e:
+                self._queue_timeout(e)
+                return None
+            self._queued(ticket.wait)
+            parts: List[str] = []
+            used: Optional[int] = None
+            error: Optional[Exception] = None
+            chunks = send()
+            try:
+                while True:
+                    try:
+                        delta = next(chunks)
+                    except StopIteration as stop:
+                        used = stop.value
+                        break
+                    parts.append(delta)
+                    yield delta
+            except Exception as e:
+                error = e
+            finally:
+                # 调用方中途停止读取时同样关闭响应、归还名额，用量按已产出内容估算
+                chunks.close()
+                if used is None and parts:
+                    used = prompt_tokens + estimate_tokens("".join(parts))
+                governor.release(ticket, used)
+            if error is None:
+                return "".join(parts)
+            if parts:
+                self._emit(f"❌ 流式响应中断: {error}")
+                raise RuntimeError(f"流式响应中断: {error}") from error
+            wait_time = self._failed(attempt, error)
+            if wait_time is None:
+                return None
+            time.sleep(wait_time)
+        return None
+
+    def think_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0,
+        cache: bool = False,
+        lane: str = GENERATE,
+    ) -> Iterator[str]:
+        """
+        流式调用大模型，逐段产出输出文本（SSE）；服务端返回普通 JSON 时整体产出一段。
+        尚未产出内容时失败按 think 的策略重试，全部失败则不产出任何内容；
+        已产出部分内容后中断抛出 RuntimeError，由调用方决定是否改用 think 重新生成。
+        整个读取过程占用调度器的一个名额；cache、lane 语义与 think 相同，命中缓存时一次性产出缓存内容。
+        """
+        cache_key, cached = self._lookup_cache(messages, temperature, cache)
+        if cached is not None:
+            yield cached
+            return
+
+        self._announce(stream=True)
+        url, headers, payload = self._request(messages, temperature, stream=True)
+        prompt_tokens = estimate_message_tokens(messages)
+
+        def send() -> Iterator[str]:
+            parts: List[str] = []
+            with self.session.post(
+                url, headers=headers, json=payload, timeout=self.timeout, verify=False, stream=True
+            ) as resp:
                 resp.raise_for_status()
-                
-                data = resp.json()
-                
-                if not data.get("success"):
-                    error_msg = data.get("error_message") or "Unknown error"
-                    raise RuntimeError(f"Qveris execution failed: {error_msg}")
-
-                tool_result = data.get("result", {}).get("data", {})
-                
-                # 解析 OpenAI 格式的响应
-                content = ""
-                if isinstance(tool_result, dict):
-                    choices = tool_result.get("choices", [])
-                    if choices and len(choices) > 0:
-                        message = choices[0].get("message", {})
-                        content = message.get("content", "")
-                
-                # 如果 result.data 直接是字符串（某些工具可能直接返回内容）
-                if not content and isinstance(tool_result, str):
-                    content = tool_result
-
-                if content:
-                    print(content)
-                    self._emit(f"✅ 大语言模型响应成功")
-                    return content
-                else:
-                    print("⚠️ 模型返回内容为空")
-                    # 空内容不视为错误，直接返回空字符串
-                    return ""
+                for delta in self._iter_stream(resp):
+                    parts.append(delta)
+                    yield delta
+            return prompt_tokens + estimate_tokens("".join(parts))
+
+        content = yield from self._attempts(lane, prompt_tokens, send)
+        if content is not None:
+            self._succeeded(content, cache_key)
+
+    def think(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0,
+        cache: bool = False,
+        lane: str = GENERATE,
+    ) -> Optional[str]:
+        """
+        通过 Qveris Execute Tool 接口调用大模型。
+        cache=True 时相同请求直接返回缓存的响应（仅缓存非空结果）。
+        lane 为调度通道（interactive / generate / batch），名额紧张时高优先级通道先获准。
+        """
+        cache_key, cached = self._lookup_cache(messages, temperature, cache)
+        if cached is not None:
+            return cached
+
+        self._announce()
+        url, headers, payload = self._request(messages, temperature)
+        prompt_tokens = estimate_message_tokens(messages)
+
+        def send() -> Iterator[str]:
+            # 同步调用，整段返回；边生成边处理使用 think_stream
+            # 禁用 SSL 验证以解决证书错误
+            resp = self.session.post(url, headers=headers, json=payload, timeout=self.timeout, verify=False)
+            resp.raise_for_status()
+            data = resp.json()
+            content = self._content_of(data)
+            if content:
+                yield content
+            return self._tokens_used(data, prompt_tokens, content)
+
+        attempts = self._attempts(lane, prompt_tokens, send)
+        try:
+            while True:
+                next(attempts)
+        except StopIteration as stop:
+            content = stop.value
+        if content is None:
+            return None
+        if content:
+            print(content)
+        return self._succeeded(content, cache_key)
+
+    def think_many(
+        self,
+        batches: List[List[Dict[str, str]]],
+        temperature: float = 0,
+        cache: bool = False,
+        lane: str = GENERATE,
+    ) -> List[Optional[str]]:
+        """
+        同步包装：在新事件循环中由 AsyncStoryAgentLLM 并发执行多组对话，返回与输入同序的结果。
+        不能在已运行的事件循环内调用，此时应直接使用 AsyncStoryAgentLLM。
+        """
+        async def _run() -> List[Optional[str]]:
+            async with AsyncStoryAgentLLM(
+                self.model, self.apiKey, self.baseUrl, self.timeout, self.event_callback
+            ) as client:
+                return await asyncio.gather(*(client.think(m, temperature, cache, lane) for m in batches))
+
+        return list(asyncio.run(_run())) if batches else []
+
 
+class AsyncStoryAgentLLM(_QverisLLMBase):
+    """
+    asyncio 版模型客户端：think 与 StoryAgentLLM.think 语义一致（重试、事件回调、响应缓存、内容解析、调度通道），
+    一个事件循环可同时挂起数百个模型请求，排队时不占用线程。
+    - 与同步客户端共用进程级调度器（llm_governor），在途上限与令牌预算对两者一并生效
+    - 安装 aiohttp 时直接发起异步 HTTP 请求，单实例连接数上限由 LLM_ASYNC_MAX_CONCURRENCY 控制
+    - 未安装 aiohttp 时获准后在线程池中执行同步请求（共享连接池），结果一致
+    - 实例持有的 aiohttp 会话绑定首次使用时的事件循环，用完后调用 aclose 或以 async with 管理
+    """
+    def __init__(
+        self,
+        model: Optional[str] = None,
+        apiKey: Optional[str] = None,
+        baseUrl: Optional[str] = None,
+        timeout: Optional[int] = None,
+        event_callback: Optional[callable] = None,
+        max_concurrency: Optional[int] = None,
+    ):
+        super().__init__(model, apiKey, baseUrl, timeout, event_callback)
+        self.max_concurrency = max(1, max_concurrency or _LLM_ASYNC_MAX_CONCURRENCY)
+        self._session = None
+
+    async def __aenter__(self) -> "AsyncStoryAgentLLM":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, force_close=not _LLM_KEEP_ALIVE, ssl=False)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def _post(self, url: str, headers: Dict[str, str], payload: Dict[str, object]) -> Dict[str, object]:
+        if aiohttp is None:
+            return await asyncio.to_thread(self._post_blocking, url, headers, payload)
+        async with self._get_session().post(url, headers=headers, json=payload) as resp:
+            resp.raise_for_status()
+            return await resp.json(content_type=None)
+
+    def _post_blocking(self, url: str, headers: Dict[str, str], payload: Dict[str, object]) -> Dict[str, object]:
+        resp = get_llm_session().post(url, headers=headers, json=payload, timeout=self.timeout, verify=False)
+        resp.raise_for_status()
+        return resp.json()
+
+    async def _attempts(
+        self, lane: str, prompt_tokens: int, send: Callable[[], Awaitable[Tuple[str, int]]]
+    ) -> Optional[str]:
+        """
+        异步调用的重试循环，策略与 StoryAgentLLM._attempts 相同；send 返回 (输出, 实际 token 数)。
+        """
+        governor = get_governor()
+        for attempt in range(1, _MAX_RETRIES + 1):
+            # 只在请求期间占用调度器名额，重试等待时释放
+            try:
+                ticket = await governor.acquire_async(lane, tokens=prompt_tokens)
+            except LlmQueueTimeout as e:
+                self._queue_timeout(e)
+                return None
+            self._queued(ticket.wait)
+            used: Optional[int] = None
+            try:
+                content, used = await send()
+                return content
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                last_error = e
-                print(f"⚠️ 第 {attempt}/{max_retries} 次尝试失败: {e}")
-                if attempt < max_retries:
-                    wait_time = 2 * attempt  # 简单的指数退避
-                    print(f"⏳ {wait_time} 秒后重试...")
-                    time.sleep(wait_time)
-                else:
-                    print(f"❌ 调用LLM API最终失败: {e}")
-                    self._emit(f"❌ 调用LLM API最终失败: {e}")
-        
+                error = e
+            finally:
+                governor.release(ticket, used)
+            wait_time = self._failed(attempt, error)
+            if wait_time is None:
+                return None
+            await asyncio.sleep(wait_time)
         return None
 
+    async def think(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0,
+        cache: bool = False,
+        lane: str = GENERATE,
+    ) -> Optional[str]:
+        """
+        异步调用大模型：成功返回内容，模型返回空内容时返回空字符串，重试耗尽或排队超时返回 None。
+        """
+        cache_key, cached = self._lookup_cache(messages, temperature, cache)
+        if cached is not None:
+            return cached
+
+        self._announce()
+        url, headers, payload = self._request(messages, temperature)
+        prompt_tokens = estimate_message_tokens(messages)
+
+        async def send() -> Tuple[str, int]:
+            data = await self._post(url, headers, payload)
+            content = self._content_of(data)
+            return content, self._tokens_used(data, prompt_tokens, content)
+
+        content = await self._attempts(lane, prompt_tokens, send)
+        if content is None:
+            return None
+        return self._succeeded(content, cache_key)
+
 
 def _read_prompt(relpath: str) -> str:
     """
@@ -173,9 +643,16 @@ def _read_prompt(relpath: str) -> str:
         return f.read()
 
 
-def generate_historical_markdown(llm: "StoryAgentLLM", person: str) -> Optional[str]:
+def generate_historical_markdown(
+    llm: "StoryAgentLLM",
+    person: str,
+    use_cache: bool = True,
+    on_chunk: Optional[Callable[[str], None]] = None,
+) -> Optional[str]:
     """
-    生成指定人物的生平 Markdown。
+    生成指定人物的生平 Markdown；use_cache=False 时绕过响应缓存重新生成。
+    传入 on_chunk 时改为流式生成，每收到一段文本即回调，调用方可边生成边处理已完整的内容；
+    流式中途断开时回退为一次性生成。
     """
     system_prompt = _read_prompt("story_system_prompt.md")
     user_prompt = f"请整理历史人物「{person}」的生平信息，并按要求输出。"
@@ -183,10 +660,19 @@ def generate_historical_markdown(llm: "StoryAgentLLM", person: str) -> Optional[
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt},
     ]
-    return llm.think(messages, temperature=0.1)
+    if on_chunk is None:
+        return llm.think(messages, temperature=0.1, cache=use_cache)
+    parts: List[str] = []
+    try:
+        for chunk in llm.think_stream(messages, temperature=0.1, cache=use_cache):
+            parts.append(chunk)
+            on_chunk(chunk)
+    except RuntimeError:
+        return llm.think(messages, temperature=0.1, cache=use_cache)
+    return "".join(parts) or None
 
 
-def extract_historical_figures(llm: "StoryAgentLLM", text: str) -> List[str]:
+def extract_historical_figures(llm: "StoryAgentLLM", text: str, use_cache: bool = True) -> List[str]:
     """
     从输入文本中抽取历史人物名称列表。
     """
@@ -197,7 +683,7 @@ def extract_historical_figures(llm: "StoryAgentLLM", text: str) -> List[str]:
         {"role": "system", "content": sys_prompt},
         {"role": "user", "content": text},
     ]
-    raw = llm.think(messages, temperature=0)
+    raw = llm.think(messages, temperature=0, cache=use_cache)
     if not raw:
         return []
     try:
@@ -265,6 +751,9 @@ def main():
     parser.add_argument(
         "-p", "--person", help="历史人物姓名，例如：李白、杜甫、诸葛亮", required=False
     )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="忽略模型响应缓存，重新调用模型生成"
+    )
     args = parser.parse_args()
 
     if args.person:
@@ -274,12 +763,13 @@ def main():
                 print(err)
                 return
             client = StoryAgentLLM()
-            targets = extract_historical_figures(client, args.person)
+            use_cache = not args.no_cache
+            targets = extract_historical_figures(client, args.person, use_cache=use_cache)
             if not targets:
                 print("未识别到历史人物。")
                 return
             for person in targets:
-                md = generate_historical_markdown(client, person)
+                md = generate_historical_markdown(client, person, use_cache=use_cache)
                 if md:
                     saved = save_markdown(person, md)
                     print(f"已生成：{saved}")
@@ -1,12 +1,15 @@
 """
 简要说明：
 - 读取人物生平 Markdown，解析“年份”表中的地点与事件列
-- 调用 geocode_city 获取 GCJ-02 坐标
+- 调用 geocode_many 批量获取 GCJ-02 坐标
 - 生成可交互 HTML 地图：支持行政/地形/Esri 多种底图，连线展示顺序，Markdown 弹窗显示大事
 """
 import argparse
 import atexit
+import copy
 import csv
+import glob
+import hashlib
 import io
 import json
 import logging
@@ -14,18 +17,30 @@ import os
 import re
 import threading
 import time
+import unicodedata
 import uuid
 from concurrent.futures import ThreadPoolExecutor
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from typing import Dict, List, Optional, Tuple
 from urllib.parse import parse_qs, urlparse
 
+from bounded_cache import BoundedCache, cache_stats, register_cache
+from cache_store import ProfileStore, SplitStore, resolve_store_path
+from coord_transform import gcj02_to_wgs84
+from copresence import find_copresence
 from dotenv import load_dotenv
+from geo_distance import cumulative_km
+from llm_governor import BATCH, INTERACTIVE, governor_status
 from map_client import (
     append_coords_section,
     compute_total_distance_km,
-    geocode_city,
+    geocode_data_version,
+    geocode_many,
+    geocode_provider_status,
     insert_distance_intro,
+    list_geocode_misses,
+    preload_geocodes,
+    timeline_row_place,
 )
 from map_html_renderer import (
     build_info_panel_html,
@@ -33,10 +48,14 @@ from map_html_renderer import (
     render_osm_html,
     render_profile_html,
 )
+from md_document import MdStreamItem, MdStreamParser, MdSubsection, MdTableRow, parse_markdown
+from place_split import split_place_text
+from spatial_index import find_overlap_groups
 from story_agents import (
     StoryAgentLLM,
     extract_historical_figures,
     generate_historical_markdown,
+    llm_max_concurrency,
     save_markdown,
 )
 
@@ -59,66 +78,15 @@ def _parse_timeline_table(md: str) -> tuple[List[str], List[List[str]]]:
     """
     if not isinstance(md, str):
         return [], []
-    lines = md.splitlines()
-    in_sec = False
-    header: List[str] = []
-    rows: List[List[str]] = []
-    table_started = False
-    header_seen = False
-    for line in lines:
-        if line.strip().startswith("## "):
-            title = line.strip().lstrip("#").strip()
-            # 仅解析“年份”章节下第一张表
-            in_sec = title.startswith("年份")
-            table_started = False
-            header_seen = False
-            header = []
-            continue
-        if not in_sec:
-            continue
-        if line.strip().startswith("|") and not table_started:
-            header = [c.strip() for c in line.strip().strip("|").split("|")]
-            table_started = True
-            continue
-        if table_started:
-            if re.match(r"^\|\s*-{3,}\s*\|", line.strip()):
-                header_seen = True
-                continue
-            if header_seen and line.strip().startswith("|"):
-                rows.append([c.strip() for c in line.strip().strip("|").split("|")])
-            else:
-                # 遇到非表格行即停止，避免越界读取
-                break
-    if header and rows:
-        return header, rows
-    header = []
-    rows = []
-    table_started = False
-    header_seen = False
-    for line in lines:
-        if line.strip().startswith("|") and not table_started:
-            header = [c.strip() for c in line.strip().strip("|").split("|")]
-            table_started = True
-            continue
-        if table_started:
-            if re.match(r"^\|\s*-{3,}\s*\|", line.strip()):
-                header_seen = True
-                continue
-            if header_seen and line.strip().startswith("|"):
-                rows.append([c.strip() for c in line.strip().strip("|").split("|")])
-            else:
-                if header and rows and any(
-                    any(k in c for k in ("现称", "事件", "年号", "公元")) for c in header
-                ):
-                    return header, rows
-                header = []
-                rows = []
-                table_started = False
-                header_seen = False
-    if header and rows and any(
-        any(k in c for k in ("现称", "事件", "年号", "公元")) for c in header
-    ):
-        return header, rows
+    doc = parse_markdown(md)
+    # 优先取“年份”章节下第一张表
+    table = doc.first_table(lambda title: title.startswith("年份"))
+    if table and table.rows:
+        return list(table.header), [list(row) for row in table.rows]
+    # 退化为全文第一张带现称/事件/年号/公元列的表
+    for table in doc.tables():
+        if table.rows and any(any(k in c for k in ("现称", "事件", "年号", "公元")) for c in table.header):
+            return list(table.header), [list(row) for row in table.rows]
     return [], []
 
 
@@ -128,26 +96,9 @@ def _parse_basic_info(md: str) -> Dict[str, str]:
     """
     if not isinstance(md, str):
         return {}
-    lines = md.splitlines()
-    in_profile = False
-    in_basic = False
     info: Dict[str, str] = {}
-    for line in lines:
-        if line.strip().startswith("## "):
-            title = line.strip().lstrip("#").strip()
-            in_profile = "人物档案" in title
-            in_basic = False
-            continue
-        if not in_profile:
-            continue
-        if line.strip().startswith("### "):
-            title = line.strip().lstrip("#").strip()
-            in_basic = "基本信息" in title
-            continue
-        if in_basic:
-            m = re.match(r"-\s*\*\*(.+?)\*\*：\s*(.+)", line.strip())
-            if m:
-                info[m.group(1).strip()] = m.group(2).strip()
+    for sub in parse_markdown(md).subsections(lambda t: "人物档案" in t, lambda t: "基本信息" in t):
+        info.update(sub.fields)
     return info
 
 
@@ -157,24 +108,9 @@ def _parse_overview(md: str) -> str:
     """
     if not isinstance(md, str):
         return ""
-    lines = md.splitlines()
-    in_profile = False
-    in_overview = False
     buf: List[str] = []
-    for line in lines:
-        if line.strip().startswith("## "):
-            title = line.strip().lstrip("#").strip()
-            in_profile = "人物档案" in title
-            if not in_profile:
-                in_overview = False
-            continue
-        if not in_profile:
-            continue
-        if line.strip().startswith("### "):
-            title = line.strip().lstrip("#").strip()
-            in_overview = "生平概述" in title
-            continue
-        if in_overview:
+    for sub in parse_markdown(md).subsections(lambda t: "人物档案" in t, lambda t: "生平概述" in t):
+        for line in sub.lines:
             t = line.strip()
             if not t or re.match(r"^-{3,}$", t):
                 continue
@@ -203,78 +139,96 @@ def _split_quote_lines(text: str) -> List[str]:
     return parts
 
 
+def _location_from_subsection(sub: MdSubsection) -> Dict[str, str]:
+    raw_title = sub.title
+    loc_type = "normal"
+    if "出生地" in raw_title:
+        loc_type = "birth"
+    elif "去世地" in raw_title:
+        loc_type = "death"
+    if "：" in raw_title:
+        name = raw_title.split("：", 1)[-1].strip()
+    else:
+        name = raw_title
+    name = re.sub(r"^[^0-9A-Za-z\u4e00-\u9fff]+", "", name).strip()
+    current = {
+        "name": name,
+        "type": loc_type,
+        "time": "",
+        "location": "",
+        "event": "",
+        "significance": "",
+        "duration": "",
+        "quotes": "",
+    }
+    for key, val in sub.fields:
+        if key in {"时间", "时段", "时期", "年代", "公元纪年", "年号纪年"}:
+            current["time"] = val
+        elif key in {"位置", "地点"}:
+            current["location"] = val
+        elif key in {"事迹", "背景", "经过", "事件"}:
+            current["event"] = (current["event"] + " " + val).strip()
+        elif key in {"意义", "影响"}:
+            current["significance"] = val
+        elif key in {"停留", "停留时间", "停留时长", "居留", "驻留", "逗留", "在此时间", "在此时长"}:
+            current["duration"] = val
+        elif key in {"名篇名句", "代表名句", "名句", "诗句"}:
+            current["quotes"] = (current["quotes"] + "；" + val).strip("；")
+    return current
+
+
 def _parse_location_sections(md: str) -> List[Dict[str, str]]:
     """
     解析“人生历程/重要地点”段落为结构化地点事件列表。
     """
     if not isinstance(md, str):
         return []
-    lines = md.splitlines()
-    in_section = False
-    current: Dict[str, str] | None = None
     locations: List[Dict[str, str]] = []
-    for line in lines:
-        if line.strip().startswith("## "):
-            title = line.strip().lstrip("#").strip()
-            if "人生历程" in title or "重要地点" in title:
-                in_section = True
-                current = None
-                continue
-            if in_section:
-                break
-        if not in_section:
-            continue
-        if line.strip().startswith("### "):
-            if current:
-                locations.append(current)
-            raw_title = line.strip().lstrip("#").strip()
-            loc_type = "normal"
-            if "出生地" in raw_title:
-                loc_type = "birth"
-            elif "去世地" in raw_title:
-                loc_type = "death"
-            if "：" in raw_title:
-                name = raw_title.split("：", 1)[-1].strip()
-            else:
-                name = raw_title
-            name = re.sub(r"^[^0-9A-Za-z\u4e00-\u9fff]+", "", name).strip()
-            current = {
-                "name": name,
-                "type": loc_type,
-                "time": "",
-                "location": "",
-                "event": "",
-                "significance": "",
-                "duration": "",
-                "quotes": "",
-            }
-            continue
-        if current:
-            m = re.match(r"-\s*\*\*(.+?)\*\*：\s*(.+)", line.strip())
-            if m:
-                key = m.group(1).strip()
-                val = m.group(2).strip()
-                if key in {"时间", "时段", "时期", "年代", "公元纪年", "年号纪年"}:
-                    current["time"] = val
-                elif key in {"位置", "地点"}:
-                    current["location"] = val
-                elif key in {"事迹", "背景", "经过", "事件"}:
-                    current["event"] = (current["event"] + " " + val).strip()
-                elif key in {"意义", "影响"}:
-                    current["significance"] = val
-                elif key in {"停留", "停留时间", "停留时长", "居留", "驻留", "逗留", "在此时间", "在此时长"}:
-                    current["duration"] = val
-                elif key in {"名篇名句", "代表名句", "名句", "诗句"}:
-                    current["quotes"] = (current["quotes"] + "；" + val).strip("；")
-    if current:
-        locations.append(current)
+    in_section = False
+    for section in parse_markdown(md).sections:
+        if "人生历程" in section.title or "重要地点" in section.title:
+            in_section = True
+            locations.extend(_location_from_subsection(sub) for sub in section.subsections)
+        elif in_section:
+            break
     return locations
 
 
 _LLM_CLIENT: Optional[StoryAgentLLM] = None
 _LLM_LOCK = threading.Lock()
-_SPLIT_CACHE: Dict[str, Tuple[str, str]] = {}
+_SPLIT_CACHE = register_cache(BoundedCache("split", int(os.getenv("STORY_MAP_SPLIT_CACHE_SIZE", "5000"))))
+# 人物页数据按 Markdown 内容摘要缓存；构建逻辑的变化会影响输出时递增版本号，使旧缓存失效
+_PROFILE_VERSION = 2
+_PROFILE_CACHE = register_cache(BoundedCache("profile", int(os.getenv("STORY_MAP_PROFILE_CACHE_SIZE", "200"))))
+_PROFILE_STORE: Optional[ProfileStore] = None
+_PROFILE_STORE_LOCK = threading.Lock()
+_PROFILE_DB_LIMIT = 2000
 _CACHE_LOCK = threading.Lock()
+_SPLIT_COUNTS = {"local": 0, "llm": 0}
+_SPLIT_CHUNK_SIZE = 20
+# 生平流式生成开关（STORY_MAP_STREAM=0 时一次性生成）与边生成边预取的后台线程数
+_STREAM_ENABLED = os.getenv("STORY_MAP_STREAM", "1").strip().lower() not in {"0", "off", "false", "no"}
+_PREFETCH_WORKERS = 4
+# 预取线程池全进程共享（线程按需创建），避免每生成一个人物就新建一组线程
+_PREFETCH_POOL = ThreadPoolExecutor(max_workers=_PREFETCH_WORKERS, thread_name_prefix="story-prefetch")
+_SPLIT_BATCH_PROMPT = (
+    "你是地名拆解助手。请按输入顺序输出严格 JSON 数组，"
+    "元素格式为 {\"text\":\"\",\"ancient\":\"\",\"modern\":\"\"}。"
+    "无法判断时 ancient/modern 置空。不要输出多余文本。"
+)
+_SPLIT_PROMPTS = (
+    "你是地名拆解助手。仅返回严格 JSON：{\"ancient\":\"\",\"modern\":\"\"}。不要输出多余文本。无法判断时输出空字符串。",
+    "请只输出 JSON 对象，不要任何解释：{\"ancient\":\"古称或历史地名\",\"modern\":\"现代地名\"}。如果无法判断，两个值都输出空字符串。",
+)
+# 拆解结果按（模型 ID, 提示词版本）持久化；修改上述提示词后旧结果自动失效
+_SPLIT_PROMPT_VERSION = hashlib.sha1(
+    json.dumps([_SPLIT_BATCH_PROMPT, *_SPLIT_PROMPTS], ensure_ascii=False).encode("utf-8")
+).hexdigest()[:12]
+_SPLIT_STORE: Optional[SplitStore] = None
+_SPLIT_LOADED: Optional[Tuple[str, str]] = None
+_SPLIT_STORE_LOCK = threading.Lock()
+# 其他模型或提示词版本的拆解记录超过该秒数未写入才清理（默认 30 天）
+_SPLIT_STALE_TTL = float(os.getenv("STORY_MAP_SPLIT_STALE_TTL", "2592000"))
 _MAX_TEXT_LEN = 200
 _ALLOWED_ORIGINS = [o.strip() for o in os.getenv("STORY_MAP_ALLOWED_ORIGINS", "*").split(",") if o.strip()]
 
@@ -377,68 +331,157 @@ def _parse_split_batch(raw: str, expected: List[str]) -> Dict[str, Tuple[str, st
     return mapping
 
 
+def _split_key(text: str) -> str:
+    return re.sub(r"\s+", "", unicodedata.normalize("NFKC", text or ""))
+
+
+def _split_scope() -> Tuple[str, str]:
+    return (os.getenv("LLM_MODEL_ID") or "").strip(), _SPLIT_PROMPT_VERSION
+
+
+def _get_split_store() -> SplitStore:
+    """
+    懒加载拆解结果持久化缓存。首次使用（或模型切换）时清理其他模型、旧提示词版本中长期未写入的记录，
+    并把当前版本的记录预热到进程内缓存。
+    """
+    global _SPLIT_STORE, _SPLIT_LOADED
+    scope = _split_scope()
+    if _SPLIT_STORE is not None and _SPLIT_LOADED == scope:
+        return _SPLIT_STORE
+    with _SPLIT_STORE_LOCK:
+        if _SPLIT_STORE is None:
+            _SPLIT_STORE = SplitStore(resolve_store_path("STORY_MAP_SPLIT_DB", "split.sqlite3"))
+        if _SPLIT_LOADED != scope:
+            purged = _SPLIT_STORE.purge_stale(*scope, max_age=_SPLIT_STALE_TTL)
+            rows = _SPLIT_STORE.load(*scope, limit=_SPLIT_CACHE.max_size)
+            with _CACHE_LOCK:
+                if _SPLIT_LOADED is not None:
+                    # 模型切换后，进程内旧模型的拆解结果一并作废
+                    _SPLIT_CACHE.clear()
+                # 按写入时间从旧到新放入，最近使用的记录最后被淘汰
+                for key, value in reversed(list(rows.items())):
+                    if key not in _SPLIT_CACHE:
+                        _SPLIT_CACHE[key] = value
+            _SPLIT_LOADED = scope
+            _LOGGER.info("split_store_loaded model=%s rows=%s purged=%s", scope[0], len(rows), purged)
+    return _SPLIT_STORE
+
+
+def _persist_splits(items: Dict[str, Tuple[str, str]]) -> None:
+    # 只保存模型给出结果的条目；调用失败或无法判断的文本下次重启后重新拆解
+    solved = {key: value for key, value in items.items() if value[0] or value[1]}
+    if solved:
+        _get_split_store().put_many(solved, *_split_scope())
+
+
+def _read_persisted_splits(keys: List[str]) -> Dict[str, Tuple[str, str]]:
+    """
+    进程内缓存未命中的拆解键回查持久化库（被 LRU 淘汰、超出预热条数或由其他进程写入的记录），
+    命中的结果回填进程内缓存。
+    """
+    if not keys:
+        return {}
+    found = _get_split_store().get_many(keys, *_split_scope())
+    if found:
+        with _CACHE_LOCK:
+            _SPLIT_CACHE.update(found)
+    return found
+
+
 def _batch_split_ancient_modern(
     loc_texts: List[str], event_callback: Optional[callable] = None
 ) -> Dict[str, Tuple[str, str]]:
     texts = [t.strip() for t in loc_texts if t and t.strip()]
     if not texts:
         return {}
-    seen = set()
-    ordered: List[str] = []
-    for t in texts:
-        if t in seen:
-            continue
-        seen.add(t)
-        ordered.append(t)
+    _get_split_store()
+    ordered = list(dict.fromkeys(texts))
+    keys = {t: _split_key(t) for t in ordered}
+    pending: List[str] = []
+    queued = set()
     with _CACHE_LOCK:
-        pending = [t for t in ordered if t not in _SPLIT_CACHE]
-    if not pending:
-        with _CACHE_LOCK:
-            return {t: _SPLIT_CACHE[t] for t in ordered if t in _SPLIT_CACHE}
-    client = _get_llm_client(event_callback=event_callback)
-    sys_prompt = (
-        "你是地名拆解助手。请按输入顺序输出严格 JSON 数组，"
-        "元素格式为 {\"text\":\"\",\"ancient\":\"\",\"modern\":\"\"}。"
-        "无法判断时 ancient/modern 置空。不要输出多余文本。"
-    )
-    for i in range(0, len(pending), 20):
-        chunk = pending[i : i + 20]
-        messages = [
-            {"role": "system", "content": sys_prompt},
-            {"role": "user", "content": f"地名列表：{json.dumps(chunk, ensure_ascii=False)}"},
-        ]
-        raw = client.think(messages, temperature=0)
-        mapping = _parse_split_batch(raw or "", chunk)
-        with _CACHE_LOCK:
-            for text in chunk:
-                if text in _SPLIT_CACHE:
-                    continue
-                result = mapping.get(text) or ("", "")
-                _SPLIT_CACHE[text] = result
+        for t in ordered:
+            # 规范化后相同的文本只拆解一次
+            if keys[t] in _SPLIT_CACHE or keys[t] in queued:
+                continue
+            queued.add(keys[t])
+            pending.append(t)
+    # “古称（今现称）”等规整写法本地拆解，只把无法判断的文本交给模型
+    local: Dict[str, Tuple[str, str]] = {}
+    for text in pending:
+        result = split_place_text(text)
+        if result:
+            local[text] = result
+    pending = [t for t in pending if t not in local]
+    stored = _read_persisted_splits([keys[t] for t in pending])
+    pending = [t for t in pending if keys[t] not in stored]
     with _CACHE_LOCK:
-        return {t: _SPLIT_CACHE.get(t, ("", "")) for t in ordered}
+        _SPLIT_CACHE.update({keys[t]: result for t, result in local.items()})
+        _SPLIT_COUNTS["local"] += len(local)
+        _SPLIT_COUNTS["llm"] += len(pending)
+    if local or stored or pending:
+        _LOGGER.info("split_batch local=%s stored=%s llm=%s", len(local), len(stored), len(pending))
+    if pending:
+        client = _get_llm_client(event_callback=event_callback)
+
+        def _split_chunk(chunk: List[str]) -> None:
+            messages = [
+                {"role": "system", "content": _SPLIT_BATCH_PROMPT},
+                {"role": "user", "content": f"地名列表：{json.dumps(chunk, ensure_ascii=False)}"},
+            ]
+            raw = client.think(messages, temperature=0, lane=BATCH)
+            mapping = _parse_split_batch(raw or "", chunk)
+            fresh: Dict[str, Tuple[str, str]] = {}
+            with _CACHE_LOCK:
+                for text in chunk:
+                    if keys[text] in _SPLIT_CACHE:
+                        continue
+                    result = mapping.get(text) or ("", "")
+                    _SPLIT_CACHE[keys[text]] = result
+                    fresh[keys[text]] = result
+            _persist_splits(fresh)
+
+        chunks = [pending[i : i + _SPLIT_CHUNK_SIZE] for i in range(0, len(pending), _SPLIT_CHUNK_SIZE)]
+        if len(chunks) == 1:
+            _split_chunk(chunks[0])
+        else:
+            # 分块并发请求；实际同时在途的模型调用数还受 LLM_MAX_CONCURRENCY 全局限制
+            with ThreadPoolExecutor(max_workers=min(len(chunks), llm_max_concurrency())) as executor:
+                for future in [executor.submit(_split_chunk, chunk) for chunk in chunks]:
+                    future.result()
+    with _CACHE_LOCK:
+        return {t: _SPLIT_CACHE.get(keys[t], ("", "")) for t in ordered}
 
 
 def _split_ancient_modern(loc_text: str, event_callback: Optional[callable] = None) -> Tuple[str, str]:
     if not loc_text:
         return "", ""
+    _get_split_store()
+    key = _split_key(loc_text)
     with _CACHE_LOCK:
-        cached = _SPLIT_CACHE.get(loc_text)
+        cached = _SPLIT_CACHE.get(key)
     if cached:
         return cached
+    local = split_place_text(loc_text)
+    if local is None:
+        stored = _read_persisted_splits([key]).get(key)
+        if stored:
+            return stored
+    with _CACHE_LOCK:
+        _SPLIT_COUNTS["local" if local else "llm"] += 1
+        if local:
+            _SPLIT_CACHE[key] = local
+    if local:
+        return local
     client = _get_llm_client(event_callback=event_callback)
-    prompts = [
-        "你是地名拆解助手。仅返回严格 JSON：{\"ancient\":\"\",\"modern\":\"\"}。不要输出多余文本。无法判断时输出空字符串。",
-        "请只输出 JSON 对象，不要任何解释：{\"ancient\":\"古称或历史地名\",\"modern\":\"现代地名\"}。如果无法判断，两个值都输出空字符串。",
-    ]
     ancient = ""
     modern = ""
-    for sys_prompt in prompts:
+    for sys_prompt in _SPLIT_PROMPTS:
         messages = [
             {"role": "system", "content": sys_prompt},
             {"role": "user", "content": f"地名文本：{loc_text}"},
         ]
-        raw = client.think(messages, temperature=0)
+        raw = client.think(messages, temperature=0, lane=BATCH)
         if not raw:
             continue
         a, m = _parse_split_json(raw)
@@ -447,10 +490,22 @@ def _split_ancient_modern(loc_text: str, event_callback: Optional[callable] = No
             break
     result = (ancient, modern)
     with _CACHE_LOCK:
-        _SPLIT_CACHE[loc_text] = result
+        _SPLIT_CACHE[key] = result
+    _persist_splits({key: result})
     return result
 
 
+def split_stats() -> Dict[str, object]:
+    """
+    古今地名拆解来源统计：本地规则命中数、交给模型的条数及本地占比。
+    """
+    with _CACHE_LOCK:
+        local = _SPLIT_COUNTS["local"]
+        llm = _SPLIT_COUNTS["llm"]
+    total = local + llm
+    return {"local": local, "llm": llm, "local_ratio": round(local / total, 4) if total else 0.0}
+
+
 def _pick_geocode_name(text: str) -> str:
     """
     为地理编码选取最稳妥的候选名称。
@@ -511,70 +566,49 @@ def _parse_coords_table(md: str) -> Dict[str, tuple[float, float]]:
     """
     if not isinstance(md, str):
         return {}
-    lines = md.splitlines()
-    in_section = False
-    table_started = False
-    header_seen = False
+    table = parse_markdown(md).first_table(lambda title: "地点坐标" in title)
+    if not table:
+        return {}
     idx_name = None
     idx_lat = None
     idx_lon = None
+    for i, c in enumerate(table.header):
+        if "现称" in c or "地点" in c:
+            idx_name = i
+        if "纬度" in c or "lat" in c.lower():
+            idx_lat = i
+        if "经度" in c or "lon" in c.lower() or "lng" in c.lower():
+            idx_lon = i
+    if idx_name is None or idx_lat is None or idx_lon is None:
+        return {}
     coords: Dict[str, tuple[float, float]] = {}
-    for line in lines:
-        if line.strip().startswith("## "):
-            title = line.strip().lstrip("#").strip()
-            in_section = "地点坐标" in title
-            table_started = False
-            header_seen = False
-            idx_name = None
-            idx_lat = None
-            idx_lon = None
-            continue
-        if not in_section:
+    for row in table.rows:
+        if idx_name >= len(row) or idx_lat >= len(row) or idx_lon >= len(row):
             continue
-        if line.strip().startswith("|") and not table_started:
-            table_started = True
-            header = [c.strip() for c in line.strip().strip("|").split("|")]
-            for i, c in enumerate(header):
-                if "现称" in c or "地点" in c:
-                    idx_name = i
-                if "纬度" in c or "lat" in c.lower():
-                    idx_lat = i
-                if "经度" in c or "lon" in c.lower() or "lng" in c.lower():
-                    idx_lon = i
+        name = _pick_geocode_name(row[idx_name])
+        try:
+            lat = float(row[idx_lat])
+            lon = float(row[idx_lon])
+        except Exception:
             continue
-        if table_started:
-            if re.match(r"^\|\s*-{3,}\s*\|", line.strip()):
-                header_seen = True
-                continue
-            if header_seen and line.strip().startswith("|"):
-                row = [c.strip() for c in line.strip().strip("|").split("|")]
-                if idx_name is None or idx_lat is None or idx_lon is None:
-                    continue
-                if idx_name >= len(row) or idx_lat >= len(row) or idx_lon >= len(row):
-                    continue
-                name = _pick_geocode_name(row[idx_name])
-                try:
-                    lat = float(row[idx_lat])
-                    lon = float(row[idx_lon])
-                except Exception:
-                    continue
-                if name:
-                    coords[name] = (lat, lon)
-            else:
-                break
+        if name:
+            coords[name] = (lat, lon)
     return coords
 
 
-def _build_profile_data(md: str, event_callback: Optional[callable] = None) -> Optional[Dict[str, object]]:
+def _compose_profile_data(
+    md: str, event_callback: Optional[callable] = None
+) -> Tuple[Optional[Dict[str, object]], bool]:
     """
     汇总人物档案与地点数据，形成完整人物页渲染所需结构。
+    第二个返回值表示全部地点（含出生/去世地）均已取得坐标，只有完整结果才会被缓存。
     """
     if not isinstance(md, str) or not md.strip():
-        return None
+        return None, False
     info = _parse_basic_info(md)
     locations = _parse_location_sections(md)
     if not info or not locations:
-        return None
+        return None, False
     name_raw = info.get("姓名", "")
     name = name_raw.split("（", 1)[0].strip() or name_raw.strip()
     title = (
@@ -602,9 +636,28 @@ def _build_profile_data(md: str, event_callback: Optional[callable] = None) -> O
     death_modern = _split_ancient_modern(death_loc, event_callback=event_callback)[1]
     birth_geo = _pick_geocode_name(birth_modern or birth_loc)
     death_geo = _pick_geocode_name(death_modern or death_loc)
-    # 出生/去世地点优先直连地理编码
-    birth_coord = geocode_city(birth_geo) if birth_geo else None
-    death_coord = geocode_city(death_geo) if death_geo else None
+    coords_cache = _parse_coords_table(md)
+    resolved: List[Tuple[Dict[str, str], str, str, str, Optional[Tuple[float, float]]]] = []
+    for loc in locations:
+        loc_text = loc.get("location") or loc.get("name") or ""
+        ancient, modern = _split_ancient_modern(loc_text, event_callback=event_callback)
+        geo_name = _pick_geocode_name(modern or loc_text or loc.get("name") or ancient)
+        coord = None
+        # 优先使用 Markdown 中自动写入的坐标表，降低地理编码调用次数
+        if geo_name:
+            coord = coords_cache.get(geo_name)
+        if not coord and modern:
+            coord = coords_cache.get(_pick_geocode_name(modern))
+        if not coord and loc_text:
+            coord = coords_cache.get(_pick_geocode_name(loc_text))
+        if not coord and loc.get("name"):
+            coord = coords_cache.get(_pick_geocode_name(loc.get("name") or ""))
+        resolved.append((loc, ancient, modern, geo_name, coord))
+    # 出生/去世地点直连地理编码；坐标表缺失的地点一并批量编码
+    pending = [birth_geo, death_geo] + [item[3] for item in resolved if not item[4] and item[3]]
+    geocoded = geocode_many([p for p in pending if p])
+    birth_coord = geocoded.get(birth_geo) if birth_geo else None
+    death_coord = geocoded.get(death_geo) if death_geo else None
     dynasty = (info.get("时代", "") or info.get("朝代", "")).strip()
     avatar = ""
     person = {
@@ -629,25 +682,11 @@ def _build_profile_data(md: str, event_callback: Optional[callable] = None) -> O
         },
         "lifespan": lifespan,
     }
-    coords_cache = _parse_coords_table(md)
     loc_items: List[Dict[str, object]] = []
-    for loc in locations:
+    for loc, ancient, modern, geo_name, coord in resolved:
         loc_text = loc.get("location") or loc.get("name") or ""
-        ancient, modern = _split_ancient_modern(loc_text, event_callback=event_callback)
-        geo_name = _pick_geocode_name(modern or loc_text or loc.get("name") or ancient)
-        coord = None
-        # 优先使用 Markdown 中自动写入的坐标表，降低地理编码调用次数
-        if geo_name:
-            coord = coords_cache.get(geo_name)
-        if not coord and modern:
-            coord = coords_cache.get(_pick_geocode_name(modern))
-        if not coord and loc_text:
-            coord = coords_cache.get(_pick_geocode_name(loc_text))
-        if not coord and loc.get("name"):
-            coord = coords_cache.get(_pick_geocode_name(loc.get("name") or ""))
         if not coord and geo_name:
-            # 坐标表缺失时才触发在线地理编码
-            coord = geocode_city(geo_name)
+            coord = geocoded.get(geo_name)
         if not coord:
             continue
         works = _extract_works(" ".join([loc.get("event", ""), loc.get("significance", "")]))
@@ -669,7 +708,13 @@ def _build_profile_data(md: str, event_callback: Optional[callable] = None) -> O
             }
         )
     if not loc_items:
-        return None
+        return None, False
+    complete = (
+        len(loc_items) == len(resolved)
+        and (birth_coord is not None or not birth_geo)
+        and (death_coord is not None or not death_geo)
+    )
+    _attach_wgs84(loc_items)
     for loc in loc_items:
         quote_lines = loc.get("quoteLines") or []
         if quote_lines:
@@ -692,7 +737,52 @@ def _build_profile_data(md: str, event_callback: Optional[callable] = None) -> O
             },
         },
     }
-    return {"person": person, "locations": loc_items, "mapStyle": map_style}
+    return {"person": person, "locations": loc_items, "mapStyle": map_style}, complete
+
+
+def _profile_digest(md: str) -> str:
+    """
+    人物页缓存键：除 Markdown 内容外还包含拆解模型/提示词版本与坐标数据版本，任一变化后重新构建。
+    """
+    model, prompt = _split_scope()
+    scope = f"{_PROFILE_VERSION}\n{model}\n{prompt}\n{geocode_data_version()}"
+    return hashlib.sha256(f"{scope}\n{md}".encode("utf-8")).hexdigest()
+
+
+def _get_profile_store() -> ProfileStore:
+    """
+    懒加载人物页持久化缓存，首次访问时才打开 SQLite 文件。
+    """
+    global _PROFILE_STORE
+    if _PROFILE_STORE is None:
+        with _PROFILE_STORE_LOCK:
+            if _PROFILE_STORE is None:
+                _PROFILE_STORE = ProfileStore(resolve_store_path("STORY_MAP_PROFILE_DB", "profile.sqlite3"))
+    return _PROFILE_STORE
+
+
+def _build_profile_data(md: str, event_callback: Optional[callable] = None) -> Optional[Dict[str, object]]:
+    """
+    按 Markdown 内容摘要缓存 profile：先查进程内 LRU，再查 SQLite，均未命中才完整构建。
+    返回深拷贝，调用方可自由修改（如附加 markdown 字段）。
+    """
+    if not isinstance(md, str) or not md.strip():
+        return None
+    digest = _profile_digest(md)
+    profile = _PROFILE_CACHE.get(digest)
+    if profile is None:
+        profile = _get_profile_store().get(digest)
+        if profile is not None:
+            _PROFILE_CACHE[digest] = profile
+    if profile is not None:
+        return copy.deepcopy(profile)
+    profile, complete = _compose_profile_data(md, event_callback=event_callback)
+    if profile is None:
+        return None
+    if complete:
+        _PROFILE_CACHE[digest] = copy.deepcopy(profile)
+        _get_profile_store().put(digest, profile, max_rows=_PROFILE_DB_LIMIT)
+    return profile
 
 
 def parse_places(md: str) -> List[Dict[str, str]]:
@@ -858,18 +948,19 @@ def _format_seconds(sec: float) -> str:
 def build_points(places: List[Dict[str, str]], events: List[Dict[str, str]]) -> List[Dict[str, object]]:
     """
     将地点列表转为带坐标与弹窗内容的点位：
-    - 对每个地点进行地理编码
+    - 对全部地点批量地理编码
     - 优先收集包含该地名的事件；无匹配则取前若干条
     - 弹窗内容使用 Markdown 列表
     """
     if not isinstance(places, list) or not isinstance(events, list):
         return []
+    names = [p.get("modern") or p.get("ancient") or "" for p in places]
+    coords = geocode_many([n for n in names if n])
     pts: List[Dict[str, object]] = []
-    for p in places:
-        name = p.get("modern") or p.get("ancient") or ""
+    for name in names:
         if not name:
             continue
-        coord = geocode_city(name)
+        coord = coords.get(name)
         if not coord:
             continue
         lat, lon = coord
@@ -896,25 +987,17 @@ def _extract_intro_fields(md: str) -> Dict[str, str]:
     """
     if not isinstance(md, str):
         return {"朝代": "", "身份": "", "生卒年": "", "主要事件": "", "主要作品": "", "历史地位": "", "一生行程": ""}
-    lines = md.splitlines()
-    in_intro = False
+    doc = parse_markdown(md)
     fields = {"朝代": "", "身份": "", "生卒年": "", "主要事件": "", "主要作品": "", "历史地位": "", "一生行程": ""}
-    for line in lines:
-        if line.strip().startswith("## "):
-            title = line.strip().lstrip("#").strip()
-            in_intro = (title == "简介")
-            continue
-        if not in_intro:
-            continue
-        if line.strip().startswith("## "):
-            break
-        t = line.strip()
-        if "：" in t:
-            k, v = t.split("：", 1)
-            k = k.strip()
-            v = v.strip()
-            if k in fields:
-                fields[k] = v
+    for section in doc.find_sections(lambda title: title == "简介"):
+        for line in section.lines:
+            t = line.strip()
+            if "：" in t:
+                k, v = t.split("：", 1)
+                k = k.strip()
+                v = v.strip()
+                if k in fields:
+                    fields[k] = v
     if any(fields.values()):
         return fields
     info = _parse_basic_info(md)
@@ -937,17 +1020,8 @@ def _extract_intro_fields(md: str) -> Dict[str, str]:
             else:
                 merged = " / ".join([t for t in [birth_text, death_text] if t])
                 fields["生卒年"] = merged
-    in_section = False
-    for line in lines:
-        if line.strip().startswith("## "):
-            title = line.strip().lstrip("#").strip()
-            if "人生足迹地图说明" in title:
-                in_section = True
-                continue
-            if in_section:
-                break
-        if not in_section:
-            continue
+    section = doc.first_section(lambda title: "人生足迹地图说明" in title)
+    for line in (section.lines if section else ()):
         if "：" not in line:
             continue
         label = ""
@@ -1122,6 +1196,67 @@ def run_interactive() -> None:
         )
 
 
+class _StreamPrefetcher:
+    """
+    流式生成生平时的预取器：每当带“现称”列的表格数据行或地点小节完整到达，
+    即在后台拆解古今地名并地理编码，结果写入各自缓存，生成结束后的建图流程直接命中。
+    预取只做本地拆解，不调用 LLM；本地拆不开的地点留给建图时的批量拆解。
+    """
+    def __init__(self):
+        self._parser = MdStreamParser()
+        self._futures = []
+        self._seen = set()
+        self.count = 0
+
+    def feed(self, chunk: str) -> None:
+        self._dispatch(self._parser.feed(chunk))
+
+    def _dispatch(self, items: List[MdStreamItem]) -> None:
+        for section, item in items:
+            if isinstance(item, MdTableRow):
+                if any("现称" in c for c in item.header):
+                    self._submit(self._warm_geocode, timeline_row_place(item.header, item.cells))
+            elif "人物档案" in section and "基本信息" in item.title:
+                fields = dict(item.fields)
+                self._submit(self._warm_location, _parse_date_location(fields.get("出生", ""), ["出生于", "生于"])[1])
+                self._submit(self._warm_location, _parse_date_location(fields.get("去世", ""), ["卒于", "去世于", "卒"])[1])
+            elif "人生历程" in section or "重要地点" in section:
+                loc = _location_from_subsection(item)
+                self._submit(self._warm_location, loc.get("location") or loc.get("name") or "")
+
+    def _submit(self, fn, text: str) -> None:
+        if not text or (fn, text) in self._seen:
+            return
+        self._seen.add((fn, text))
+        self._futures.append(_PREFETCH_POOL.submit(fn, text))
+
+    @staticmethod
+    def _warm_geocode(name: str) -> None:
+        geocode_many([name])
+
+    @staticmethod
+    def _warm_location(text: str) -> None:
+        local = split_place_text(text)
+        if not local:
+            # 原文通常不是建图时实际查询的名称，预取它只会白占限流额度、留下无用的失败记录
+            return
+        name = _pick_geocode_name(local[1])
+        if name:
+            geocode_many([name])
+
+    def finish(self) -> None:
+        """
+        处理末尾未完整的内容并等待预取完成；预取失败只记录日志，不影响后续流程。
+        """
+        self._dispatch(self._parser.close())
+        for future in self._futures:
+            try:
+                future.result()
+                self.count += 1
+            except Exception as exc:
+                _LOGGER.warning("stream_prefetch_failed error=%s", exc)
+
+
 def _generate_for_person(
     client: StoryAgentLLM,
     person: str,
@@ -1159,7 +1294,16 @@ def _generate_for_person(
     if progress:
         progress(f"{person} 生平生成")
     t_step = time.perf_counter()
-    md = generate_historical_markdown(client, person)
+    if _STREAM_ENABLED:
+        # 边生成边预取：早先到达的地点在后续内容生成期间完成拆解与地理编码
+        prefetch = _StreamPrefetcher()
+        try:
+            md = generate_historical_markdown(client, person, use_cache=allow_cache, on_chunk=prefetch.feed)
+        finally:
+            prefetch.finish()
+        _LOGGER.info("stream_prefetch person=%s warmed=%s", person, prefetch.count)
+    else:
+        md = generate_historical_markdown(client, person, use_cache=allow_cache)
     t_md = time.perf_counter() - t_step
     if not md:
         return {"ok": False, "person": person, "error": "未取得内容"}
@@ -1221,121 +1365,121 @@ def _generate_for_person(
     return result
 
 
-def _build_geojson_for_profile(profile: Dict[str, object]) -> Dict[str, object]:
-    person = profile.get("person") or {}
-    locations = profile.get("locations") or []
+def _attach_wgs84(locations: List[Dict[str, object]]) -> None:
+    """
+    为地点批量补充 WGS84 坐标（wgsLat/wgsLng）；地图使用 GCJ-02，GeoJSON/CSV 等导出使用 WGS84。
+    """
+    pending = [
+        loc
+        for loc in locations
+        if "wgsLat" not in loc and _is_valid_coord(loc.get("lat"), loc.get("lng"))
+    ]
+    if not pending:
+        return
+    converted = gcj02_to_wgs84([(float(loc["lat"]), float(loc["lng"])) for loc in pending])
+    for loc, (lat, lng) in zip(pending, converted):
+        loc["wgsLat"] = round(lat, 6)
+        loc["wgsLng"] = round(lng, 6)
+
+
+def _person_geo_features(person_name: str, locations: List[Dict[str, object]]) -> List[Dict[str, object]]:
+    """
+    单个人物的轨迹点与轨迹线要素（WGS84）；点属性附带距上一点与从起点累计的距离（公里）。
+    调用前需已通过 _attach_wgs84 补充 WGS84 坐标。
+    """
+    points = [loc for loc in locations if "wgsLat" in loc]
+    latlngs = [(loc["wgsLat"], loc["wgsLng"]) for loc in points]
+    cumulative = cumulative_km(latlngs)
     features = []
-    coords = []
-    for loc in locations:
-        lat = loc.get("lat")
-        lng = loc.get("lng")
-        if not _is_valid_coord(lat, lng):
-            continue
-        coords.append([lng, lat])
+    for i, loc in enumerate(points):
         features.append(
             {
                 "type": "Feature",
-                "geometry": {"type": "Point", "coordinates": [lng, lat]},
+                "geometry": {"type": "Point", "coordinates": [loc["wgsLng"], loc["wgsLat"]]},
                 "properties": {
-                    "person": person.get("name", ""),
+                    "person": person_name,
                     "name": loc.get("name", ""),
                     "type": loc.get("type", ""),
                     "time": loc.get("time", ""),
                     "modernName": loc.get("modernName", ""),
                     "ancientName": loc.get("ancientName", ""),
+                    "segment_km": round(cumulative[i] - cumulative[i - 1], 3) if i else 0.0,
+                    "cumulative_km": round(cumulative[i], 3),
                 },
             }
         )
-    if len(coords) > 1:
+    if len(points) > 1:
         features.append(
             {
                 "type": "Feature",
-                "geometry": {"type": "LineString", "coordinates": coords},
-                "properties": {"person": person.get("name", ""), "name": "轨迹"},
+                "geometry": {
+                    "type": "LineString",
+                    "coordinates": [[loc["wgsLng"], loc["wgsLat"]] for loc in points],
+                },
+                "properties": {"person": person_name, "name": "轨迹", "distance_km": round(cumulative[-1], 3)},
             }
         )
+    return features
+
+
+def _build_geojson_for_profile(profile: Dict[str, object]) -> Dict[str, object]:
+    person = profile.get("person") or {}
+    locations = profile.get("locations") or []
+    _attach_wgs84(locations)
+    features = _person_geo_features(person.get("name", ""), locations)
     return {"type": "FeatureCollection", "features": features}
 
 
+# lat/lng 为地图使用的 GCJ-02 坐标，lat_wgs84/lng_wgs84 供 GIS 工具直接使用
+_CSV_HEADER = ["person", "name", "lat", "lng", "type", "time", "modernName", "ancientName", "lat_wgs84", "lng_wgs84"]
+
+
+def _csv_row(person_name: str, loc: Dict[str, object]) -> List[object]:
+    return [
+        person_name,
+        loc.get("name", ""),
+        loc.get("lat", ""),
+        loc.get("lng", ""),
+        loc.get("type", ""),
+        loc.get("time", ""),
+        loc.get("modernName", ""),
+        loc.get("ancientName", ""),
+        loc.get("wgsLat", ""),
+        loc.get("wgsLng", ""),
+    ]
+
+
 def _build_csv_for_profile(profile: Dict[str, object]) -> str:
     person = profile.get("person") or {}
     locations = profile.get("locations") or []
+    _attach_wgs84(locations)
     buffer = io.StringIO()
     writer = csv.writer(buffer)
-    writer.writerow(["person", "name", "lat", "lng", "type", "time", "modernName", "ancientName"])
+    writer.writerow(_CSV_HEADER)
     for loc in locations:
-        writer.writerow(
-            [
-                person.get("name", ""),
-                loc.get("name", ""),
-                loc.get("lat", ""),
-                loc.get("lng", ""),
-                loc.get("type", ""),
-                loc.get("time", ""),
-                loc.get("modernName", ""),
-                loc.get("ancientName", ""),
-            ]
-        )
+        writer.writerow(_csv_row(person.get("name", ""), loc))
     return buffer.getvalue()
 
 
 def _build_geojson_for_multi(people: List[Dict[str, object]]) -> Dict[str, object]:
+    # 所有人物的坐标合并为一次批量转换
+    _attach_wgs84([loc for item in people for loc in (item.get("locations") or [])])
     features = []
     for item in people:
         person = item.get("person") or {}
-        locations = item.get("locations") or []
-        coords = []
-        for loc in locations:
-            lat = loc.get("lat")
-            lng = loc.get("lng")
-            if not _is_valid_coord(lat, lng):
-                continue
-            coords.append([lng, lat])
-            features.append(
-                {
-                    "type": "Feature",
-                    "geometry": {"type": "Point", "coordinates": [lng, lat]},
-                    "properties": {
-                        "person": person.get("name", ""),
-                        "name": loc.get("name", ""),
-                        "type": loc.get("type", ""),
-                        "time": loc.get("time", ""),
-                        "modernName": loc.get("modernName", ""),
-                        "ancientName": loc.get("ancientName", ""),
-                    },
-                }
-            )
-        if len(coords) > 1:
-            features.append(
-                {
-                    "type": "Feature",
-                    "geometry": {"type": "LineString", "coordinates": coords},
-                    "properties": {"person": person.get("name", ""), "name": "轨迹"},
-                }
-            )
+        features.extend(_person_geo_features(person.get("name", ""), item.get("locations") or []))
     return {"type": "FeatureCollection", "features": features}
 
 
 def _build_csv_for_multi(people: List[Dict[str, object]]) -> str:
+    _attach_wgs84([loc for item in people for loc in (item.get("locations") or [])])
     buffer = io.StringIO()
     writer = csv.writer(buffer)
-    writer.writerow(["person", "name", "lat", "lng", "type", "time", "modernName", "ancientName"])
+    writer.writerow(_CSV_HEADER)
     for item in people:
         person = item.get("person") or {}
-        locations = item.get("locations") or []
-        for loc in locations:
-            writer.writerow(
-                [
-                    person.get("name", ""),
-                    loc.get("name", ""),
-                    loc.get("lat", ""),
-                    loc.get("lng", ""),
-                    loc.get("type", ""),
-                    loc.get("time", ""),
-                    loc.get("modernName", ""),
-                    loc.get("ancientName", ""),
-                ]
-            )
+        for loc in item.get("locations") or []:
+            writer.writerow(_csv_row(person.get("name", ""), loc))
     return buffer.getvalue()
 
 
@@ -1394,19 +1538,19 @@ def _relative_path(path: str) -> str:
 
 
 def _compute_overlaps(people: List[Dict[str, object]]) -> List[Dict[str, object]]:
-    counts: Dict[str, int] = {}
-    for item in people:
-        locations = item.get("locations") or []
-        names = set()
-        for loc in locations:
-            name = (loc.get("modernName") or loc.get("name") or "").strip()
-            if name:
-                names.add(name)
-        for name in names:
-            counts[name] = counts.get(name, 0) + 1
-    overlaps = [{"name": k, "count": v} for k, v in counts.items() if v >= 2]
-    overlaps.sort(key=lambda x: (-x["count"], x["name"]))
-    return overlaps
+    """
+    多人物交集地点：按空间邻近（STORY_MAP_OVERLAP_RADIUS_KM）与规范化地名聚类，
+    返回 {name, count, persons, names, lat, lng, spread_km} 列表。
+    """
+    return find_overlap_groups(people)
+
+
+def _compute_copresence(people: List[Dict[str, object]]) -> List[Dict[str, object]]:
+    """
+    多人物同时同地：在交集地点的基础上按地点时间（公元纪年）区间求交，
+    返回 {name, lat, lng, start, end, period, count, persons} 列表。
+    """
+    return find_copresence(people)
 
 
 def _build_conclusion(results: List[Dict[str, object]], multi: bool) -> str:
@@ -1426,7 +1570,23 @@ _QUEUE_LOCK = threading.Lock()
 _PENDING = 0
 _ACTIVE = 0
 _TASK_LOCK = threading.Lock()
-_TASKS: Dict[str, Dict[str, object]] = {}
+_TASK_FINISHED = ("completed", "failed")
+
+
+def _task_evictable(task: object) -> bool:
+    # 排队或运行中的任务仍会被轮询，不参与淘汰
+    return isinstance(task, dict) and task.get("status") in _TASK_FINISHED
+
+
+# 结束的任务保留 STORY_MAP_TASK_TTL 秒供前端轮询结果，总数超过上限时淘汰最早结束的任务
+_TASKS = register_cache(
+    BoundedCache(
+        "tasks",
+        int(os.getenv("STORY_MAP_TASK_LIMIT", "500")),
+        ttl=float(os.getenv("STORY_MAP_TASK_TTL", "3600")),
+        can_evict=_task_evictable,
+    )
+)
 
 
 def _shutdown_executor() -> None:
@@ -1462,6 +1622,9 @@ def _update_task(task_id: str, **fields: object) -> None:
             return
         task.update(fields)
         task["updated_at"] = time.time()
+        if fields.get("status") in _TASK_FINISHED:
+            # 重新写入以从结束时刻起计算保留时长
+            _TASKS[task_id] = task
 
 
 def _append_progress(task_id: str, label: str, detail: str = "") -> None:
@@ -1529,12 +1692,13 @@ def _run_task(task_id: str, text: str, allow_cache: bool = True) -> None:
             exports = _ensure_profile_exports(profile, person, allow_cache=allow_cache)
             result["exports"] = exports
     overlaps = _compute_overlaps(people_payload) if len(people_payload) > 1 else []
+    copresence = _compute_copresence(people_payload) if len(people_payload) > 1 else []
     multi_html_path = ""
     multi_exports: Dict[str, str] = {}
     if len(people_payload) > 1:
         _append_progress(task_id, "合并视图渲染")
         title = "多人物合并视图"
-        multi_data = {"title": title, "people": people_payload, "overlaps": overlaps}
+        multi_data = {"title": title, "people": people_payload, "overlaps": overlaps, "copresence": copresence}
         multi_html = render_multi_html(multi_data)
         multi_name = f"{title}_{task_id[:8]}"
         multi_html_path = save_html(multi_name, multi_html)
@@ -1548,6 +1712,7 @@ def _run_task(task_id: str, text: str, allow_cache: bool = True) -> None:
         "multi_html_path": multi_html_path,
         "multi_exports": multi_exports,
         "overlaps": overlaps,
+        "copresence": copresence,
         "duration": duration,
         "conclusion": conclusion,
     }
@@ -1671,6 +1836,40 @@ class StoryMapServerHandler(BaseHTTPRequestHandler):
             self._set_headers(status, len(payload), allowed)
             self.wfile.write(payload)
             return
+        if parsed.path == "/geocode/misses":
+            params = parse_qs(parsed.query)
+            try:
+                limit = int((params.get("limit") or ["100"])[0])
+            except ValueError:
+                limit = 100
+            payload = json.dumps(
+                {"ok": True, "items": list_geocode_misses(limit=limit)}, ensure_ascii=False
+            ).encode("utf-8")
+            self._set_headers(200, len(payload), allowed)
+            self.wfile.write(payload)
+            return
+        if parsed.path == "/stats/caches":
+            payload = json.dumps({"ok": True, "caches": cache_stats()}, ensure_ascii=False).encode("utf-8")
+            self._set_headers(200, len(payload), allowed)
+            self.wfile.write(payload)
+            return
+        if parsed.path == "/stats/llm":
+            payload = json.dumps({"ok": True, "llm": governor_status()}, ensure_ascii=False).encode("utf-8")
+            self._set_headers(200, len(payload), allowed)
+            self.wfile.write(payload)
+            return
+        if parsed.path == "/stats/split":
+            payload = json.dumps({"ok": True, "split": split_stats()}, ensure_ascii=False).encode("utf-8")
+            self._set_headers(200, len(payload), allowed)
+            self.wfile.write(payload)
+            return
+        if parsed.path == "/geocode/providers":
+            payload = json.dumps(
+                {"ok": True, "providers": geocode_provider_status()}, ensure_ascii=False
+            ).encode("utf-8")
+            self._set_headers(200, len(payload), allowed)
+            self.wfile.write(payload)
+            return
         if parsed.path != "/generate":
             payload = json.dumps({"ok": False, "error": "not found"}, ensure_ascii=False).encode("utf-8")
             self._set_headers(404, len(payload), allowed)
@@ -1712,9 +1911,11 @@ class StoryMapServerHandler(BaseHTTPRequestHandler):
                 data = json.loads(body)
                 messages = data.get("messages", [])
                 temperature = data.get("temperature", 0.1)
+                # 前端重复提问直接命中响应缓存；请求带 no_cache: true 或 cache: false 时强制重新生成
+                use_cache = not data.get("no_cache") and data.get("cache", True) is not False
                 
                 client = _get_llm_client()
-                content = client.think(messages, temperature=temperature)
+                content = client.think(messages, temperature=temperature, cache=use_cache, lane=INTERACTIVE)
                 
                 # Ensure content is valid string and clean surrogate pairs if any
                 if content:
@@ -1760,8 +1961,62 @@ class StoryMapServerHandler(BaseHTTPRequestHandler):
         self.wfile.write(payload)
 
 
+def _warmup_dirs() -> List[str]:
+    root = _project_root()
+    return [
+        os.path.join(root, "storymap", "examples", "story"),
+        os.path.join(root, "story"),
+    ]
+
+
+def warm_geocode_cache(dirs: Optional[List[str]] = None) -> Dict[str, int]:
+    """
+    扫描已生成的人物 Markdown，把其中“地点坐标”表批量写入地理编码缓存。
+    重建语料时已解析过的地点直接命中缓存，不再外呼。
+    """
+    t0 = time.perf_counter()
+    coords: Dict[str, Tuple[float, float]] = {}
+    files = 0
+    for base in dirs or _warmup_dirs():
+        for path in sorted(glob.glob(os.path.join(base, "*.md"))):
+            md = _read_text(path)
+            if not md:
+                continue
+            files += 1
+            for name, coord in _parse_coords_table(md).items():
+                coords.setdefault(name, coord)
+    loaded = preload_geocodes(coords) if coords else 0
+    _LOGGER.info(
+        "geocode_warmup files=%s places=%s loaded=%s duration_ms=%s",
+        files,
+        len(coords),
+        loaded,
+        int((time.perf_counter() - t0) * 1000),
+    )
+    return {"files": files, "places": len(coords), "loaded": loaded}
+
+
+def _start_warmup_thread() -> Optional[threading.Thread]:
+    """
+    后台预热，不阻塞服务就绪；STORY_MAP_WARM_CACHE=0 时关闭。
+    """
+    if (os.getenv("STORY_MAP_WARM_CACHE") or "1").strip().lower() in {"0", "off", "false", "no"}:
+        return None
+
+    def _run() -> None:
+        try:
+            warm_geocode_cache()
+        except Exception as exc:
+            _LOGGER.warning("geocode_warmup_failed error=%s", exc)
+
+    thread = threading.Thread(target=_run, name="geocode-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
 def _run_server(port: int) -> None:
     server = ThreadingHTTPServer(("0.0.0.0", port), StoryMapServerHandler)
+    _start_warmup_thread()
     _LOGGER.info("server_start port=%s", port)
     print(f"服务已启动：http://localhost:{port}")
     server.serve_forever()
@@ -1772,6 +2027,7 @@ def main():
     命令行入口：
     - 可指定人物与底图
     - 未指定人物时进入交互模式
+    - --warm-cache 从已生成文档预热地理编码缓存
     """
     parser = argparse.ArgumentParser(
         description="生成人物生平 Markdown，并导出可交互地图 HTML"
@@ -1779,7 +2035,13 @@ def main():
     parser.add_argument("-p", "--person", help="历史人物姓名或一句包含人物的句子", required=False)
     parser.add_argument("--serve", action="store_true", help="启动 HTTP 服务")
     parser.add_argument("--port", type=int, default=8765, help="HTTP 服务端口")
+    parser.add_argument("--warm-cache", action="store_true", help="从已生成的 Markdown 预热地理编码缓存")
     args = parser.parse_args()
+    if args.warm_cache:
+        stats = warm_geocode_cache()
+        print(f"缓存预热完成：文档 {stats['files']}，地点 {stats['places']}，新增 {stats['loaded']}")
+        if not args.serve and not args.person:
+            return
     if args.serve:
         return _run_server(args.port)
     if not args.person:
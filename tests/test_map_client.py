@@ -0,0 +1,651 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+
+"""单元测试聚焦地理编码缓存等 map_client 核心能力，不发起真实网络请求。"""
+
+SCRIPT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "storymap", "script"))
+sys.path.insert(0, SCRIPT_DIR)
+
+try:
+    import bounded_cache
+    import cache_store
+    import coord_transform
+    import gazetteer
+    import geo_distance
+    import http_pool
+    import map_client
+    import place_index
+    import provider_guard
+except Exception as exc:
+    map_client = None
+    _IMPORT_ERROR = exc
+
+
+@unittest.skipIf(map_client is None, "map_client import failed")
+class GeocodeCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.db_path = os.path.join(self._tmp.name, "geocode.sqlite3")
+        self.store = self._use_store(cache_store.GeocodeStore(self.db_path))
+        env = mock.patch.dict(os.environ, {"QVERIS_API_URL": "", "QVERIS_BASE_URL": "", "QVERIS_API_KEY": ""})
+        env.start()
+        self.addCleanup(env.stop)
+        mem = mock.patch.dict(map_client._GEOCODE_CACHE, clear=True)
+        mem.start()
+        self.addCleanup(mem.stop)
+
+    def _use_store(self, store):
+        patcher = mock.patch.object(map_client, "_GEOCODE_STORE", store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(store.close)
+        return store
+
+    def test_warm_restart_serves_from_disk(self):
+        # 模拟进程重启：清空内存缓存并重新打开磁盘库，重复地名不应再外呼。
+        hit = ((30.1, 112.2), "nominatim")
+        with mock.patch.object(map_client, "_geocode_public", return_value=hit) as fake:
+            first = map_client.geocode_city("测试古城")
+        self.assertEqual(first, (30.1, 112.2))
+        self.assertEqual(fake.call_count, 1)
+        map_client._GEOCODE_CACHE.clear()
+        store = self._use_store(cache_store.GeocodeStore(self.db_path))
+        with mock.patch.object(map_client, "_geocode_public") as fake:
+            second = map_client.geocode_city("测试古城")
+        fake.assert_not_called()
+        self.assertEqual(second, first)
+        row = store.get("测试古城")
+        self.assertEqual(row.get("provider"), "nominatim")
+        self.assertGreater(row.get("updated_at"), 0)
+
+    def test_normalized_key_shares_entry(self):
+        # 全角空白与首尾空格不应产生新的缓存键。
+        map_client._geocode_cache_set("测试 古城", (31.0, 113.0), provider="qveris")
+        self.assertEqual(map_client._geocode_cache_get("  测试　古城 "), (31.0, 113.0))
+
+    def test_negative_cache_short_circuits_repeat_misses(self):
+        # 首次失败记录各服务原因，TTL 内重复查询不再走回退链路。
+        def fake_public(name, force_cn=False, reasons=None):
+            map_client._note_geocode_failure(reasons, "nominatim", "no_result")
+            return None
+
+        with mock.patch.object(map_client, "_geocode_public", side_effect=fake_public) as fake:
+            self.assertIsNone(map_client.geocode_city("不存在之城"))
+            calls = fake.call_count
+            self.assertIsNone(map_client.geocode_city("不存在之城"))
+        self.assertGreater(calls, 0)
+        self.assertEqual(fake.call_count, calls)
+        misses = map_client.list_geocode_misses()
+        self.assertEqual([m["name"] for m in misses], ["不存在之城"])
+        reasons = misses[0]["reasons"]
+        self.assertEqual(reasons.get("nominatim"), ["no_result"])
+        self.assertEqual(reasons.get("qveris"), ["not_configured"])
+        self.assertEqual(map_client.clear_geocode_misses("不存在之城"), 1)
+        self.assertEqual(map_client.list_geocode_misses(), [])
+
+    def test_outage_is_recorded_as_transient_miss(self):
+        # QVeris 无响应与公共链路报错都不是“无结果”，失败记录只短期保留。
+        provider_guard.reset_guards()
+        self.addCleanup(provider_guard.reset_guards)
+
+        def failing_public(name, force_cn=False, reasons=None):
+            map_client._note_geocode_failure(reasons, "nominatim", "error: timed out")
+            return None
+
+        env = {"QVERIS_API_URL": "http://qveris.local", "QVERIS_API_KEY": "k"}
+        with mock.patch.dict(os.environ, env), \
+                mock.patch.object(map_client, "_http_post_json", return_value=None), \
+                mock.patch.object(map_client, "_geocode_public", side_effect=failing_public):
+            self.assertIsNone(map_client.geocode_city("断网古城"))
+        miss = map_client.list_geocode_misses()[0]
+        self.assertEqual(miss["reasons"]["qveris"], ["error"])
+        self.assertLessEqual(miss["expires_at"] - miss["created_at"], map_client._GEOCODE_TRANSIENT_MISS_TTL)
+
+    def test_put_miss_purges_expired_rows(self):
+        self.store._PRUNE_EVERY = 2
+        with mock.patch.object(cache_store.time, "time", return_value=time.time() - 100):
+            self.store.put_miss("旧失败", {"nominatim": ["no_result"]}, ttl=10)
+        self.store.put_miss("新失败甲", {"nominatim": ["no_result"]}, ttl=10)
+        self.assertEqual(self.store._query("SELECT COUNT(*) FROM geocode_miss")[0][0], 2)
+        self.store.put_miss("新失败乙", {"nominatim": ["no_result"]}, ttl=10)
+        self.assertEqual(self.store._query("SELECT COUNT(*) FROM geocode_miss")[0][0], 2)
+
+    def test_concurrent_lookups_share_one_flight(self):
+        # 多个线程同时查询同一地名，只允许一次外部调用。
+        release = threading.Event()
+
+        def slow_public(name, force_cn=False, reasons=None):
+            release.wait(2)
+            return (30.3, 112.2), "nominatim"
+
+        results = []
+        with mock.patch.object(map_client, "_geocode_public", side_effect=slow_public) as fake:
+            threads = [
+                threading.Thread(target=lambda: results.append(map_client.geocode_city("并发古城")))
+                for _ in range(6)
+            ]
+            for t in threads:
+                t.start()
+            while not map_client._GEOCODE_INFLIGHT:
+                time.sleep(0.01)
+            time.sleep(0.05)
+            release.set()
+            for t in threads:
+                t.join(5)
+        self.assertEqual(fake.call_count, 1)
+        self.assertEqual(results, [(30.3, 112.2)] * 6)
+        self.assertEqual(map_client._GEOCODE_INFLIGHT, {})
+
+    def test_geocode_many_dedupes_and_only_sends_misses(self):
+        # 缓存命中与失败记录在一次批量查询内处理，只有未命中地名发往服务。
+        map_client._geocode_cache_set("缓存古镇", (34.03, 113.85), provider="qveris")
+        map_client._geocode_miss_set("失败古镇", {"nominatim": ["no_result"]})
+        queried = []
+
+        def fake_public(name, force_cn=False, reasons=None):
+            queried.append(name)
+            return (30.33, 112.24), "photon"
+
+        with mock.patch.object(map_client, "_geocode_public", side_effect=fake_public):
+            coords = map_client.geocode_many(["缓存古镇", " 缓存古镇", "失败古镇", "待查古镇", "待查古镇"])
+        self.assertEqual(coords, {"缓存古镇": (34.03, 113.85), "待查古镇": (30.33, 112.24)})
+        self.assertEqual(queried, ["待查古镇"])
+
+    def test_geocode_many_prefers_qveris_batch(self):
+        calls = []
+
+        class FakeClient:
+            def __init__(self, api_url, api_key):
+                pass
+
+            def geocode_batch(self, names):
+                calls.append(list(names))
+                return [(30.0 + i, 110.0) for i, _ in enumerate(names)]
+
+            def geocode(self, name):
+                raise AssertionError("single lookup should not run")
+
+        env = {"QVERIS_API_URL": "http://qveris.local", "QVERIS_API_KEY": "k"}
+        with mock.patch.dict(os.environ, env), mock.patch.object(
+            map_client, "_get_qveris_client_class", return_value=FakeClient
+        ), mock.patch.object(map_client, "_geocode_public") as fake_public:
+            coords = map_client.geocode_many([f"批量地{i}" for i in range(12)])
+        fake_public.assert_not_called()
+        self.assertEqual(len(coords), 12)
+        self.assertEqual([len(c) for c in calls], [10, 2])
+
+    def test_hedged_mode_returns_first_valid_result(self):
+        # 竞速模式下慢速 QVeris 不应拖慢结果，海外坐标不应胜出。
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        class SlowClient:
+            def __init__(self, api_url, api_key):
+                pass
+
+            def geocode_variant(self, name, param):
+                if param == "address":
+                    return (40.7, -74.0)
+                release.wait(5)
+                return (30.0, 110.0)
+
+        def fast_public(name, force_cn=False, reasons=None, cancel=None):
+            time.sleep(0.05)
+            return (30.33, 112.24), "photon"
+
+        env = {"QVERIS_API_URL": "http://qveris.local", "QVERIS_API_KEY": "k"}
+        with mock.patch.dict(os.environ, env), mock.patch.object(
+            map_client, "_get_qveris_client_class", return_value=SlowClient
+        ), mock.patch.object(map_client, "_geocode_public", side_effect=fast_public):
+            started = time.perf_counter()
+            res = map_client.geocode_city("竞速古城", hedge=True)
+            elapsed = time.perf_counter() - started
+        self.assertEqual(res, (30.33, 112.24))
+        self.assertLess(elapsed, 2)
+        self.assertEqual(self.store.get("竞速古城")["provider"], "photon")
+
+
+    def test_hedged_mode_accepts_foreign_places_like_sequential_mode(self):
+        # 中文写法的海外地名不受国内范围限制；公共链路的异常不记到 QVeris 名下。
+        class EmptyClient:
+            def __init__(self, api_url, api_key):
+                pass
+
+            def geocode_variant(self, name, param):
+                return None
+
+        env = {"QVERIS_API_URL": "http://qveris.local", "QVERIS_API_KEY": "k"}
+        with mock.patch.dict(os.environ, env), mock.patch.object(
+            map_client, "_get_qveris_client_class", return_value=EmptyClient
+        ):
+            with mock.patch.object(map_client, "_geocode_public", return_value=((48.85, 2.35), "nominatim")):
+                self.assertEqual(map_client.geocode_city("法国巴黎", hedge=True), (48.85, 2.35))
+            reasons = {}
+            with mock.patch.object(map_client, "_geocode_public", side_effect=RuntimeError("boom")):
+                self.assertIsNone(map_client._geocode_hedged("某某古城", True, EmptyClient("", ""), reasons))
+        self.assertEqual(reasons["qveris"], ["no_result"])
+        self.assertEqual(reasons["public"], ["error: boom"])
+
+    def test_hedged_mode_stops_qveris_variants_after_public_wins(self):
+        # QVeris 一路按参数顺序逐个尝试；公共链路胜出后不再发起后续参数形式的请求。
+        calls = []
+
+        class SlowClient:
+            def __init__(self, api_url, api_key):
+                pass
+
+            def geocode_variant(self, name, param):
+                calls.append(param)
+                time.sleep(0.2)
+                return None
+
+        def fast_public(name, force_cn=False, reasons=None, cancel=None):
+            return (30.33, 112.24), "photon"
+
+        env = {"QVERIS_API_URL": "http://qveris.local", "QVERIS_API_KEY": "k"}
+        with mock.patch.dict(os.environ, env), mock.patch.object(
+            map_client, "_get_qveris_client_class", return_value=SlowClient
+        ), mock.patch.object(map_client, "_geocode_public", side_effect=fast_public):
+            res = map_client.geocode_city("竞速新城", hedge=True)
+            time.sleep(0.4)
+        self.assertEqual(res, (30.33, 112.24))
+        self.assertEqual(calls, ["address"])
+
+@unittest.skipIf(map_client is None, "map_client import failed")
+class GazetteerTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        store = cache_store.GeocodeStore(os.path.join(self._tmp.name, "geocode.sqlite3"))
+        patcher = mock.patch.object(map_client, "_GEOCODE_STORE", store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(store.close)
+        env = mock.patch.dict(
+            os.environ,
+            {"QVERIS_API_URL": "", "QVERIS_BASE_URL": "", "QVERIS_API_KEY": "", "STORY_MAP_GAZETTEER": ""},
+        )
+        env.start()
+        self.addCleanup(env.stop)
+        mem = mock.patch.dict(map_client._GEOCODE_CACHE, clear=True)
+        mem.start()
+        self.addCleanup(mem.stop)
+        gazetteer.reset_gazetteer()
+        self.addCleanup(gazetteer.reset_gazetteer)
+
+    def test_lookup_accepts_admin_suffix_and_ancient_names(self):
+        self.assertEqual(gazetteer.lookup_place("许昌市").name, "许昌")
+        self.assertEqual(gazetteer.lookup_place("河南省").level, "province")
+        entry = gazetteer.lookup_place("长安")
+        self.assertEqual(entry.modern, "陕西省西安市")
+        self.assertEqual((entry.lat, entry.lng), (gazetteer.lookup_place("西安").lat, gazetteer.lookup_place("西安").lng))
+        self.assertIsNone(gazetteer.lookup_place("测试古城"))
+        # 去后缀后不足两个字的写法不参与匹配
+        self.assertIsNone(gazetteer.lookup_place("市"))
+
+    def test_gazetteer_version_follows_file_content(self):
+        # 更换地名库文件后坐标数据版本随之变化，依赖坐标的缓存据此失效。
+        builtin = map_client.geocode_data_version()
+        self.assertEqual(map_client.geocode_data_version(), builtin)
+        path = os.path.join(self._tmp.name, "gazetteer.tsv")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("测试古城\t30.0\t110.0\tcity\t\t\n")
+        with mock.patch.dict(os.environ, {"STORY_MAP_GAZETTEER": path}):
+            gazetteer.reset_gazetteer()
+            self.assertNotEqual(map_client.geocode_data_version(), builtin)
+        gazetteer.reset_gazetteer()
+        self.assertEqual(map_client.geocode_data_version(), builtin)
+
+    def test_city_suffix_does_not_match_province(self):
+        # “吉林市”去掉“市”后不能命中吉林省；直辖市照常匹配。
+        self.assertIsNone(gazetteer.lookup_place("吉林市"))
+        self.assertEqual(gazetteer.lookup_place("吉林省").level, "province")
+        self.assertEqual(gazetteer.lookup_place("北京市").name, "北京")
+        self.assertFalse(place_index.resolve_place("吉林市").complete)
+        self.assertFalse(place_index.resolve_place("吉林省吉林市").complete)
+        self.assertTrue(place_index.resolve_place("重庆市").complete)
+        with mock.patch.object(map_client, "_geocode_public", return_value=((43.84, 126.55), "photon")) as fake:
+            self.assertEqual(map_client.geocode_city("吉林市"), (43.84, 126.55))
+        fake.assert_called()
+
+    def test_gazetteer_hit_skips_cache_and_network(self):
+        with mock.patch.object(map_client, "_geocode_public") as fake, \
+                mock.patch.object(map_client, "_geocode_cache_get") as cache_get:
+            coord = map_client.geocode_city("荆州市")
+            coords = map_client.geocode_many(["襄阳", "麦城"])
+        fake.assert_not_called()
+        cache_get.assert_not_called()
+        self.assertEqual(coord, (30.336282, 112.24143))
+        self.assertEqual(set(coords), {"襄阳", "麦城"})
+
+    def test_geocode_detail_reports_source(self):
+        detail = map_client.geocode_detail("涿郡")
+        self.assertEqual(detail["source"], "gazetteer")
+        self.assertEqual(detail["matched"], "涿郡")
+        self.assertEqual(detail["modern"], "河北省涿州市")
+        with mock.patch.object(map_client, "_geocode_public", return_value=((30.1, 112.2), "photon")):
+            first = map_client.geocode_detail("测试古城")
+            second = map_client.geocode_detail("测试古城")
+        self.assertEqual(first, {"lat": 30.1, "lng": 112.2, "source": "network", "provider": "photon"})
+        self.assertEqual(second["source"], "cache")
+
+    def test_place_index_resolves_compound_names(self):
+        cases = {
+            "河东郡解县": ("解县", True),
+            "荆州麦城": ("麦城", True),
+            "中国湖北省荆州市公安县": ("公安", True),
+            "湖北省当阳市玉泉山": ("当阳", False),
+            "洛阳白马寺": ("洛阳", False),
+        }
+        for text, (name, complete) in cases.items():
+            match = place_index.resolve_place(text)
+            self.assertEqual((match.entry.name, match.complete), (name, complete), text)
+        self.assertIsNone(place_index.resolve_place("汉寿亭侯"))
+
+    def test_partial_match_is_fallback_after_network(self):
+        # 含未收录细节的地名先走在线服务；全部失败时退回本地识别出的县级地名
+        def fake_public(name, force_cn=False, reasons=None):
+            map_client._note_geocode_failure(reasons, "nominatim", "no_result")
+            return None
+
+        with mock.patch.object(map_client, "_geocode_public", side_effect=fake_public) as fake:
+            coord = map_client.geocode_city("湖北省当阳市玉泉山")
+            calls = fake.call_count
+            again = map_client.geocode_many(["湖北省当阳市玉泉山"])
+        self.assertGreater(calls, 0)
+        self.assertEqual(fake.call_count, calls)
+        expected = (gazetteer.lookup_place("当阳").lat, gazetteer.lookup_place("当阳").lng)
+        self.assertEqual(coord, expected)
+        self.assertEqual(again, {"湖北省当阳市玉泉山": expected})
+        with mock.patch.object(map_client, "_geocode_public") as fake:
+            self.assertEqual(map_client.geocode_city("河东郡解县"), (35.015549, 110.998135))
+        fake.assert_not_called()
+
+    def test_disabled_gazetteer_falls_back_to_network(self):
+        with mock.patch.dict(os.environ, {"STORY_MAP_GAZETTEER": "off"}):
+            gazetteer.reset_gazetteer()
+            with mock.patch.object(map_client, "_geocode_public", return_value=((1.0, 2.0), "photon")) as fake:
+                self.assertEqual(map_client.geocode_city("荆州市"), (1.0, 2.0))
+        self.assertEqual(fake.call_count, 1)
+
+
+@unittest.skipIf(map_client is None, "map_client import failed")
+class BoundedCacheTest(unittest.TestCase):
+    def test_lru_eviction_and_counters(self):
+        cache = bounded_cache.BoundedCache("test-lru", max_size=2)
+        cache["a"] = 1
+        cache["b"] = 2
+        self.assertEqual(cache.get("a"), 1)  # a 变为最近使用
+        cache["c"] = 3
+        self.assertNotIn("b", cache)
+        self.assertEqual(sorted(cache.keys()), ["a", "c"])
+        self.assertIsNone(cache.get("b"))
+        stats = cache.stats()
+        self.assertEqual((stats["size"], stats["hits"], stats["misses"], stats["evictions"]), (2, 1, 1, 1))
+
+    def test_ttl_and_capacity_respect_pinned_entries(self):
+        pinned = lambda v: v.get("status") == "completed"
+        cache = bounded_cache.BoundedCache("test-pin", max_size=1, can_evict=pinned)
+        cache["running"] = {"status": "running"}
+        cache["done"] = {"status": "completed"}
+        # 运行中的条目即使超出容量也保留，淘汰只作用于已结束的条目
+        self.assertIn("running", cache)
+        self.assertNotIn("done", cache)
+        cache = bounded_cache.BoundedCache("test-ttl", max_size=10, ttl=0.05, can_evict=pinned)
+        cache["running"] = {"status": "running"}
+        cache["done"] = {"status": "completed"}
+        time.sleep(0.06)
+        self.assertIsNone(cache.get("done"))
+        self.assertEqual(cache.get("running"), {"status": "running"})
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+    def test_eviction_keeps_pinned_entries_in_lru_order(self):
+        # 受保护条目被跳过后仍留在最久未使用一端，顺序不变；淘汰其后最旧的可淘汰条目。
+        cache = bounded_cache.BoundedCache("test-order", max_size=3, can_evict=lambda v: v != "pin")
+        for key, value in (("p1", "pin"), ("p2", "pin"), ("a", 1), ("b", 2)):
+            cache[key] = value
+        self.assertEqual(cache.keys(), ["p1", "p2", "b"])
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_process_caches_are_registered(self):
+        self.assertIsInstance(map_client._GEOCODE_CACHE, bounded_cache.BoundedCache)
+        self.assertIn("geocode", bounded_cache.cache_stats())
+
+
+@unittest.skipIf(map_client is None, "map_client import failed")
+class GeoDistanceTest(unittest.TestCase):
+    COORDS = [(39.9042, 116.4074), (31.2304, 121.4737), (30.5728, 104.0668), (34.3416, 108.9398)]
+
+    def _all(self):
+        return (
+            geo_distance.segment_lengths_km(self.COORDS),
+            geo_distance.cumulative_km(self.COORDS),
+            geo_distance.pairwise_km(self.COORDS),
+        )
+
+    def test_vectorized_matches_scalar_fallback(self):
+        segments, cumulative, matrix = self._all()
+        with mock.patch.object(geo_distance, "np", None):
+            fb_segments, fb_cumulative, fb_matrix = self._all()
+        for a, b in zip(segments + cumulative, fb_segments + fb_cumulative):
+            self.assertAlmostEqual(a, b, places=6)
+        for row_a, row_b in zip(matrix, fb_matrix):
+            for a, b in zip(row_a, row_b):
+                self.assertAlmostEqual(a, b, places=6)
+        # 北京—上海约 1068 公里
+        self.assertAlmostEqual(segments[0], 1068, delta=5)
+        self.assertEqual(len(cumulative), len(self.COORDS))
+        self.assertAlmostEqual(cumulative[-1], sum(segments), places=6)
+        self.assertAlmostEqual(matrix[0][1], segments[0], places=6)
+        self.assertEqual(matrix[2][2], 0.0)
+
+    def test_total_distance_from_coords_table(self):
+        md = "## 地点坐标（自动地理编码）\n| 现称 | 纬度 | 经度 |\n| --- | --- | --- |\n"
+        md += "".join(f"| 地{i} | {lat} | {lng} |\n" for i, (lat, lng) in enumerate(self.COORDS))
+        total = map_client.compute_total_distance_km(md)
+        self.assertAlmostEqual(total, geo_distance.path_length_km(self.COORDS), places=6)
+        self.assertIsNone(map_client.compute_total_distance_km(md.split("| 地1")[0]))
+
+
+@unittest.skipIf(map_client is None, "map_client import failed")
+class CoordTransformTest(unittest.TestCase):
+    # 天安门：WGS84 与高德（GCJ-02）坐标
+    WGS = (39.908722, 116.397499)
+    GCJ = (39.910126, 116.403743)
+
+    def test_round_trip_and_outside_china(self):
+        coords = [self.WGS, (51.5074, -0.1278)]
+        gcj = coord_transform.wgs84_to_gcj02(coords)
+        self.assertAlmostEqual(gcj[0][0], self.GCJ[0], places=5)
+        self.assertAlmostEqual(gcj[0][1], self.GCJ[1], places=5)
+        self.assertEqual(gcj[1], coords[1])
+        back = coord_transform.gcj02_to_wgs84(gcj)
+        self.assertAlmostEqual(back[0][0], self.WGS[0], places=6)
+        self.assertAlmostEqual(back[0][1], self.WGS[1], places=6)
+        with mock.patch.object(coord_transform, "np", None):
+            self.assertEqual(coord_transform.wgs84_to_gcj02(coords)[1], coords[1])
+            fallback = coord_transform.wgs84_to_gcj02(coords)[0]
+        self.assertAlmostEqual(fallback[0], gcj[0][0], places=9)
+        self.assertAlmostEqual(fallback[1], gcj[0][1], places=9)
+
+    def test_legacy_public_rows_are_migrated_once(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        store = cache_store.GeocodeStore(os.path.join(tmp.name, "geocode.sqlite3"))
+        self.addCleanup(store.close)
+        store.put("旧地", "旧地", self.WGS, "nominatim")
+        store.put("高德地", "高德地", self.GCJ, "qveris")
+        self.assertEqual(map_client._migrate_public_coords(store), 1)
+        self.assertEqual(map_client._migrate_public_coords(store), 0)
+        migrated = store.get("旧地")
+        self.assertAlmostEqual(migrated["lat"], self.GCJ[0], places=5)
+        self.assertAlmostEqual(migrated["lng"], self.GCJ[1], places=5)
+        self.assertEqual((store.get("高德地")["lat"], store.get("高德地")["lng"]), self.GCJ)
+
+
+@unittest.skipIf(map_client is None, "map_client import failed")
+class ProviderGuardTest(unittest.TestCase):
+    def setUp(self):
+        provider_guard.reset_guards()
+        self.addCleanup(provider_guard.reset_guards)
+        env = {
+            "STORY_MAP_GEOCODE_RATE_NOMINATIM": "1000",
+            "STORY_MAP_GEOCODE_RATE_PHOTON": "1000",
+            "STORY_MAP_BREAKER_THRESHOLD": "2",
+            "STORY_MAP_BREAKER_RESET": "60",
+            "MAPSCO_API_KEY": "",
+        }
+        patcher = mock.patch.dict(os.environ, env)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_breaker_transitions(self):
+        breaker = provider_guard.CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.snapshot()["state"], "open")
+        self.assertFalse(breaker.allow())
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.snapshot()["state"], "half_open")
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.snapshot()["state"], "closed")
+
+    def test_rate_limited_probe_is_given_back(self):
+        # 半开探测被限流时不消耗探测名额，令牌恢复后下一个请求即可探测。
+        breaker = provider_guard.CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        bucket = provider_guard.TokenBucket(rate=1.0, capacity=1.0)
+        guard = provider_guard.ProviderGuard("probe", bucket, breaker, max_wait=0)
+        breaker.record_failure()
+        self.assertTrue(bucket.acquire(max_wait=0))
+        time.sleep(0.06)
+        self.assertEqual(guard.before_call(), "rate_limited")
+        self.assertEqual(breaker.snapshot()["state"], "half_open")
+        with mock.patch.object(bucket, "acquire", return_value=True):
+            self.assertIsNone(guard.before_call())
+            self.assertEqual(guard.before_call(), "circuit_open")
+
+    def test_token_bucket_refuses_long_waits(self):
+        bucket = provider_guard.TokenBucket(rate=1.0, capacity=1.0)
+        self.assertTrue(bucket.acquire(max_wait=0))
+        self.assertFalse(bucket.acquire(max_wait=0.1))
+
+    def test_tripped_provider_is_skipped(self):
+        # 连续失败后熔断打开，后续请求不再访问该服务。
+        hosts = []
+
+        def fake_request(method, url, headers, body=None):
+            hosts.append(url.split("/")[2])
+            if "nominatim" in url:
+                raise TimeoutError("timed out")
+            return {"features": [{"geometry": {"coordinates": [112.2, 30.3]}}]}
+
+        # 公共服务坐标为 WGS84，返回前转换为 GCJ-02
+        expected = coord_transform.wgs84_to_gcj02([(30.3, 112.2)])[0]
+        with mock.patch.object(map_client, "_http_request_json", side_effect=fake_request):
+            for _ in range(3):
+                hit = map_client._geocode_public("江陵", force_cn=True)
+                self.assertEqual(hit, (expected, "photon"))
+            reasons = {}
+            map_client._geocode_public("江陵", force_cn=True, reasons=reasons)
+        self.assertEqual(hosts.count("nominatim.openstreetmap.org"), 2)
+        self.assertEqual(reasons.get("nominatim"), ["circuit_open"])
+        status = map_client.geocode_provider_status()
+        self.assertEqual(status["nominatim"]["state"], "open")
+        self.assertEqual(status["photon"]["state"], "closed")
+
+
+class _EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", "0") or "0")
+        body = self.rfile.read(length)
+        if self.path.startswith("/moved"):
+            self.send_response(307)
+            self.send_header("Location", "/tools/execute")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        payload = json.dumps({"port": self.client_address[1], "echo": json.loads(body)}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@unittest.skipIf(map_client is None, "map_client import failed")
+class HttpPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _EchoHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/tools/execute"
+
+    def test_keep_alive_connection_is_reused(self):
+        # 连续请求应复用同一条 TCP 连接（客户端端口不变）。
+        pool = http_pool.HttpConnectionPool(max_per_host=2)
+        self.addCleanup(pool.close)
+        ports = []
+        for i in range(3):
+            status, body = pool.request("POST", self.url, {"Content-Type": "application/json"}, json.dumps({"i": i}).encode())
+            self.assertEqual(status, 200)
+            data = json.loads(body)
+            self.assertEqual(data["echo"], {"i": i})
+            ports.append(data["port"])
+        self.assertEqual(len(set(ports)), 1)
+        stats = pool.stats()
+        self.assertEqual(stats["created"], 1)
+        self.assertEqual(stats["reused"], 2)
+
+    def test_redirect_is_followed(self):
+        # 307 重定向保持方法与请求体，跟随后返回最终响应。
+        pool = http_pool.HttpConnectionPool(max_per_host=2)
+        self.addCleanup(pool.close)
+        moved = self.url.replace("/tools/execute", "/moved")
+        status, body = pool.request("POST", moved, {"Content-Type": "application/json"}, b'{"a": 1}')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)["echo"], {"a": 1})
+        self.assertEqual(pool.stats()["redirects"], 1)
+
+    def test_proxy_from_environment_is_honoured(self):
+        # 配置了 HTTP_PROXY 的主机改走 urlopen 经代理发出（本地回显服务充当代理）。
+        proxy = f"http://127.0.0.1:{self.server.server_address[1]}"
+        env = {"http_proxy": proxy, "HTTP_PROXY": proxy, "no_proxy": "", "NO_PROXY": ""}
+        pool = http_pool.HttpConnectionPool(max_per_host=2)
+        self.addCleanup(pool.close)
+        with mock.patch.dict(os.environ, env):
+            status, body = pool.request("POST", "http://story-map.invalid/tools/execute", {}, b'{"b": 2}')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)["echo"], {"b": 2})
+        self.assertEqual((pool.stats()["proxied"], pool.stats()["created"]), (1, 0))
+
+    def test_qveris_execute_uses_shared_pool(self):
+        pool = http_pool.HttpConnectionPool(max_per_host=2)
+        self.addCleanup(pool.close)
+        client = map_client.QVerisClient(api_url=self.url.rsplit("/tools", 1)[0], api_key="k")
+        with mock.patch.object(map_client, "get_default_pool", return_value=pool):
+            first = client._execute("tool", {"address": "荆州"})
+            second = client._execute("tool", {"address": "襄阳"})
+        self.assertEqual(first["echo"]["parameters"], {"address": "荆州"})
+        self.assertEqual(first["port"], second["port"])
+
+
+if __name__ == "__main__":
+    unittest.main()
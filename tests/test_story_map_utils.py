@@ -1,17 +1,29 @@
+import json
 import os
 import sys
+import tempfile
+import threading
+import time
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest import mock
 
 
 """单元测试聚焦导出格式与交集计算等核心工具函数。"""
 
 SCRIPT_DIR = os.path.abspath(
-    os.path.join(os.path.dirname(__file__), "..", ".github", "skills", "map-story", "script")
+    os.path.join(os.path.dirname(__file__), "..", "storymap", "script")
 )
 sys.path.insert(0, SCRIPT_DIR)
 
 try:
+    import cache_store
+    import copresence
+    import llm_governor
+    import map_client
+    import md_document
+    import place_split
+    import story_agents
     import story_map
 except Exception as exc:
     story_map = None
@@ -72,6 +84,31 @@ def _sample_markdown():
 
 @unittest.skipIf(story_map is None, "story_map import failed")
 class StoryMapUtilsTest(unittest.TestCase):
+    def setUp(self):
+        # 持久化缓存一律落在临时目录的内存库，避免读写仓库内的 storymap/cache
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        env = {
+            "STORY_MAP_CACHE_DIR": tmp.name,
+            "STORY_MAP_PROFILE_DB": "off",
+            "STORY_MAP_SPLIT_DB": "off",
+            "STORY_MAP_GEOCODE_DB": "off",
+            "LLM_CACHE_DB": "off",
+        }
+        patchers = [
+            mock.patch.dict(os.environ, env),
+            mock.patch.object(story_map, "_PROFILE_STORE", None),
+            mock.patch.object(story_map, "_SPLIT_STORE", None),
+            mock.patch.object(story_map, "_SPLIT_LOADED", None),
+            mock.patch.object(map_client, "_GEOCODE_STORE", None),
+            mock.patch.object(story_agents, "_LLM_RESPONSE_STORE", None),
+            mock.patch.dict(story_map._PROFILE_CACHE, clear=True),
+            mock.patch.dict(story_map._SPLIT_CACHE, clear=True),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
     def test_build_geojson_for_profile(self):
         # 验证轨迹点与路径线是否能生成合法 GeoJSON。
         profile = _sample_profile()
@@ -81,6 +118,15 @@ class StoryMapUtilsTest(unittest.TestCase):
         self.assertEqual(len(features), 3)
         line = features[-1]
         self.assertEqual(line.get("geometry", {}).get("type"), "LineString")
+        # GeoJSON 使用 WGS84：国内坐标相对 GCJ-02 有数百米偏移
+        lng, lat = features[0]["geometry"]["coordinates"]
+        self.assertNotEqual((lat, lng), (34.34, 108.94))
+        self.assertAlmostEqual(lat, 34.34, delta=0.01)
+        # 长安→成都约 600 公里，点要素附带逐段与累计距离
+        second = features[1]["properties"]
+        self.assertEqual(features[0]["properties"]["cumulative_km"], 0.0)
+        self.assertAlmostEqual(second["segment_km"], 600, delta=30)
+        self.assertEqual(second["cumulative_km"], line["properties"]["distance_km"])
 
     def test_build_csv_for_profile(self):
         # 验证导出 CSV 的基本结构与人物字段输出。
@@ -89,6 +135,7 @@ class StoryMapUtilsTest(unittest.TestCase):
         lines = [line for line in csv_text.splitlines() if line.strip()]
         self.assertGreaterEqual(len(lines), 3)
         self.assertIn("person", lines[0])
+        self.assertIn("lat_wgs84", lines[0])
         self.assertIn("李白", csv_text)
 
     def test_compute_overlaps(self):
@@ -113,6 +160,633 @@ class StoryMapUtilsTest(unittest.TestCase):
         names = [item.get("name") for item in overlaps]
         self.assertIn("西安", names)
 
+    def test_compute_overlaps_by_proximity(self):
+        # 写法不同（许昌/许昌市）或坐标相近的地点归为同一交集，并给出人物与中心点。
+        people = [
+            {"person": {"name": "甲"}, "locations": [
+                {"modernName": "许昌", "lat": 34.0373, "lng": 113.8520},
+                {"modernName": "成都", "lat": 30.5730, "lng": 104.0663},
+            ]},
+            {"person": {"name": "乙"}, "locations": [
+                {"modernName": "许昌市", "lat": 34.0400, "lng": 113.8600},
+                {"modernName": "洛阳", "lat": 34.6197, "lng": 112.4539},
+            ]},
+            {"person": {"name": "丙"}, "locations": [
+                {"modernName": "许都故城", "lat": 34.0500, "lng": 113.8000},
+            ]},
+        ]
+        overlaps = story_map._compute_overlaps(people)
+        self.assertEqual(len(overlaps), 1)
+        group = overlaps[0]
+        self.assertEqual(group["count"], 3)
+        self.assertEqual(group["persons"], ["甲", "乙", "丙"])
+        self.assertIn(group["name"], ("许昌", "许昌市", "许都故城"))
+        self.assertAlmostEqual(group["lat"], 34.0424, places=3)
+        self.assertLess(group["spread_km"], 15)
+
+    def test_overlap_keeps_distant_same_name_places_apart(self):
+        # 同名但相距数百公里的地点不归为一组；无坐标的同名地点仍按名称归组。
+        people = [
+            {"person": {"name": "甲"}, "locations": [{"modernName": "朝阳", "lat": 39.9215, "lng": 116.4435}]},
+            {"person": {"name": "乙"}, "locations": [{"modernName": "朝阳市", "lat": 41.5737, "lng": 120.4503}]},
+            {"person": {"name": "丙"}, "locations": [{"modernName": "朝阳"}]},
+        ]
+        overlaps = story_map._compute_overlaps(people)
+        self.assertEqual(len(overlaps), 1)
+        self.assertEqual(overlaps[0]["persons"], ["甲", "丙"])
+        self.assertEqual(overlaps[0]["spread_km"], 0.0)
+
+    def test_overlap_does_not_chain_along_a_route(self):
+        # 一人沿途密集的地点不能把相距 520 公里的两人串成同一交集。
+        route = [{"modernName": f"驿{i}", "lat": 30.0, "lng": 110.0 + i * 0.135} for i in range(40)]
+        people = [
+            {"person": {"name": "行者"}, "locations": route},
+            {"person": {"name": "东"}, "locations": [{"modernName": "东城", "lat": 30.0, "lng": 110.0}]},
+            {"person": {"name": "西"}, "locations": [{"modernName": "西城", "lat": 30.0, "lng": 110.0 + 39 * 0.135}]},
+        ]
+        overlaps = story_map._compute_overlaps(people)
+        self.assertEqual(sorted(o["persons"] for o in overlaps), [["行者", "东"], ["行者", "西"]])
+        radius = 15.0
+        self.assertTrue(all(o["spread_km"] <= 2 * radius for o in overlaps))
+
+    def test_overlap_grid_scales_to_large_inputs(self):
+        # 网格哈希只比较相邻网格，3000 个点也应在秒级内完成。
+        import random
+        import time
+
+        rng = random.Random(7)
+        people = [
+            {"person": {"name": f"人{p}"}, "locations": [
+                {"modernName": f"地{p}-{i}", "lat": rng.uniform(20, 45), "lng": rng.uniform(90, 120)}
+                for i in range(150)
+            ]}
+            for p in range(20)
+        ]
+        t0 = time.perf_counter()
+        story_map._compute_overlaps(people)
+        self.assertLess(time.perf_counter() - t0, 5.0)
+
+    def test_parse_year_interval(self):
+        parse = copresence.parse_year_interval
+        self.assertEqual(parse("约184年-200年"), (184, 200))
+        self.assertEqual(parse("公元192年—195年"), (192, 195))
+        self.assertEqual(parse("184-188年"), (184, 188))
+        self.assertEqual(parse("公元前206年—前195年"), (-206, -195))
+        self.assertEqual(parse("中平元年（184年）前后"), (184, 184))
+        self.assertIsNone(parse("早年"))
+
+    def test_interval_tree_matches_linear_scan(self):
+        import random
+
+        rng = random.Random(3)
+        intervals = []
+        for _ in range(300):
+            start = rng.randint(-200, 300)
+            intervals.append((start, start + rng.randint(0, 40)))
+        tree = copresence.IntervalTree(intervals)
+        for t in range(-210, 350, 7):
+            expected = sorted(i for i, (s, e) in enumerate(intervals) if s <= t <= e)
+            self.assertEqual(sorted(tree.stab(t)), expected)
+
+    def test_compute_copresence(self):
+        # 同一地点且时间区间重叠才算同时同地；只去过同一地点但时间错开的不计入。
+        zhuo = {"modernName": "涿州", "lat": 39.4854, "lng": 115.9745}
+        people = [
+            {"person": {"name": "刘备"}, "locations": [dict(zhuo, time="161年-184年"), {"modernName": "成都", "lat": 30.57, "lng": 104.07, "time": "214年-223年"}]},
+            {"person": {"name": "关羽"}, "locations": [dict(zhuo, modernName="涿郡", time="约184年-200年")]},
+            {"person": {"name": "张飞"}, "locations": [dict(zhuo, time="约167年-184年")]},
+            {"person": {"name": "诸葛亮"}, "locations": [{"modernName": "成都市", "lat": 30.66, "lng": 104.06, "time": "公元234年"}]},
+        ]
+        events = story_map._compute_copresence(people)
+        self.assertEqual([e["period"] for e in events], ["167年—183年", "184年"])
+        self.assertEqual(events[0]["persons"], ["刘备", "张飞"])
+        self.assertEqual(events[1]["persons"], ["刘备", "关羽", "张飞"])
+        self.assertEqual(events[1]["name"], "涿州")
+
+    def test_markdown_parsed_once_for_all_views(self):
+        # 各解析函数共享同一份文档模型，同一内容只切分一次。
+        md = _sample_markdown()
+        md_document._DOCUMENTS.clear()
+        with mock.patch.object(md_document.MdDocument, "parse", wraps=md_document.MdDocument.parse) as parse:
+            metrics = story_map._collect_quality_metrics(md)
+            story_map._validate_data_quality(md)
+            story_map._extract_intro_fields(md)
+            map_client.extract_places_in_order(md)
+            map_client.compute_total_distance_km(md)
+        self.assertEqual(parse.call_count, 1)
+        self.assertEqual(metrics["locations"], 2)
+        self.assertEqual(metrics["coords"], 2)
+        doc = md_document.parse_markdown(md)
+        self.assertEqual(doc.first_table(lambda t: "地点坐标" in t).rows[0], ("西安", "34.34", "108.94"))
+        basic = next(doc.subsections(lambda t: "人物档案" in t, lambda t: "基本信息" in t))
+        self.assertIn(("朝代", "唐"), basic.fields)
+
+    def test_stream_parser_matches_whole_document(self):
+        # 任意切分喂入的结果与整篇解析一致，且表格行在整篇结束前即已产出。
+        md = _sample_markdown()
+        parser = md_document.MdStreamParser()
+        items = []
+        first_row_at = None
+        for i in range(0, len(md), 7):
+            items.extend(parser.feed(md[i:i + 7]))
+            if first_row_at is None and any(isinstance(it, md_document.MdTableRow) for _, it in items):
+                first_row_at = i
+        items.extend(parser.close())
+        doc = md_document.MdDocument.parse(md)
+        subs = [(sec.title, sub) for sec in doc.sections for sub in sec.subsections]
+        rows = [(sec.title, md_document.MdTableRow(t.header, r)) for sec in doc.sections for t in sec.tables for r in t.rows]
+        self.assertEqual([it for it in items if isinstance(it[1], md_document.MdSubsection)], subs)
+        self.assertEqual([it for it in items if isinstance(it[1], md_document.MdTableRow)], rows)
+        self.assertIsNotNone(first_row_at)
+        self.assertLess(first_row_at, len(md) - 7)
+
+    def test_stream_prefetch_warms_locations(self):
+        # 地点小节到达即本地拆解并地理编码，不走 LLM；没有“现称”列的表格行不参与。
+        md = _sample_markdown()
+        geocoded = []
+        with mock.patch.object(story_map, "_split_ancient_modern", side_effect=AssertionError("llm split")), \
+                mock.patch.object(story_map, "split_place_text", side_effect=lambda t: ("", t)), \
+                mock.patch.object(story_map, "geocode_many", side_effect=lambda names: geocoded.extend(names) or {}):
+            prefetch = story_map._StreamPrefetcher()
+            for i in range(0, len(md), 11):
+                prefetch.feed(md[i:i + 11])
+            prefetch.finish()
+        self.assertEqual(sorted(geocoded), ["成都", "长安"])
+        self.assertEqual(prefetch.count, 2)
+        # 本地拆不开的地点不预取原文
+        geocoded.clear()
+        with mock.patch.object(story_map, "split_place_text", return_value=None), \
+                mock.patch.object(story_map, "geocode_many", side_effect=lambda names: geocoded.extend(names) or {}):
+            prefetch = story_map._StreamPrefetcher()
+            prefetch.feed(md)
+            prefetch.finish()
+        self.assertEqual(geocoded, [])
+
+    def test_think_stream_against_local_endpoint(self):
+        # 用本地 HTTP 服务代替 Qveris：SSE 按段产出，普通 JSON 整体产出一段。
+        deltas = ["## 一、", "人物档案\n", "### 基本信息\n"]
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if body["parameters"].get("stream"):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.end_headers()
+                    for d in deltas:
+                        event = {"choices": [{"delta": {"content": d}}]}
+                        self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.write(b"data: [DONE]\n\n")
+                else:
+                    payload = {"success": True, "result": {"data": {"choices": [{"message": {"content": "整段"}}]}}}
+                    raw = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(raw)))
+                    self.end_headers()
+                    self.wfile.write(raw)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        client = story_agents.StoryAgentLLM(
+            model="m", apiKey="k", baseUrl=f"http://127.0.0.1:{server.server_port}", session=story_agents.requests.Session()
+        )
+        messages = [{"role": "user", "content": "hi"}]
+        self.assertEqual(list(client.think_stream(messages)), deltas)
+        self.assertEqual(client.think(messages), "整段")
+        received = []
+        with mock.patch.object(story_agents, "_read_prompt", return_value="sys"):
+            md = story_agents.generate_historical_markdown(client, "张飞", use_cache=False, on_chunk=received.append)
+        self.assertEqual(received, deltas)
+        self.assertEqual(md, "".join(deltas))
+
+    def test_async_client_multiplexes_requests(self):
+        # 异步客户端与同步包装对同一本地服务并发请求，结果与输入顺序一致，失败按同样策略重试。
+        import asyncio
+
+        failures = {"left": 1}
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if failures["left"] and body["parameters"]["messages"][0]["content"] == "retry":
+                    failures["left"] -= 1
+                    self.send_response(503)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                content = "回复" + body["parameters"]["messages"][0]["content"]
+                payload = {"success": True, "result": {"data": {"choices": [{"message": {"content": content}}]}}}
+                raw = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        kwargs = {"model": "m", "apiKey": "k", "baseUrl": f"http://127.0.0.1:{server.server_port}"}
+        events = []
+
+        async def run():
+            async with story_agents.AsyncStoryAgentLLM(event_callback=events.append, **kwargs) as client:
+                return await asyncio.gather(
+                    *(client.think([{"role": "user", "content": str(i)}]) for i in range(20)),
+                    client.think([{"role": "user", "content": "retry"}]),
+                )
+
+        real_sleep = asyncio.sleep
+
+        async def no_wait(_seconds):
+            await real_sleep(0)
+
+        with mock.patch.object(story_agents.asyncio, "sleep", no_wait):
+            results = asyncio.run(run())
+        self.assertEqual(results, [f"回复{i}" for i in range(20)] + ["回复retry"])
+        self.assertEqual(events.count("✅ 大语言模型响应成功"), 21)
+        sync_client = story_agents.StoryAgentLLM(**kwargs)
+        batches = [[{"role": "user", "content": c}] for c in "甲乙丙"]
+        self.assertEqual(sync_client.think_many(batches), ["回复甲", "回复乙", "回复丙"])
+
+    def test_governor_prefers_interactive_lane(self):
+        # 名额被占满时，后到的前端代理请求先于排队中的批量拆解获准；排队耗时计入通道统计。
+        import time
+
+        gov = llm_governor.LlmGovernor(max_in_flight=1)
+        holder = gov.acquire(llm_governor.GENERATE)
+        order = []
+
+        def worker(lane):
+            ticket = gov.acquire(lane)
+            order.append(lane)
+            gov.release(ticket)
+
+        threads = []
+        for lane in (llm_governor.BATCH, llm_governor.INTERACTIVE):
+            thread = threading.Thread(target=worker, args=(lane,))
+            thread.start()
+            threads.append(thread)
+            while gov.snapshot()["lanes"][lane]["queued"] == 0:
+                time.sleep(0.005)
+        time.sleep(0.05)
+        gov.release(holder)
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(order, [llm_governor.INTERACTIVE, llm_governor.BATCH])
+        snap = gov.snapshot()
+        self.assertEqual(snap["in_flight"], 0)
+        self.assertEqual(snap["lanes"]["batch"]["calls"], 1)
+        self.assertGreaterEqual(snap["lanes"]["batch"]["wait_max_ms"], 50)
+
+    def test_governor_token_budget_and_timeout(self):
+        # 窗口内预算用尽时排队，超时抛出 LlmQueueTimeout；窗口滑过后放行。
+        gov = llm_governor.LlmGovernor(max_in_flight=4, tokens_per_minute=100, window=0.3)
+        first = gov.acquire(tokens=80)
+        with self.assertRaises(llm_governor.LlmQueueTimeout):
+            gov.acquire(tokens=50, max_wait=0.05)
+        gov.release(first, used_tokens=90)
+        second = gov.acquire(tokens=50, max_wait=3)
+        self.assertGreater(second.wait, 0.1)
+        gov.release(second)
+        snap = gov.snapshot()
+        self.assertEqual(snap["lanes"]["generate"]["timeouts"], 1)
+        self.assertEqual(snap["lanes"]["generate"]["tokens"], 140)
+
+    def test_governor_release_does_not_overspend_after_expiry(self):
+        # 实际用量少于预扣时原地修正；预扣过期后窗口用量不会变成负数而连续超发。
+        gov = llm_governor.LlmGovernor(max_in_flight=8, tokens_per_minute=1000, window=0.3)
+        ticket = gov.acquire(tokens=1000)
+        time.sleep(0.15)
+        gov.release(ticket, used_tokens=100)
+        self.assertEqual(gov.snapshot()["tokens_in_window"], 100)
+        time.sleep(0.2)
+        gov.acquire(tokens=600, max_wait=0)
+        with self.assertRaises(llm_governor.LlmQueueTimeout):
+            gov.acquire(tokens=600, max_wait=0)
+        self.assertEqual(gov.snapshot()["tokens_in_window"], 600)
+
+    def test_governor_async_waiters_share_limit(self):
+        # 协程排队不占线程，在途数不超过上限；取消等待中的协程不会泄漏名额。
+        import asyncio
+
+        gov = llm_governor.LlmGovernor(max_in_flight=2)
+        state = {"active": 0, "peak": 0}
+
+        async def call():
+            ticket = await gov.acquire_async(llm_governor.BATCH)
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+            await asyncio.sleep(0.01)
+            state["active"] -= 1
+            gov.release(ticket)
+
+        async def run():
+            await asyncio.gather(*(call() for _ in range(20)))
+            holders = [gov.acquire(), gov.acquire()]
+            waiting = asyncio.ensure_future(gov.acquire_async())
+            await asyncio.sleep(0.01)
+            waiting.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiting
+            for ticket in holders:
+                gov.release(ticket)
+
+        asyncio.run(run())
+        self.assertEqual(state["peak"], 2)
+        snap = gov.snapshot()
+        self.assertEqual(snap["in_flight"], 0)
+        self.assertEqual(snap["lanes"]["batch"]["calls"], 20)
+
+    def test_rate_limited_response_pauses_governor(self):
+        # 上游 429 时按 Retry-After 暂停全部通道，重试等待不短于该值。
+        response = story_agents.requests.Response()
+        response.status_code = 429
+        response.headers["Retry-After"] = "2"
+        error = story_agents.requests.HTTPError(response=response)
+        self.assertEqual(story_agents._retry_after(error), 2.0)
+        self.assertIsNone(story_agents._retry_after(RuntimeError("boom")))
+        gov = llm_governor.LlmGovernor()
+        client = story_agents.StoryAgentLLM(model="m", apiKey="k", baseUrl="https://llm.example")
+        with mock.patch.object(story_agents, "get_governor", return_value=gov):
+            self.assertGreaterEqual(client._retry_wait(1, error), 2.0)
+        self.assertGreater(gov.snapshot()["paused_for"], 1.5)
+
+    def test_profile_memoized_by_markdown_digest(self):
+        # 同一 Markdown 再次构建直接命中缓存；进程内缓存清空后由 SQLite 恢复。
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        store = cache_store.ProfileStore(os.path.join(tmp.name, "profile.sqlite3"))
+        self.addCleanup(store.close)
+        profile = _sample_profile()
+        profile["mapStyle"] = {}
+        compose = mock.Mock(return_value=(profile, True))
+        md = _sample_markdown()
+        with mock.patch.object(story_map, "_PROFILE_STORE", store), \
+                mock.patch.dict(story_map._PROFILE_CACHE, clear=True), \
+                mock.patch.object(story_map, "_compose_profile_data", compose):
+            first = story_map._build_profile_data(md)
+            first["markdown"] = md
+            second = story_map._build_profile_data(md)
+            story_map._PROFILE_CACHE.clear()
+            third = story_map._build_profile_data(md)
+        compose.assert_called_once()
+        self.assertNotIn("markdown", second)
+        self.assertEqual(second, third)
+        self.assertEqual(third["person"]["name"], "李白")
+
+    def test_store_prunes_on_schedule_not_every_write(self):
+        # 超量清理按写入周期执行：周期内允许短暂超出，到期后裁剪到上限并保留最新记录。
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        store = cache_store.LlmResponseStore(os.path.join(tmp.name, "llm.sqlite3"))
+        self.addCleanup(store.close)
+        store._PRUNE_EVERY = 3
+        with mock.patch.object(store, "_trim", wraps=store._trim) as trim:
+            for i in range(4):
+                with mock.patch.object(cache_store.time, "time", return_value=1000.0 + i):
+                    store.put(f"k{i}", "v", max_rows=2)
+                if i == 2:
+                    self.assertEqual(store.get("k0"), "v")
+        self.assertEqual(trim.call_count, 2)
+        self.assertIsNone(store.get("k0"))
+        self.assertIsNone(store.get("k1"))
+        self.assertEqual(store.get("k3"), "v")
+
+    def test_ai_proxy_uses_response_cache_unless_disabled(self):
+        # 前端代理请求默认走响应缓存；no_cache / cache: false 时绕过。
+        import urllib.request
+
+        client = mock.Mock()
+        client.think.return_value = "好"
+        server = ThreadingHTTPServer(("127.0.0.1", 0), story_map.StoryMapServerHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f"http://127.0.0.1:{server.server_port}/api/ai/proxy"
+        messages = [{"role": "user", "content": "你好"}]
+        with mock.patch.object(story_map, "_get_llm_client", return_value=client):
+            for extra in ({}, {"no_cache": True}, {"cache": False}):
+                body = json.dumps({"messages": messages, **extra}).encode("utf-8")
+                req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+                with urllib.request.urlopen(req, timeout=5) as resp:
+                    self.assertEqual(json.loads(resp.read())["choices"][0]["message"]["content"], "好")
+        self.assertEqual([c.kwargs["cache"] for c in client.think.call_args_list], [True, False, False])
+
+    def test_profile_digest_tracks_split_and_coordinate_versions(self):
+        # 更换拆解模型或地名库后，同一 Markdown 的人物页缓存键随之变化。
+        md = _sample_markdown()
+        with mock.patch.dict(os.environ, {"LLM_MODEL_ID": "model-a"}):
+            base = story_map._profile_digest(md)
+            self.assertEqual(story_map._profile_digest(md), base)
+            with mock.patch.object(story_map, "geocode_data_version", return_value="gcj02:other"):
+                self.assertNotEqual(story_map._profile_digest(md), base)
+        with mock.patch.dict(os.environ, {"LLM_MODEL_ID": "model-b"}):
+            self.assertNotEqual(story_map._profile_digest(md), base)
+
+    def test_incomplete_profile_not_memoized(self):
+        # 有地点未取得坐标时不缓存，下次构建会重新尝试地理编码。
+        compose = mock.Mock(return_value=(_sample_profile(), False))
+        with mock.patch.object(story_map, "_PROFILE_STORE", mock.Mock()) as store, \
+                mock.patch.dict(story_map._PROFILE_CACHE, clear=True), \
+                mock.patch.object(story_map, "_compose_profile_data", compose):
+            store.get.return_value = None
+            story_map._build_profile_data(_sample_markdown())
+            story_map._build_profile_data(_sample_markdown())
+        self.assertEqual(compose.call_count, 2)
+        store.put.assert_not_called()
+
+    def test_local_place_split(self):
+        split = place_split.split_place_text
+        self.assertEqual(split("河东郡解县（今山西省运城市盐湖区）"), ("河东郡解县", "山西省运城市盐湖区"))
+        self.assertEqual(split("荆州（今湖北省荆州市及周边地区）"), ("荆州", "湖北省荆州市"))
+        self.assertEqual(split("涿郡涿县，今河北省涿州市"), ("涿郡涿县", "河北省涿州市"))
+        self.assertEqual(split("今河北省涿州市）"), ("", "河北省涿州市"))
+        self.assertEqual(split("长安"), ("长安", "陕西省西安市"))
+        # 今称对应多个地点、或地名库无法完整识别时交给模型
+        self.assertIsNone(split("益州（今四川省及重庆市一带）"))
+        self.assertIsNone(split("某某古渡"))
+        # “和/与”作地名用字时照常拆解，两侧都是地名时才视为并列
+        self.assertEqual(split("于阗（今新疆和田市）"), ("于阗", "新疆和田市"))
+        self.assertEqual(split("历阳（今安徽省和县）"), ("历阳", "安徽省和县"))
+        self.assertEqual(split("今天津市和平区"), ("", "天津市和平区"))
+        self.assertIsNone(split("襄樊（今湖北省襄阳市和宜昌市）"))
+        self.assertIsNone(split("边地（今陕西省与甘肃省）"))
+        # 今称带异说或分句时不能当作单个地点
+        self.assertIsNone(split("徐州（今江苏徐州，一说山东郯城）"))
+        self.assertIsNone(split("某地（今甲市；一说乙市）"))
+
+    def _split_store(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        store = cache_store.SplitStore(os.path.join(tmp.name, "split.sqlite3"))
+        self.addCleanup(store.close)
+        return store
+
+    def test_split_results_persist_per_model_and_prompt(self):
+        # 模型拆解结果落盘，重启（进程内缓存清空）后直接预热；更换模型后不读取旧结果，但也不删除。
+        client = mock.Mock()
+        client.think.return_value = '[{"text": "某某古渡", "ancient": "某某古渡", "modern": "湖北省某市"}]'
+        store = self._split_store()
+        with mock.patch.dict(story_map._SPLIT_CACHE, clear=True), \
+                mock.patch.object(story_map, "_SPLIT_STORE", store), \
+                mock.patch.object(story_map, "_SPLIT_LOADED", None), \
+                mock.patch.object(story_map, "_get_llm_client", return_value=client), \
+                mock.patch.dict(os.environ, {"LLM_MODEL_ID": "model-a"}):
+            story_map._batch_split_ancient_modern(["某某古渡"])
+            story_map._SPLIT_CACHE.clear()
+            story_map._SPLIT_LOADED = None
+            again = story_map._batch_split_ancient_modern(["某某古渡"])
+            self.assertEqual(client.think.call_count, 1)
+            self.assertEqual(again["某某古渡"], ("某某古渡", "湖北省某市"))
+            with mock.patch.dict(os.environ, {"LLM_MODEL_ID": "model-b"}):
+                story_map._batch_split_ancient_modern(["某某古渡"])
+        self.assertEqual(client.think.call_count, 2)
+        self.assertIn("某某古渡", store.load("model-a", story_map._SPLIT_PROMPT_VERSION))
+        self.assertIn("某某古渡", store.load("model-b", story_map._SPLIT_PROMPT_VERSION))
+
+    def test_split_reads_through_to_store_on_cache_miss(self):
+        # 预热之后由其他进程写入（或被 LRU 淘汰）的拆解结果，从持久化库回查，不再交给模型。
+        client = mock.Mock()
+        store = self._split_store()
+        with mock.patch.dict(os.environ, {"LLM_MODEL_ID": "model-a"}), \
+                mock.patch.object(story_map, "_SPLIT_STORE", store), \
+                mock.patch.object(story_map, "_SPLIT_LOADED", story_map._split_scope()), \
+                mock.patch.object(story_map, "_get_llm_client", return_value=client):
+            key = story_map._split_key("某某古渡")
+            store.put_many({key: ("某某古渡", "湖北省某市")}, *story_map._split_scope())
+            result = story_map._batch_split_ancient_modern(["某某古渡"])
+            self.assertEqual(story_map._split_ancient_modern("某某古渡"), ("某某古渡", "湖北省某市"))
+        client.think.assert_not_called()
+        self.assertEqual(result["某某古渡"], ("某某古渡", "湖北省某市"))
+
+    def test_split_store_purges_only_old_rows_of_other_scopes(self):
+        # 只清理其他模型/提示词版本中长期未写入的记录，当前版本与近期记录保留。
+        store = self._split_store()
+        with mock.patch.object(cache_store.time, "time", return_value=time.time() - 100):
+            store.put_many({"甲": ("甲", "甲市")}, "old", "p1")
+            store.put_many({"乙": ("乙", "乙市")}, "cur", "p1")
+        store.put_many({"丙": ("丙", "丙市")}, "other", "p1")
+        self.assertEqual(store.purge_stale("cur", "p1", max_age=50), 1)
+        self.assertEqual(store.load("old", "p1"), {})
+        self.assertIn("乙", store.load("cur", "p1"))
+        self.assertIn("丙", store.load("other", "p1"))
+        self.assertEqual(store.purge_stale("cur", "p1", max_age=0), 0)
+
+    def test_batch_split_dispatches_chunks_concurrently(self):
+        # 多个分块并发请求模型，返回顺序与输入一致。
+        import json
+        import threading
+        import time
+
+        state = {"active": 0, "peak": 0}
+        lock = threading.Lock()
+
+        def fake_think(messages, temperature=0, lane=None):
+            chunk = json.loads(messages[1]["content"].split("：", 1)[1])
+            with lock:
+                state["active"] += 1
+                state["peak"] = max(state["peak"], state["active"])
+            time.sleep(0.1)
+            with lock:
+                state["active"] -= 1
+            return json.dumps([{"text": t, "ancient": t, "modern": f"今{t}"} for t in chunk], ensure_ascii=False)
+
+        client = mock.Mock()
+        client.think.side_effect = fake_think
+        texts = [f"无名古渡{i}" for i in range(50)]
+        with mock.patch.dict(story_map._SPLIT_CACHE, clear=True), \
+                mock.patch.object(story_map, "_SPLIT_STORE", self._split_store()), \
+                mock.patch.object(story_map, "_SPLIT_LOADED", None), \
+                mock.patch.object(story_map, "_get_llm_client", return_value=client):
+            result = story_map._batch_split_ancient_modern(texts)
+        self.assertEqual(client.think.call_count, 3)
+        self.assertGreater(state["peak"], 1)
+        self.assertEqual(list(result), texts)
+        self.assertEqual(result["无名古渡7"], ("无名古渡7", "今无名古渡7"))
+
+    def test_batch_split_sends_only_ambiguous_texts_to_llm(self):
+        client = mock.Mock()
+        client.think.return_value = '[{"text": "益州（今四川省及重庆市一带）", "ancient": "益州", "modern": "四川省成都市"}]'
+        texts = ["麦城（今湖北省当阳市）", "白帝城（今重庆市奉节县）", "益州（今四川省及重庆市一带）"]
+        before = story_map.split_stats()
+        store = self._split_store()
+        with mock.patch.dict(story_map._SPLIT_CACHE, clear=True), \
+                mock.patch.object(story_map, "_SPLIT_STORE", store), \
+                mock.patch.object(story_map, "_SPLIT_LOADED", None), \
+                mock.patch.object(story_map, "_get_llm_client", return_value=client):
+            result = story_map._batch_split_ancient_modern(texts)
+        client.think.assert_called_once()
+        prompt = client.think.call_args[0][0][1]["content"]
+        self.assertNotIn("麦城", prompt)
+        self.assertEqual(result["麦城（今湖北省当阳市）"], ("麦城", "湖北省当阳市"))
+        self.assertEqual(result["益州（今四川省及重庆市一带）"], ("益州", "四川省成都市"))
+        after = story_map.split_stats()
+        self.assertEqual(after["local"] - before["local"], 2)
+        self.assertEqual(after["llm"] - before["llm"], 1)
+
+    def test_llm_clients_share_pooled_session(self):
+        # 单例客户端与带回调的任务客户端共用同一个连接池会话。
+        kwargs = {"model": "m", "apiKey": "k", "baseUrl": "https://llm.example"}
+        first = story_agents.StoryAgentLLM(**kwargs)
+        second = story_agents.StoryAgentLLM(event_callback=lambda _msg: None, **kwargs)
+        self.assertIs(first.session, second.session)
+        self.assertIs(first.session, story_agents.get_llm_session())
+        resp = mock.Mock()
+        resp.json.return_value = {"success": True, "result": {"data": {"choices": [{"message": {"content": "好"}}]}}}
+        with mock.patch.object(first.session, "post", return_value=resp) as post, \
+                mock.patch("requests.post") as module_post:
+            self.assertEqual(second.think([{"role": "user", "content": "hi"}]), "好")
+        post.assert_called_once()
+        module_post.assert_not_called()
+
+    def test_llm_response_cache_reuses_identical_requests(self):
+        # 相同请求第二次直接命中缓存；内存层清空后从落盘层恢复；cache=False 时绕过缓存。
+        client = story_agents.StoryAgentLLM(model="m", apiKey="k", baseUrl="https://llm.example")
+        resp = mock.Mock()
+        resp.json.return_value = {"success": True, "result": {"data": {"choices": [{"message": {"content": "好"}}]}}}
+        messages = [{"role": "user", "content": "hi"}]
+        responses = story_agents.BoundedCache("llm_response_test", 8)
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(story_agents, "_LLM_CACHE_ENABLED", True), \
+                mock.patch.object(story_agents, "_LLM_RESPONSES", responses), \
+                mock.patch.object(
+                    story_agents, "_LLM_RESPONSE_STORE",
+                    cache_store.LlmResponseStore(os.path.join(tmp, "llm.sqlite3")),
+                ), \
+                mock.patch.object(client.session, "post", return_value=resp) as post:
+            self.assertEqual(client.think(messages, cache=True), "好")
+            self.assertEqual(client.think(messages, cache=True), "好")
+            self.assertEqual(post.call_count, 1)
+            responses.clear()
+            self.assertEqual(client.think(messages, cache=True), "好")
+            self.assertEqual(post.call_count, 1)
+            client.think(messages, temperature=0.5, cache=True)
+            client.think(messages, cache=False)
+            self.assertEqual(post.call_count, 3)
+            story_agents._LLM_RESPONSE_STORE.close()
+
+    def test_build_points_geocodes_in_one_batch(self):
+        # 点位构建应一次性批量编码，而不是逐个地名串行调用。
+        places = [{"modern": "西安", "ancient": "长安"}, {"modern": "", "ancient": "江陵"}, {"modern": "无解"}]
+        events = [{"era": "天宝元年", "ad": "742年", "desc": "入西安"}]
+        fake = mock.Mock(return_value={"西安": (34.34, 108.94), "江陵": (30.35, 112.19)})
+        with mock.patch.object(story_map, "geocode_many", fake):
+            pts = story_map.build_points(places, events)
+        fake.assert_called_once_with(["西安", "江陵", "无解"])
+        self.assertEqual([p["name"] for p in pts], ["西安", "江陵"])
+        self.assertIn("入西安", pts[0]["md"])
+
     def test_render_profile_html_output(self):
         def fake_batch(texts: list[str], event_callback=None):
             _ = event_callback
@@ -138,6 +812,26 @@ class StoryMapUtilsTest(unittest.TestCase):
         self.assertIn("李白", html)
         self.assertNotIn("__DATA__", html)
 
+    def test_warm_geocode_cache_loads_coordinate_tables(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        md = "# 测试\n## 地点坐标（自动地理编码）\n| 现称 | 纬度 | 经度 |\n| --- | --- | --- |\n| 预热古城 | 31.500000 | 112.500000 |\n"
+        with open(os.path.join(tmp.name, "测试.md"), "w", encoding="utf-8") as f:
+            f.write(md)
+        store = cache_store.GeocodeStore(os.path.join(tmp.name, "geocode.sqlite3"))
+        self.addCleanup(store.close)
+        with mock.patch.object(map_client, "_GEOCODE_STORE", store), \
+                mock.patch.dict(map_client._GEOCODE_CACHE, clear=True):
+            first = story_map.warm_geocode_cache([tmp.name])
+            again = story_map.warm_geocode_cache([tmp.name])
+            with mock.patch.object(map_client, "_geocode_public") as fake:
+                coord = map_client.geocode_city("预热古城")
+        fake.assert_not_called()
+        self.assertEqual(first, {"files": 1, "places": 1, "loaded": 1})
+        self.assertEqual(again["loaded"], 0)
+        self.assertEqual(coord, (31.5, 112.5))
+        self.assertEqual(store.get("预热古城")["provider"], "markdown")
+
 
 if __name__ == "__main__":
     unittest.main()